@@ -0,0 +1,146 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import miniaudio  # noqa: E402
+import numpy  # noqa: E402
+
+from eternal_radio_player import __version__  # noqa: E402
+from eternal_radio_player.decoder import StreamDecoder  # noqa: E402
+from eternal_radio_player.dsp import GainRamp  # noqa: E402
+from eternal_radio_player.stream import StreamSource, probe_stream_format  # noqa: E402
+
+
+# Decodes a local MP3 or Ogg Vorbis file through StreamDecoder and the gain stage of the stream
+# callback as fast as possible, for each output path the player can negotiate, and reports the
+# CPU time per minute of audio. Float paths can also be charged for the conversion to int16 a
+# 16-bit device does, emulated with numpy, since PortAudio does it outside of the player.
+
+CHUNK_SIZE = 16 * 1024
+
+
+def get_paths(sample_rate, channels, device_rate):
+    # (name, output sample rate, channels, sample format, dither), the first one is how every
+    # stream was decoded before format negotiation when the device rate differs
+    return [
+        ('float32-stereo-resampled-dither', device_rate, 2, 'float32', 'triangle'),
+        ('float32-stereo', sample_rate, 2, 'float32', 'none'),
+        ('float32-native', sample_rate, channels, 'float32', 'none'),
+        ('int16-resampled', device_rate, channels, 'int16', 'none'),
+        ('int16-resampled-dither', device_rate, channels, 'int16', 'triangle'),
+        ('int16-native', sample_rate, channels, 'int16', 'none')
+    ]
+
+
+def create_source(data):
+    # All the data is queued up front, so the decoder never waits for the network
+    source = StreamSource({}, prebuffer_size=1, low_watermark=1, high_watermark=len(data) + 1)
+    for i in range(0, len(data), CHUNK_SIZE):
+        source.write(data[i:i + CHUNK_SIZE])
+    source.finish()
+    return source
+
+
+def get_duration(data, encoding):
+    if encoding == miniaudio.FileFormat.VORBIS:
+        return miniaudio.vorbis_get_info(data).duration
+    return miniaudio.mp3_get_info(data).duration
+
+
+def run_path(data, encoding, duration, path, args):
+    # The whole file is decoded into the ring buffer first, then read in blocks like the stream
+    # callback does, so neither stage waits for the other while it's measured
+    _name, sample_rate, channels, sample_format, dither = path
+    decoder = StreamDecoder(
+        create_source(data),
+        encoding,
+        sample_rate,
+        channels=channels,
+        sample_format=sample_format,
+        dither=dither,
+        frames_to_read=args.blocksize,
+        decode_ahead_time=duration + 1.0
+    )
+    cpu_started = time.process_time()
+    decoder.start()
+    while not decoder.finished:
+        time.sleep(0.01)
+    decoder_time = time.process_time() - cpu_started
+    decoder.stop()
+    if decoder.error:
+        raise decoder.error
+
+    output = numpy.zeros((args.blocksize, channels), sample_format)
+    device_output = numpy.zeros((args.blocksize, channels), numpy.int16)
+    gain_ramp = GainRamp(args.blocksize, args.volume)
+    convert = args.device_conversion and sample_format == 'float32'
+    frames = decoder.buffer.available
+    cpu_started = time.process_time()
+    while decoder.buffer.read_into(output):
+        gain_ramp.apply(output)
+        if convert:
+            numpy.clip(output, -1.0, 1.0, out=output)
+            numpy.multiply(output, 32767, out=device_output, casting='unsafe')
+    callback_time = time.process_time() - cpu_started
+    minutes = frames / sample_rate / 60
+    return {
+        'audio_minutes': minutes,
+        'cpu_ms_per_audio_minute': (decoder_time + callback_time) / minutes * 1000,
+        'decoder_cpu_ms_per_audio_minute': decoder_time / minutes * 1000,
+        'callback_cpu_ms_per_audio_minute': callback_time / minutes * 1000
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('file', help='MP3 or Ogg Vorbis file to decode')
+    parser.add_argument('--device-rate', type=int, default=48000, help='Sample rate of the resampled paths')
+    parser.add_argument('--blocksize', type=int, default=4 * 1024, help='Frames per decoded block')
+    parser.add_argument('--volume', type=float, default=1.0, help='Gain applied to every block')
+    parser.add_argument('--device-conversion', action='store_true', help='Convert float paths to int16')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per path, the fastest is reported')
+    parser.add_argument('--output', help='Save the results to this JSON file')
+    args = parser.parse_args()
+
+    with open(args.file, 'rb') as f:
+        data = f.read()
+    encoding = miniaudio.FileFormat.VORBIS if data[:4] == b'OggS' else miniaudio.FileFormat.MP3
+    stream_format = probe_stream_format(data[:64 * 1024], encoding)
+    if stream_format is None:
+        parser.error(f"Could not read the stream format of '{args.file}'")
+    sample_rate, channels = stream_format
+    duration = get_duration(data, encoding)
+    print(f'{args.file}: {encoding.name}, {sample_rate} Hz, {channels} channels')
+
+    paths = {}
+    for path in get_paths(sample_rate, channels, args.device_rate):
+        runs = [run_path(data, encoding, duration, path, args) for _ in range(args.repeat)]
+        result = min(runs, key=lambda run: run['cpu_ms_per_audio_minute'])
+        paths[path[0]] = result
+        print(
+            f"{path[0]:33} {result['cpu_ms_per_audio_minute']:8.1f} ms CPU per audio minute "
+            f"(decoder {result['decoder_cpu_ms_per_audio_minute']:.1f}, "
+            f"callback {result['callback_cpu_ms_per_audio_minute']:.1f})"
+        )
+
+    if args.output:
+        results = {
+            'version': __version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'settings': vars(args),
+            'stream': {'encoding': encoding.name, 'sample_rate': sample_rate, 'channels': channels},
+            'paths': paths
+        }
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
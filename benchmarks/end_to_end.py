@@ -0,0 +1,191 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from eternal_radio_player import __version__  # noqa: E402
+from eternal_radio_player.feed import RecentSongsCache  # noqa: E402
+from eternal_radio_player.player import RadioPlayer  # noqa: E402
+from eternal_radio_player.sinks import NullSink, OUTPUT_SINKS  # noqa: E402
+from radio_server import add_condition_arguments, conditions_from_args, run_server  # noqa: E402
+
+
+# Plays from the local stand-in radio server in radio_server.py, running in a separate process so
+# its CPU time and memory aren't counted, through the real-time null output sink. Reports time to
+# first audio, callback duration percentiles, underflows, CPU time per minute of audio and peak
+# RSS, and saves them as JSON. With --compare, the results are printed next to the ones from an
+# earlier run.
+
+
+class TimingNullSink(NullSink):
+
+    # The real-time null sink, timing each callback and noting when the first audio comes out
+
+    name = 'benchmark-null'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.callback_times = []
+        self.frames = 0
+        self.first_audio_time = None
+        callback = self._callback
+
+        def timed_callback(output, frames, time_, status):
+            started = time.perf_counter()
+            try:
+                callback(output, frames, time_, status)
+            finally:
+                finished = time.perf_counter()
+                self.callback_times.append(finished - started)
+            self.frames += frames
+            if self.first_audio_time is None and output.any():
+                self.first_audio_time = finished
+
+        self._callback = timed_callback
+
+
+OUTPUT_SINKS[TimingNullSink.name] = TimingNullSink
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def run(stream_url, recent_songs_url, args):
+    player = RadioPlayer(
+        request_timeout=args.timeout,
+        reconnect_attempts=args.reconnect_attempts,
+        stream_url=stream_url,
+        output_sink=TimingNullSink.name
+    )
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    player.play()
+    output_stream = player._output_stream
+    time.sleep(args.duration)
+    player.stop()
+    cpu_time = time.process_time() - cpu_started
+
+    feed_started = time.perf_counter()
+    recent_songs = RecentSongsCache(recent_songs_url).get(args.timeout)
+    feed_time = time.perf_counter() - feed_started
+
+    callback_times = output_stream.callback_times
+    audio_time = output_stream.frames / output_stream.samplerate
+    stats = player.get_stats()
+    return {
+        'time_to_first_audio': (
+            output_stream.first_audio_time - started if output_stream.first_audio_time else None
+        ),
+        'callback_p50_ms': percentile(callback_times, 50) * 1000,
+        'callback_p95_ms': percentile(callback_times, 95) * 1000,
+        'callback_p99_ms': percentile(callback_times, 99) * 1000,
+        'callback_max_ms': max(callback_times) * 1000,
+        'underflows': stats['underflows'],
+        'silence_time': player._silence_frames / output_stream.samplerate,
+        'decoder_errors': stats['decoder_errors'],
+        'reconnects': stats['reconnects'],
+        'total_reconnect_gap': stats['total_reconnect_gap'],
+        'audio_time': audio_time,
+        'cpu_time_per_audio_minute': cpu_time / audio_time * 60 if audio_time else None,
+        'recent_songs_fetch_time': feed_time,
+        'recent_songs_count': len(recent_songs)
+    }
+
+
+def summarize(runs):
+    summary = {}
+    for key in runs[0]:
+        values = [r[key] for r in runs if r[key] is not None]
+        summary[key] = statistics.median(values) if values else None
+    summary['peak_rss_mb'] = peak_rss_mb()
+    return summary
+
+
+def print_results(summary, previous=None):
+    for key, value in summary.items():
+        line = f'{key}: {value:.4g}' if isinstance(value, float) else f'{key}: {value}'
+        old_value = previous.get(key) if previous else None
+        if isinstance(value, (int, float)) and isinstance(old_value, (int, float)):
+            line += f' (was {old_value:.4g}'
+            if old_value:
+                line += f', {(value - old_value) / old_value * 100:+.1f}%'
+            line += ')'
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('file', help='MP3 or Ogg Vorbis file looped by the server')
+    parser.add_argument('--format', choices=('mp3', 'ogg'), default='mp3', help='Format of the file')
+    parser.add_argument('--duration', type=float, default=30.0, help='Playback time per run in seconds')
+    parser.add_argument('--runs', type=int, default=3, help='Number of runs, results are the median')
+    parser.add_argument('--timeout', type=float, default=5.0, help='Request timeout')
+    parser.add_argument('--reconnect-attempts', type=int, default=10, help='Player reconnect attempts')
+    parser.add_argument('--output', help='Save the results to this JSON file')
+    parser.add_argument('--compare', help='Results JSON file of an earlier run to compare against')
+    add_condition_arguments(parser)
+    args = parser.parse_args()
+
+    address_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(
+        target=run_server,
+        args=(args.file, args.format, conditions_from_args(args)),
+        kwargs={'address_queue': address_queue},
+        daemon=True
+    )
+    server.start()
+    try:
+        stream_url, recent_songs_url = address_queue.get(timeout=10.0)
+        runs = []
+        for i in range(args.runs):
+            result = run(stream_url, recent_songs_url, args)
+            print(f"Run {i + 1}/{args.runs}: time to first audio {result['time_to_first_audio']}s")
+            runs.append(result)
+    finally:
+        server.terminate()
+        server.join()
+
+    summary = summarize(runs)
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['summary']
+    print_results(summary, previous)
+
+    if args.output:
+        results = {
+            'version': __version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'settings': vars(args),
+            'summary': summary,
+            'runs': runs
+        }
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
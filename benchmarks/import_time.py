@@ -0,0 +1,101 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+# Measures the module import time of the '--version', '--help' and CLI start paths with
+# 'python -X importtime' and fails if the median of any path is over its budget. Modules imported
+# by the interpreter startup itself are not counted.
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def run_importtime(args, stdin=None):
+    started = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', *args],
+        input=stdin,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        cwd=ROOT_DIR,
+        text=True
+    )
+    elapsed = time.perf_counter() - started
+    modules = {}
+    errors = []
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:'):
+            errors.append(line)
+            continue
+        parts = line.split('|')
+        try:
+            cumulative = int(parts[1])
+        except ValueError:
+            # Header line
+            continue
+        name = parts[2]
+        # Only the top level imports, nested ones are included in their cumulative time
+        if len(name) - len(name.lstrip()) == 1:
+            modules[name.strip()] = cumulative
+    if process.returncode != 0:
+        raise RuntimeError(f'Exited with code {process.returncode}:\n' + '\n'.join(errors[-10:]))
+    return modules, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5, help='Number of runs per path')
+    parser.add_argument('--version-budget', type=float, default=60.0, help='Import budget for --version in ms')
+    parser.add_argument('--help-budget', type=float, default=60.0, help='Import budget for --help in ms')
+    parser.add_argument('--cli-budget', type=float, default=500.0, help='Import budget for the CLI start in ms')
+    parser.add_argument('--top', type=int, default=5, help='Number of slowest top level imports to show')
+    args = parser.parse_args()
+
+    startup_modules, _ = run_importtime(['-c', 'pass'])
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cli_args = [
+            '-m', 'eternal_radio_player', '--cli',
+            '-C', os.path.join(temp_dir, 'config.json'),
+            '-l', os.path.join(temp_dir, 'eternal-radio-player.log')
+        ]
+        paths = (
+            ('--version', ['-m', 'eternal_radio_player', '--version'], None, args.version_budget),
+            ('--help', ['-m', 'eternal_radio_player', '--help'], None, args.help_budget),
+            ('CLI start', cli_args, 'quit\n', args.cli_budget)
+        )
+        over_budget = False
+        for name, path_args, stdin, budget in paths:
+            import_times = []
+            wall_times = []
+            try:
+                for _ in range(args.runs):
+                    modules, elapsed = run_importtime(path_args, stdin)
+                    modules = {k: v for k, v in modules.items() if k not in startup_modules}
+                    import_times.append(sum(modules.values()) / 1000)
+                    wall_times.append(elapsed * 1000)
+            except RuntimeError as e:
+                print(f'{name}: failed: {e}')
+                over_budget = True
+                continue
+            import_time = statistics.median(import_times)
+            status = 'OK' if import_time <= budget else 'OVER BUDGET'
+            over_budget = over_budget or import_time > budget
+            print(
+                f'{name}: imports {import_time:.1f} ms (budget {budget:.0f} ms) {status}, '
+                f'wall time {statistics.median(wall_times):.1f} ms'
+            )
+            slowest = sorted(modules.items(), key=lambda item: item[1], reverse=True)[:args.top]
+            for module, cumulative in slowest:
+                print(f'    {module}: {cumulative / 1000:.1f} ms')
+
+    if over_budget:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+import argparse
+import json
+import random
+import time
+import miniaudio
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Local stand-in for the radio station. Serves an audio file looped into an endless stream with
+# ICY headers and metadata at /stream.mp3 or /stream.ogg, and a recent songs feed in the format
+# of the station at /recentfeed.json. The network conditions of each stream connection can be
+# degraded with a bandwidth cap, jitter, periodic stalls and disconnects.
+
+ICY_METAINT = 16 * 1024
+SEND_CHUNK_SIZE = 4 * 1024
+RECENT_SONGS_COUNT = 10
+CONTENT_TYPES = {'mp3': 'audio/mpeg', 'ogg': 'audio/ogg'}
+
+
+def get_stream_info(data, stream_format):
+    if stream_format == 'mp3':
+        info = miniaudio.mp3_get_info(data)
+    else:
+        info = miniaudio.vorbis_get_info(data)
+    return {
+        'sample_rate': info.sample_rate,
+        'duration': info.duration,
+        'bitrate': int(len(data) * 8 / info.duration)
+    }
+
+
+def icy_metadata_block(title):
+    metadata = f"StreamTitle='{title}';".encode()
+    metadata += b'\0' * (-len(metadata) % 16)
+    return bytes((len(metadata) // 16,)) + metadata
+
+
+def song_title(loop):
+    # The feed appends an ID to titles, which the player strips
+    return f'Benchmark Song {loop}', f'Benchmark Song {loop} [{loop % 10000:04d}]'
+
+
+class StreamConditions:
+
+    # bandwidth: bytes per second after the initial burst, None for the real-time rate of the stream
+    # jitter: maximum random delay added to each chunk in seconds
+    # stall_every, stall_time: pause the connection for stall_time seconds every stall_every seconds
+    # disconnect_after: close the connection after this many seconds
+
+    def __init__(
+        self,
+        burst=64 * 1024,
+        bandwidth=None,
+        jitter=0.0,
+        stall_every=None,
+        stall_time=0.0,
+        disconnect_after=None,
+        seed=None
+    ):
+        self.burst = burst
+        self.bandwidth = bandwidth
+        self.jitter = jitter
+        self.stall_every = stall_every
+        self.stall_time = stall_time
+        self.disconnect_after = disconnect_after
+        self.seed = seed
+
+
+class RadioRequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.0'
+    server_version = 'BenchmarkRadio/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == f'/stream.{self.server.stream_format}':
+            self._send_stream()
+        elif self.path == '/recentfeed.json':
+            self._send_recent_songs()
+        else:
+            self.send_error(404)
+
+    def _send_recent_songs(self):
+        server = self.server
+        loop = int((time.time() - server.started) / server.stream_info['duration'])
+        items = []
+        for i in range(loop, max(loop - RECENT_SONGS_COUNT, -1), -1):
+            items.append({
+                'title': song_title(i)[1],
+                'date': str(int(server.started + i * server.stream_info['duration']))
+            })
+        body = json.dumps({'items': items}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self):
+        server = self.server
+        conditions = server.conditions
+        icy = self.headers.get('Icy-MetaData') == '1'
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPES[server.stream_format])
+        self.send_header('icy-sr', str(server.stream_info['sample_rate']))
+        self.send_header('icy-br', str(server.stream_info['bitrate'] // 1000))
+        self.send_header('icy-name', 'Benchmark Radio')
+        if icy:
+            self.send_header('icy-metaint', str(ICY_METAINT))
+        self.end_headers()
+
+        rng = random.Random(conditions.seed)
+        rate = conditions.bandwidth or server.stream_info['bitrate'] / 8
+        data = server.data
+        loop = 0
+        position = 0
+        sent = 0
+        metadata_remaining = ICY_METAINT
+        title = None
+        connected = time.monotonic()
+        next_send = connected
+        next_stall = connected + conditions.stall_every if conditions.stall_every else None
+        try:
+            while True:
+                now = time.monotonic()
+                if conditions.disconnect_after and now - connected >= conditions.disconnect_after:
+                    break
+                if next_stall and now >= next_stall:
+                    time.sleep(conditions.stall_time)
+                    next_send += conditions.stall_time
+                    next_stall += conditions.stall_every
+                size = min(SEND_CHUNK_SIZE, len(data) - position)
+                if icy:
+                    size = min(size, metadata_remaining)
+                self.wfile.write(data[position:position + size])
+                position += size
+                sent += size
+                if position == len(data):
+                    position = 0
+                    loop += 1
+                if icy:
+                    metadata_remaining -= size
+                    if metadata_remaining == 0:
+                        # Like the station, the title is only sent again when it changes
+                        if song_title(loop)[0] != title:
+                            title = song_title(loop)[0]
+                            self.wfile.write(icy_metadata_block(title))
+                        else:
+                            self.wfile.write(b'\0')
+                        metadata_remaining = ICY_METAINT
+                # The burst is sent as fast as possible, then the stream is paced at the rate
+                if sent <= conditions.burst:
+                    next_send = time.monotonic()
+                else:
+                    next_send += size / rate
+                    delay = next_send + rng.uniform(0.0, conditions.jitter) - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class RadioServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, data, stream_format, conditions=None):
+        super().__init__(address, RadioRequestHandler)
+        self.data = data
+        self.stream_format = stream_format
+        self.stream_info = get_stream_info(data, stream_format)
+        self.conditions = conditions or StreamConditions()
+        self.started = time.time()
+
+    @property
+    def stream_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/stream.{self.stream_format}'
+
+    @property
+    def recent_songs_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/recentfeed.json'
+
+
+def run_server(file, stream_format, conditions, port=0, address_queue=None):
+    # Entry point for running the server in a separate process
+    with open(file, 'rb') as f:
+        data = f.read()
+    server = RadioServer(('127.0.0.1', port), data, stream_format, conditions)
+    if address_queue is not None:
+        address_queue.put((server.stream_url, server.recent_songs_url))
+    server.serve_forever()
+
+
+def add_condition_arguments(parser):
+    parser.add_argument('--burst', type=int, default=64 * 1024, help='Bytes sent at connect before pacing')
+    parser.add_argument('--bandwidth', type=int, help='Stream bandwidth cap in bytes per second')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Maximum random delay per chunk in seconds')
+    parser.add_argument('--stall-every', type=float, help='Stall the stream every N seconds')
+    parser.add_argument('--stall-time', type=float, default=3.0, help='Duration of each stall in seconds')
+    parser.add_argument('--disconnect-after', type=float, help='Drop stream connections after N seconds')
+    parser.add_argument('--seed', type=int, help='Random seed for the jitter')
+
+
+def conditions_from_args(args):
+    return StreamConditions(
+        burst=args.burst,
+        bandwidth=args.bandwidth,
+        jitter=args.jitter,
+        stall_every=args.stall_every,
+        stall_time=args.stall_time,
+        disconnect_after=args.disconnect_after,
+        seed=args.seed
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('file', help='MP3 or Ogg Vorbis file to loop')
+    parser.add_argument('--format', choices=CONTENT_TYPES, default='mp3', help='Format of the file')
+    parser.add_argument('--port', type=int, default=8000, help='Port to listen on')
+    add_condition_arguments(parser)
+    args = parser.parse_args()
+
+    with open(args.file, 'rb') as f:
+        data = f.read()
+    server = RadioServer(('127.0.0.1', args.port), data, args.format, conditions_from_args(args))
+    print(f'Stream: {server.stream_url}')
+    print(f'Recent songs: {server.recent_songs_url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
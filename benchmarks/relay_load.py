@@ -0,0 +1,212 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import selectors
+import socket
+import statistics
+import sys
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from eternal_radio_player import __version__  # noqa: E402
+from eternal_radio_player.relay import StreamRelay  # noqa: E402
+from radio_server import add_condition_arguments, conditions_from_args, run_server  # noqa: E402
+
+
+# Runs the relay in its own process between the local stand-in radio server in radio_server.py
+# and hundreds of clients connected from this process. Reports the relay's CPU time and peak RSS
+# per client, the time to the first byte of each client, the rate each client received data at,
+# and how many clients were dropped. Some clients can be made to stop reading, to be dropped
+# once they fall out of the relay backlog.
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def run_relay(stream_url, args, conn):
+    # Entry point of the relay process, measures between the 'start' and 'stop' messages
+    relay = StreamRelay(
+        stream_url,
+        port=0,
+        burst_size=args.burst_size,
+        backlog_size=args.backlog_size,
+        max_clients=args.clients
+    )
+    relay.start()
+    conn.send(relay.url)
+    conn.recv()
+    cpu_started = time.process_time()
+    rss_started = peak_rss_mb()
+    conn.recv()
+    conn.send({
+        'cpu_time': time.process_time() - cpu_started,
+        'rss_started_mb': rss_started,
+        'peak_rss_mb': peak_rss_mb(),
+        'stats': relay.get_stats()
+    })
+    relay.stop()
+
+
+class Client:
+
+    def __init__(self, address, slow):
+        self.slow = slow
+        self.bytes_received = 0
+        self.connected = time.perf_counter()
+        self.first_byte_time = None
+        self.closed_time = None
+        self.socket = socket.socket()
+        if slow:
+            # A small receive buffer, so the relay runs into the client soon after it stops reading
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        self.socket.connect(address)
+        self.socket.sendall(b'GET / HTTP/1.0\r\nIcy-MetaData: 1\r\n\r\n')
+        self.socket.setblocking(False)
+
+    def receive(self):
+        try:
+            data = self.socket.recv(64 * 1024)
+        except BlockingIOError:
+            return True
+        except OSError:
+            data = b''
+        if not data:
+            self.closed_time = time.perf_counter()
+            return False
+        if self.first_byte_time is None:
+            self.first_byte_time = time.perf_counter() - self.connected
+        self.bytes_received += len(data)
+        return True
+
+
+def run_clients(address, args):
+    selector = selectors.DefaultSelector()
+    clients = []
+    slow_clients = int(args.clients * args.slow_fraction)
+    started = time.perf_counter()
+    deadline = started + args.ramp_time + args.duration
+    while time.perf_counter() < deadline:
+        # Clients are connected evenly over the ramp time
+        due = min(int((time.perf_counter() - started) / args.ramp_time * args.clients) + 1, args.clients)
+        while len(clients) < due:
+            client = Client(address, len(clients) < slow_clients)
+            clients.append(client)
+            if not client.slow:
+                selector.register(client.socket, selectors.EVENT_READ, client)
+        for key, _events in selector.select(0.1):
+            if not key.data.receive():
+                selector.unregister(key.fileobj)
+    # Slow clients read once at the end, to find out whether the relay dropped them
+    for client in clients:
+        if client.slow:
+            client.socket.setblocking(True)
+            client.socket.settimeout(0.5)
+            try:
+                while client.socket.recv(64 * 1024):
+                    pass
+                client.closed_time = time.perf_counter()
+            except OSError:
+                pass
+        client.socket.close()
+    return clients, time.perf_counter()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('file', help='MP3 file looped by the server')
+    parser.add_argument('--clients', type=int, default=200, help='Number of relay clients')
+    parser.add_argument('--duration', type=float, default=30.0, help='Time all clients are connected in seconds')
+    parser.add_argument('--ramp-time', type=float, default=5.0, help='Time to connect the clients over in seconds')
+    parser.add_argument('--slow-fraction', type=float, default=0.0, help='Fraction of clients that never read')
+    parser.add_argument('--burst-size', type=int, default=64 * 1024, help='Relay burst on connect in bytes')
+    parser.add_argument('--backlog-size', type=int, default=1024 * 1024, help='Relay backlog in bytes')
+    parser.add_argument('--output', help='Save the results to this JSON file')
+    add_condition_arguments(parser)
+    args = parser.parse_args()
+
+    address_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(
+        target=run_server,
+        args=(args.file, 'mp3', conditions_from_args(args)),
+        kwargs={'address_queue': address_queue},
+        daemon=True
+    )
+    server.start()
+    relay_conn, conn = multiprocessing.Pipe()
+    relay = None
+    try:
+        stream_url, _recent_songs_url = address_queue.get(timeout=10.0)
+        relay = multiprocessing.Process(target=run_relay, args=(stream_url, args, conn), daemon=True)
+        relay.start()
+        relay_url = urlsplit(relay_conn.recv())
+        # Let the relay fill its backlog before measuring
+        time.sleep(2.0)
+        relay_conn.send('start')
+        clients, finished = run_clients((relay_url.hostname, relay_url.port), args)
+        relay_conn.send('stop')
+        relay_results = relay_conn.recv()
+    finally:
+        if relay is not None:
+            relay.join(5.0)
+            relay.terminate()
+        server.terminate()
+        server.join()
+
+    fast_clients = [c for c in clients if not c.slow]
+    slow_clients = [c for c in clients if c.slow]
+    first_byte_times = [c.first_byte_time for c in fast_clients if c.first_byte_time is not None]
+    rates = [c.bytes_received / ((c.closed_time or finished) - c.connected) / 1024 for c in fast_clients]
+    measured_time = args.ramp_time + args.duration
+    rss_growth = relay_results['peak_rss_mb'] - relay_results['rss_started_mb']
+    summary = {
+        'clients': len(clients),
+        'slow_clients': len(slow_clients),
+        'relay_cpu_percent': relay_results['cpu_time'] / measured_time * 100,
+        'relay_cpu_ms_per_client_minute': relay_results['cpu_time'] / len(clients) / measured_time * 60 * 1000,
+        'relay_peak_rss_mb': relay_results['peak_rss_mb'],
+        'relay_rss_kb_per_client': rss_growth * 1024 / len(clients),
+        'first_byte_p50_ms': percentile(first_byte_times, 50) * 1000 if first_byte_times else None,
+        'first_byte_p95_ms': percentile(first_byte_times, 95) * 1000 if first_byte_times else None,
+        'client_rate_min_kib_s': min(rates) if rates else None,
+        'client_rate_median_kib_s': statistics.median(rates) if rates else None,
+        'fast_clients_closed': sum(1 for c in fast_clients if c.closed_time),
+        'slow_clients_dropped': sum(1 for c in slow_clients if c.closed_time),
+        'relay_stats': relay_results['stats']
+    }
+    for key, value in summary.items():
+        print(f'{key}: {value:.4g}' if isinstance(value, float) else f'{key}: {value}')
+
+    if args.output:
+        results = {
+            'version': __version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'settings': vars(args),
+            'summary': summary
+        }
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
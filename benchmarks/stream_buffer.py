@@ -0,0 +1,148 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from eternal_radio_player.buffers import ChunkBuffer  # noqa: E402
+from eternal_radio_player.stream import StreamSource  # noqa: E402
+
+
+# Simulates the decoder pulling compressed data from the stream buffer while the network
+# reader appends chunks, and compares the previous bytearray buffer against ChunkBuffer and
+# StreamSource, which splits out ICY metadata and joins short fragments. Copied bytes are
+# counted for the Python-side buffer operations only, the final copy into the decoder memory
+# is the same for all of them. A read is counted as copied unless it's a view of a chunk
+# that was appended.
+
+
+def copied_size(data, chunk_ids):
+    if isinstance(data, memoryview) and id(data.obj) in chunk_ids:
+        return 0
+    return len(data)
+
+
+class BytearrayBuffer:
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.copied = 0
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def append(self, chunk):
+        self._buffer.extend(chunk)
+        self.copied += len(chunk)
+
+    def read(self, size):
+        data = self._buffer[:size]
+        del self._buffer[:size]
+        self.copied += len(data)
+        return data
+
+
+class CountingChunkBuffer(ChunkBuffer):
+
+    def __init__(self):
+        super().__init__()
+        self.copied = 0
+        self._chunk_ids = set()
+
+    def append(self, chunk):
+        # The appended chunks stay referenced by the queue or the benchmark, so ids are unique
+        self._chunk_ids.add(id(chunk))
+        super().append(chunk)
+
+    def read(self, size):
+        data = super().read(size)
+        self.copied += copied_size(data, self._chunk_ids)
+        return data
+
+
+class CountingStreamSource:
+
+    # Feeds a StreamSource like the network reader and reads from it like the decoder
+
+    def __init__(self, metaint):
+        headers = {'icy-metaint': str(metaint)} if metaint else {}
+        self.copied = 0
+        self._chunk_ids = set()
+        self._source = StreamSource(headers, prebuffer_size=1, low_watermark=1, high_watermark=1 << 62)
+
+    def __len__(self):
+        return self._source.buffered
+
+    def append(self, chunk):
+        self._chunk_ids.add(id(chunk))
+        self._source.write(chunk)
+
+    def read(self, size):
+        data = self._source.read(size)
+        self.copied += copied_size(data, self._chunk_ids)
+        return data
+
+
+def create_chunks(megabytes, chunk_size, metaint):
+    # Audio data with an ICY metadata block every metaint bytes, cut into network chunks
+    audio = os.urandom(chunk_size)
+    audio_size = megabytes * 1024 * 1024
+    if not metaint:
+        return [bytes(audio) for _ in range(audio_size // chunk_size)]
+    metadata = b"StreamTitle='Artist - Title';"
+    metadata += b'\0' * (-len(metadata) % 16)
+    metadata = bytes((len(metadata) // 16,)) + metadata
+    stream = bytearray()
+    for offset in range(0, audio_size, metaint):
+        size = min(metaint, audio_size - offset)
+        stream += (audio * (metaint // chunk_size + 1))[:size]
+        stream += metadata
+    return [bytes(stream[i:i + chunk_size]) for i in range(0, len(stream), chunk_size)]
+
+
+def run(buffer, chunks, read_size, backlog):
+    start = time.perf_counter()
+    total = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        while len(buffer) > backlog:
+            total += len(buffer.read(read_size))
+    while len(buffer):
+        total += len(buffer.read(read_size))
+    return total, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--megabytes', type=int, default=256, help='Amount of data to push through the buffer')
+    parser.add_argument('--chunk-size', type=int, default=16 * 1024, help='Network chunk size')
+    parser.add_argument('--read-size', type=int, default=4 * 1024, help='Decoder read size')
+    parser.add_argument('--backlog', type=int, default=256 * 1024, help='Bytes kept buffered while reading')
+    parser.add_argument(
+        '--icy-metaint',
+        type=int,
+        default=16000,
+        help='ICY metadata interval of the StreamSource run in bytes, 0 to disable'
+    )
+    args = parser.parse_args()
+
+    plain_chunks = create_chunks(args.megabytes, args.chunk_size, 0)
+    icy_chunks = create_chunks(args.megabytes, args.chunk_size, args.icy_metaint)
+    runs = (
+        ('bytearray', BytearrayBuffer(), plain_chunks),
+        ('chunk-deque', CountingChunkBuffer(), plain_chunks),
+        ('stream-source', CountingStreamSource(0), plain_chunks),
+        ('stream-source-icy', CountingStreamSource(args.icy_metaint), icy_chunks)
+    )
+    for name, buffer, chunks in runs:
+        total, elapsed = run(buffer, chunks, args.read_size, args.backlog)
+        print(
+            f'{name:>17}: {total / elapsed / 1024 / 1024:10.1f} MiB/s throughput, '
+            f'{buffer.copied / elapsed / 1024 / 1024:10.1f} MiB/s copied '
+            f'({buffer.copied / total:.4f} bytes copied per byte)'
+        )
+
+
+if __name__ == '__main__':
+    main()
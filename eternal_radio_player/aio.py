@@ -0,0 +1,458 @@
+import asyncio
+import json
+import logging
+import ssl
+from requests.structures import CaseInsensitiveDict
+from urllib.parse import urljoin, urlsplit
+
+from .constants import (
+    HTTP_MAX_REDIRECTS,
+    PLAYER_EVENT_QUEUE_SIZE,
+    READ_TIMEOUT,
+    RECENT_SONGS_URL,
+    REQUEST_TIMEOUT,
+    STREAM_ITER_CHUNK_SIZE,
+    STREAM_URL,
+    USER_AGENT
+)
+from .exceptions import PlayerError, StreamError
+from .feed import parse_recent_songs, RecentSongsCachePolicy
+from .player import RadioPlayer
+from .stream import parse_stream_headers, StreamSource
+
+
+log = logging.getLogger(__name__)
+
+_ssl_context = None
+
+
+def _get_ssl_context():
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context()
+    return _ssl_context
+
+
+class AsyncHTTPResponse:
+
+    # Minimal HTTP/1.1 response on top of asyncio streams. Accepts the 'ICY' status line sent
+    # by older SHOUTcast servers.
+
+    def __init__(self, url, status_code, reason, headers, reader, writer):
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self._reader = reader
+        self._writer = writer
+        self._chunked = headers.get('Transfer-Encoding', '').lower() == 'chunked'
+        self._chunk_remaining = 0
+        try:
+            self._remaining = None if self._chunked else int(headers['Content-Length'])
+        except (KeyError, ValueError):
+            self._remaining = None
+        self._eof = False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise StreamError(f'HTTP {self.status_code} {self.reason} for URL: {self.url}')
+
+    async def read_chunk(self, size):
+        # Returns up to size bytes of the body, or empty bytes at the end of the body
+        if self._eof:
+            return b''
+        if self._chunked:
+            if not self._chunk_remaining:
+                line = await self._reader.readline()
+                try:
+                    self._chunk_remaining = int(line.split(b';', 1)[0], 16)
+                except ValueError as e:
+                    raise StreamError(f'Invalid chunk size: {line!r}') from e
+                if not self._chunk_remaining:
+                    # Skip the trailers
+                    while (await self._reader.readline()).strip():
+                        pass
+                    self._eof = True
+                    return b''
+            data = await self._reader.read(min(size, self._chunk_remaining))
+            if not data:
+                raise StreamError('Connection closed in the middle of a chunk')
+            self._chunk_remaining -= len(data)
+            if not self._chunk_remaining:
+                await self._reader.readexactly(2)
+            return data
+        if self._remaining is not None:
+            if not self._remaining:
+                self._eof = True
+                return b''
+            data = await self._reader.read(min(size, self._remaining))
+            if not data:
+                raise StreamError('Connection closed before the end of the body')
+            self._remaining -= len(data)
+            return data
+        data = await self._reader.read(size)
+        if not data:
+            self._eof = True
+        return data
+
+    async def read(self):
+        chunks = []
+        while True:
+            chunk = await self.read_chunk(STREAM_ITER_CHUNK_SIZE)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    def close(self):
+        self._writer.close()
+
+
+async def _request(url, headers, timeout, read_timeout):
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https'):
+        raise StreamError(f"Unsupported URL scheme: '{parts.scheme}'")
+    secure = parts.scheme == 'https'
+    host = parts.hostname
+    port = parts.port or (443 if secure else 80)
+    path = parts.path or '/'
+    if parts.query:
+        path += f'?{parts.query}'
+
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(
+            host,
+            port,
+            ssl=_get_ssl_context() if secure else None,
+            server_hostname=host if secure else None
+        ),
+        timeout
+    )
+    try:
+        request_headers = {
+            'Host': parts.netloc,
+            'User-Agent': USER_AGENT,
+            'Accept-Encoding': 'identity',
+            'Connection': 'close',
+            **headers
+        }
+        request = f'GET {path} HTTP/1.1\r\n'
+        request += ''.join(f'{name}: {value}\r\n' for name, value in request_headers.items())
+        writer.write(f'{request}\r\n'.encode('latin-1'))
+
+        async def read_head():
+            status_line = (await reader.readline()).decode('latin-1').rstrip('\r\n')
+            status = status_line.split(' ', 2)
+            if len(status) < 2 or not status[0].startswith(('HTTP/', 'ICY')):
+                raise StreamError(f'Invalid status line: {status_line!r}')
+            response_headers = CaseInsensitiveDict()
+            while True:
+                line = (await reader.readline()).decode('latin-1').rstrip('\r\n')
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                response_headers[name.strip()] = value.strip()
+            return int(status[1]), status[2] if len(status) > 2 else '', response_headers
+
+        status_code, reason, response_headers = await asyncio.wait_for(read_head(), read_timeout)
+    except BaseException:
+        writer.close()
+        raise
+    return AsyncHTTPResponse(url, status_code, reason, response_headers, reader, writer)
+
+
+async def http_get(url, headers=None, timeout=REQUEST_TIMEOUT, read_timeout=READ_TIMEOUT):
+    for _ in range(HTTP_MAX_REDIRECTS + 1):
+        response = await _request(url, headers or {}, timeout, read_timeout)
+        location = response.headers.get('Location')
+        if response.status_code not in (301, 302, 303, 307, 308) or not location:
+            return response
+        response.close()
+        url = urljoin(url, location)
+        log.debug(f"Following redirect to URL: '{url}'")
+    raise StreamError(f'Exceeded {HTTP_MAX_REDIRECTS} redirects')
+
+
+async def async_stream_request(url=STREAM_URL, timeout=REQUEST_TIMEOUT, read_timeout=READ_TIMEOUT):
+    log.debug(
+        f"Making async stream request with URL: '{url}', timeout: {timeout}, read timeout: {read_timeout}"
+    )
+    response = await http_get(url, {'Icy-MetaData': '1'}, timeout, read_timeout)
+    try:
+        response.raise_for_status()
+        encoding, sample_rate = parse_stream_headers(response.headers)
+    except (StreamError, ValueError):
+        response.close()
+        raise
+    return response, encoding, sample_rate
+
+
+class AsyncStreamSource(StreamSource):
+
+    # Stream source fed by a task on the event loop instead of a reader thread
+
+    def __init__(self, response, iter_chunk_size=STREAM_ITER_CHUNK_SIZE, **kwargs):
+        super().__init__(response.headers, **kwargs)
+        self._response = response
+        self._iter_chunk_size = iter_chunk_size
+        self._loop = asyncio.get_running_loop()
+        self._task = self._loop.create_task(self._reader())
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        try:
+            self._loop.call_soon_threadsafe(self._task.cancel)
+        except RuntimeError:
+            # The event loop is already closed
+            self._response.close()
+
+    async def _reader(self):
+        log.debug('Async stream reader started')
+        try:
+            while not self.closed:
+                # The buffer holds many seconds of audio when full, so polling is cheap enough
+                if self.full:
+                    await asyncio.sleep(0.1)
+                    continue
+                throttle_delay = self.throttle_delay
+                if throttle_delay:
+                    await asyncio.sleep(min(throttle_delay, 0.1))
+                    continue
+                chunk = await asyncio.wait_for(
+                    self._response.read_chunk(self._iter_chunk_size),
+                    self._read_timeout
+                )
+                if not chunk:
+                    self.finish()
+                    break
+                self.write(chunk)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.finish(e)
+        finally:
+            self._response.close()
+        log.debug('Async stream reader stopped')
+
+
+class _AsyncStreamRadioPlayer(RadioPlayer):
+
+    # Opens streams on the event loop. The initial stream is opened by AsyncRadioPlayer.play()
+    # before the blocking part of play() runs in an executor, reconnects from the supervisor
+    # thread are scheduled on the loop.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.loop = None
+        self.pending_stream = None
+
+    async def open_stream_async(self, url=None):
+        response, encoding, sample_rate = await async_stream_request(
+            url or self.stream_url,
+            self.request_timeout,
+            self.read_timeout
+        )
+        log.debug(f'Async stream request status: {response.status_code}')
+        try:
+            stream_source = AsyncStreamSource(
+                response,
+                iter_chunk_size=self.stream_chunk_size,
+                **self._stream_source_params()
+            )
+        except Exception:
+            response.close()
+            raise
+        return stream_source, encoding, sample_rate
+
+    def _connect_stream(self, url=None):
+        stream = self.pending_stream
+        if stream is not None and url is None:
+            self.pending_stream = None
+            return stream
+        future = asyncio.run_coroutine_threadsafe(self.open_stream_async(url), self.loop)
+        return future.result(self.request_timeout + self.read_timeout)
+
+
+class AsyncRadioPlayer:
+
+    def __init__(self, *args, recent_songs_url=RECENT_SONGS_URL, **kwargs):
+        self._player = _AsyncStreamRadioPlayer(*args, recent_songs_url=recent_songs_url, **kwargs)
+        self._recent_songs = AsyncRecentSongsCache(recent_songs_url) if recent_songs_url else None
+        self._lock = None
+
+    @property
+    def running(self):
+        return self._player.running
+
+    @property
+    def now_playing(self):
+        return self._player.now_playing
+
+    @property
+    def output_device(self):
+        return self._player.output_device
+
+    @property
+    def paused(self):
+        return self._player.paused
+
+    @property
+    def recording(self):
+        return self._player.recording
+
+    @property
+    def recording_path(self):
+        return self._player.recording_path
+
+    async def play(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            if self._player.paused:
+                await loop.run_in_executor(None, self._player.play)
+                return
+            if self._player.running:
+                log.debug('Cannot start radio player, already running')
+                return
+            self._player.loop = loop
+            # A warm standby stream is taken by play() without blocking
+            if not self._player.standby_ready:
+                try:
+                    self._player.pending_stream = await self._player.open_stream_async()
+                except Exception as e:
+                    raise PlayerError(f'Could not initialize player: {e}') from e
+            # Only the device setup blocks, the stream is already open
+            try:
+                await loop.run_in_executor(None, self._player.play)
+            finally:
+                stream = self._player.pending_stream
+                self._player.pending_stream = None
+                if stream is not None:
+                    stream[0].close()
+
+    async def stop(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            self._player.loop = loop
+            await loop.run_in_executor(None, self._player.stop)
+
+    async def pause(self):
+        await asyncio.get_running_loop().run_in_executor(None, self._player.pause)
+
+    async def rewind(self, seconds):
+        await asyncio.get_running_loop().run_in_executor(None, self._player.rewind, seconds)
+
+    async def live(self):
+        await asyncio.get_running_loop().run_in_executor(None, self._player.live)
+
+    async def switch_station(self, stream_url, recent_songs_url=None):
+        # The new station's stream is opened on the event loop, like reconnects
+        loop = asyncio.get_running_loop()
+        self._player.loop = loop
+        await loop.run_in_executor(None, self._player.switch_station, stream_url, recent_songs_url)
+        if recent_songs_url is None:
+            self._recent_songs = None
+        elif self._recent_songs is None or self._recent_songs.url != recent_songs_url:
+            self._recent_songs = AsyncRecentSongsCache(recent_songs_url)
+
+    async def start_standby(self):
+        # Standby streams are opened on the event loop, so this can only start from a coroutine
+        self._player.loop = asyncio.get_running_loop()
+        self._player.start_standby()
+
+    async def start_recording(self, directory=None):
+        # While stopped, the recorded stream is opened on the event loop like a standby stream
+        loop = asyncio.get_running_loop()
+        self._player.loop = loop
+        await loop.run_in_executor(None, self._player.start_recording, directory)
+
+    async def stop_recording(self):
+        await asyncio.get_running_loop().run_in_executor(None, self._player.stop_recording)
+
+    async def close(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            await asyncio.get_running_loop().run_in_executor(None, self._player.close)
+
+    async def recent_songs(self, timeout=REQUEST_TIMEOUT, max_age=None):
+        if self._recent_songs is None:
+            raise PlayerError('The station has no recent songs feed')
+        return await self._recent_songs.get(timeout, max_age)
+
+    async def events(self):
+        # Yields player events as dicts with a 'type' key: 'state', 'metadata', 'now_playing',
+        # 'underflow', 'latency', 'reconnect', 'reconnect_failed', 'recording', 'timeshift' and
+        # 'station'
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(PLAYER_EVENT_QUEUE_SIZE)
+
+        def put_event(event):
+            if queue.full():
+                log.debug(f"Event queue full, dropping event: {queue.get_nowait()['type']}")
+            queue.put_nowait(event)
+
+        def listener(event):
+            loop.call_soon_threadsafe(put_event, event)
+
+        self._player.add_event_listener(listener)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._player.remove_event_listener(listener)
+
+    def get_volume(self):
+        return self._player.get_volume()
+
+    def set_volume(self, volume):
+        self._player.set_volume(volume)
+
+    def get_stats(self):
+        return self._player.get_stats()
+
+
+class AsyncRecentSongsCache(RecentSongsCachePolicy):
+
+    # Event loop counterpart of RecentSongsCache with the same caching policy. Concurrent callers
+    # await the same fetch task.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._task = None
+
+    async def get(self, timeout=REQUEST_TIMEOUT, max_age=None):
+        data, fetch = self._lookup(max_age, self._task is not None)
+        if fetch:
+            self._task = asyncio.get_running_loop().create_task(self._fetch(timeout))
+            self._task.add_done_callback(self._fetch_done)
+        if data is not None:
+            return data
+        # Cancelling one caller shouldn't cancel the fetch shared with the others
+        await asyncio.shield(self._task)
+        return self._result()
+
+    def _fetch_done(self, _task):
+        self._task = None
+
+    async def _fetch(self, timeout):
+        data = None
+        response_headers = None
+        error = None
+        try:
+            response = await http_get(self.url, self._request_headers(), timeout, timeout)
+            try:
+                response.raise_for_status()
+                if response.status_code != 304:
+                    data = parse_recent_songs(json.loads(await asyncio.wait_for(response.read(), timeout)))
+            finally:
+                response.close()
+            response_headers = response.headers
+        except (OSError, asyncio.TimeoutError, StreamError, ValueError, PlayerError) as e:
+            error = e
+        self._store(data, response_headers, error)
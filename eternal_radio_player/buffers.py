@@ -0,0 +1,104 @@
+import numpy
+from collections import deque
+
+
+class ChunkBuffer:
+
+    # Queue of immutable chunks as received from the network. Reads return memoryview slices
+    # of the queued chunks, so data is never copied or shifted on the Python side.
+
+    def __init__(self):
+        self._chunks = deque()
+        self._offset = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, chunk):
+        if chunk:
+            self._chunks.append(memoryview(chunk))
+            self._size += len(chunk)
+
+    def read(self, size):
+        # Returns at most 'size' bytes, never spanning more than one chunk
+        if not self._chunks or size <= 0:
+            return memoryview(b'')
+        head = self._chunks[0]
+        end = min(self._offset + size, len(head))
+        data = head[self._offset:end]
+        self._size -= end - self._offset
+        if end == len(head):
+            self._chunks.popleft()
+            self._offset = 0
+        else:
+            self._offset = end
+        return data
+
+    def peek(self, size):
+        # Returns a copy of at most 'size' bytes from the start, without consuming them
+        data = bytearray()
+        offset = self._offset
+        for chunk in self._chunks:
+            data += chunk[offset:offset + size - len(data)]
+            offset = 0
+            if len(data) >= size:
+                break
+        return bytes(data)
+
+    def clear(self):
+        self._chunks.clear()
+        self._offset = 0
+        self._size = 0
+
+
+class SampleRingBuffer:
+
+    # Single-producer, single-consumer ring of PCM frames. The write and read indexes only
+    # ever grow and each is updated by one thread, so no locking is needed.
+
+    def __init__(self, frames, channels, dtype=numpy.float32):
+        self.frames = frames
+        self.channels = channels
+        self._data = numpy.zeros((frames, channels), dtype)
+        self._write_index = 0
+        self._read_index = 0
+
+    @property
+    def available(self):
+        return self._write_index - self._read_index
+
+    @property
+    def free(self):
+        return self.frames - self.available
+
+    @property
+    def frames_written(self):
+        return self._write_index
+
+    @property
+    def frames_read(self):
+        return self._read_index
+
+    def write(self, samples):
+        frames = min(len(samples), self.free)
+        start = self._write_index % self.frames
+        first = min(frames, self.frames - start)
+        self._data[start:start + first] = samples[:first]
+        if frames > first:
+            self._data[:frames - first] = samples[first:frames]
+        self._write_index += frames
+        return frames
+
+    def read_into(self, output):
+        frames = min(len(output), self.available)
+        start = self._read_index % self.frames
+        first = min(frames, self.frames - start)
+        output[:first] = self._data[start:start + first]
+        if frames > first:
+            output[first:frames] = self._data[:frames - first]
+        self._read_index += frames
+        return frames
+
+    def clear(self):
+        self._read_index = self._write_index
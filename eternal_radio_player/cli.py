@@ -1,4 +1,5 @@
 import argparse
+import atexit
 import cmd
 import logging
 import os.path
@@ -10,12 +11,15 @@
 
 from ._version import __version__
 from .config import Config
-from .constants import CREDITS
-from .exceptions import PlayerError
+from .constants import CREDITS, DEVICE_ENUMERATION_TIMEOUT, OUTPUT_SINKS, TIMESHIFT_REWIND_TIME
+from .exceptions import PlayerError, RelayError
 from .i18n import I18n, I18nError
-from .player import get_output_device, get_output_devices, RadioPlayer
+from .logging_ import LogPipeline
 from .utils import format_exc, system_info
 
+# The player, transport and audio libraries are imported on first use, so '--version' and
+# '--help' don't pay for NumPy, miniaudio, requests and PortAudio initialization
+
 
 log = logging.getLogger(__name__)
 
@@ -29,7 +33,7 @@ class App(cmd.Cmd):
     )
     _hidden_attrs = ('do_EOF', 'do_help')
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, output_sink=None, output_path=None, **kwargs):
         super().__init__(*args, **kwargs)
         log.debug('Initializing CLI command logger')
         logger = logging.getLogger('cli-cmd')
@@ -38,9 +42,21 @@ def __init__(self, *args, **kwargs):
         handler = logging.StreamHandler()
         logger.addHandler(handler)
         self._log = logger
-        self._player = RadioPlayer(Config.data['output-device'], Config.data['connection-timeout'])
-        self._player.set_volume(Config.data['volume'])
-        Config.data['output-device'] = self._player.output_device['index']
+        from .player import RadioPlayer
+
+        # The player is created for the configured station, or the fallback one if it's gone
+        Config.data['station'] = Config.get_station()[0]
+        self._player = RadioPlayer.from_config(Config.data, output_sink=output_sink, output_path=output_path)
+        from .sinks import get_output_sink
+
+        # Keep the intro, prompts and help off stdout when the sink writes samples to it
+        if get_output_sink(self._player.output_sink).writes_stdout(self._player.output_path):
+            self.stdout = sys.stderr
+            self.use_rawinput = False
+        # Sinks without a device don't replace the saved one
+        if self._player.output_device['index'] is not None:
+            Config.data['output-device'] = self._player.output_device['index']
+        self._player.start_standby()
 
     def do_play(self, _):
         try:
@@ -51,6 +67,47 @@ def do_play(self, _):
     def do_stop(self, _):
         self._player.stop()
 
+    def do_pause(self, _):
+        try:
+            self._player.pause()
+        except PlayerError as e:
+            self._log.info(e)
+
+    def do_rewind(self, args):
+        try:
+            seconds = float(args) if args else TIMESHIFT_REWIND_TIME
+        except ValueError:
+            self._log.info(f"Invalid value '{args}'")
+            return
+        try:
+            self._player.rewind(seconds)
+        except PlayerError as e:
+            self._log.info(e)
+
+    def do_live(self, _):
+        try:
+            self._player.live()
+        except PlayerError as e:
+            self._log.info(e)
+
+    def do_station(self, args):
+        stations = Config.data['stations']
+        if not args:
+            self._log.info('\n'.join(
+                f"{'*' if name == Config.data['station'] else ' '} {name}" for name in stations
+            ))
+            return
+        if args not in stations:
+            self._log.info(f"Station '{args}' not found")
+            return
+        _name, stream_url, recent_songs_url = Config.get_station(args)
+        try:
+            self._player.switch_station(stream_url, recent_songs_url)
+        except PlayerError as e:
+            log.error(f'Error switching station: {e}')
+            return
+        Config.data['station'] = args
+
     def do_volume(self, args):
         if not args:
             self._log.info('Not enough arguments')
@@ -70,13 +127,50 @@ def do_volume(self, args):
     def do_recent(self, _):
         recent_songs_localized = []
         connection_timeout = Config.data['connection-timeout']
-        for recent_song in self._player.get_recent_songs(connection_timeout):
+        try:
+            recent_songs = self._player.get_recent_songs(connection_timeout)
+        except PlayerError as e:
+            log.error(f'Error fetching recent songs: {e}')
+            return
+        for recent_song in recent_songs:
             title = recent_song['title']
             timestamp = recent_song['timestamp']
             timestamp_fmt = timeago.format(timestamp)
             recent_songs_localized.append(f'{title}\n{timestamp_fmt}')
         self._log.info('\n\n'.join(recent_songs_localized))
 
+    def do_stats(self, _):
+        stats = self._player.get_stats()
+        self._log.info(
+            f"Underflows: {stats['underflows']}\n"
+            f"Decoder errors: {stats['decoder_errors']}\n"
+            f"Reconnects: {stats['reconnects']}\n"
+            f"Last reconnect gap: {stats['last_reconnect_gap']:.2f}s\n"
+            f"Total reconnect gap: {stats['total_reconnect_gap']:.2f}s\n"
+            f"Timeshift delay: {stats['timeshift_delay']:.1f}s\n"
+            f"Output block size: {stats['output_blocksize']}\n"
+            f"Output latency: {(stats['output_latency'] or 0) * 1000:.0f}ms\n"
+            f"Dropped log messages: {LogPipeline.dropped()}"
+        )
+
+    def do_record(self, args):
+        if not args:
+            if self._player.recording:
+                path = self._player.recording_path or Config.data['recording-directory']
+                self._log.info(f"Recording to '{path}'")
+            else:
+                self._log.info('Not recording')
+            return
+        if args == 'start':
+            try:
+                self._player.start_recording()
+            except PlayerError as e:
+                log.error(f'Error starting recording: {e}')
+        elif args == 'stop':
+            self._player.stop_recording()
+        else:
+            self._log.info(f"Invalid argument '{args}'")
+
     def do_config(self, args):
         if not args:
             self._log.info('Not enough arguments')
@@ -107,7 +201,16 @@ def do_config(self, args):
             Config.data['connection-timeout'] = connection_timeout
             self._log.info(f'Connection timeout: {connection_timeout}s')
         elif subcmd == 'output-device':
-            output_devices = get_output_devices()
+            if self._player.output_device['index'] is None:
+                self._log.info(f"The '{self._player.output_sink}' output has no devices")
+                return
+            from .devices import get_device_registry
+
+            device_registry = get_device_registry()
+            # Re-enumerates with PortAudio re-initialized to list added and removed devices, unless
+            # an output stream is open
+            device_registry.invalidate(reinitialize=True).wait(DEVICE_ENUMERATION_TIMEOUT)
+            output_devices = device_registry.get_devices(DEVICE_ENUMERATION_TIMEOUT)
             if value is None:
                 output_devices_str = '\n'.join([f"#{device['index']} - {device['name']}" for device in output_devices])
                 current_device_str = f"#{self._player.output_device['index']} - {self._player.output_device['name']}"
@@ -123,8 +226,8 @@ def do_config(self, args):
                 self._log.info(f"Invalid value '{value}'")
                 return
             try:
-                device = get_output_device(selected_device_index)
-            except PlayerError:
+                device = device_registry.get_device(selected_device_index, DEVICE_ENUMERATION_TIMEOUT)
+            except ValueError:
                 self._log.info(f"Device with index '{value}' not found")
                 return
             if self._player.running:
@@ -145,16 +248,16 @@ def do_credits(self, _):
         self._log.info(CREDITS)
 
     def do_quit(self, _):
-        self._player.stop()
+        self._player.close()
         Config.save()
         return True
 
     def do_help(self, args):
         if args:
-            print()
+            self.stdout.write('\n')
         super().do_help(args)
         if args:
-            print()
+            self.stdout.write('\n')
 
     def help_play(self):
         self._log.info(
@@ -170,6 +273,35 @@ def help_stop(self):
             '  stop'
         )
 
+    def help_pause(self):
+        self._log.info(
+            "Pause the radio player, 'play' continues from the same point. Needs timeshift.\n\n"
+            'Usage:\n'
+            '  pause'
+        )
+
+    def help_rewind(self):
+        self._log.info(
+            f'Go back in the stream by the number of seconds, {TIMESHIFT_REWIND_TIME:g} by default. '
+            'Needs timeshift.\n\n'
+            'Usage:\n'
+            '  rewind [seconds]'
+        )
+
+    def help_live(self):
+        self._log.info(
+            'Go back to the live stream after pausing or rewinding. Needs timeshift.\n\n'
+            'Usage:\n'
+            '  live'
+        )
+
+    def help_station(self):
+        self._log.info(
+            'View the stations or switch to another one\n\n'
+            'Usage:\n'
+            '  station [name]'
+        )
+
     def help_volume(self):
         self._log.info(
             'View or change the sound volume\n\n'
@@ -184,6 +316,20 @@ def help_recent(self):
             '  recent'
         )
 
+    def help_stats(self):
+        self._log.info(
+            'View playback statistics\n\n'
+            'Usage:\n'
+            '  stats'
+        )
+
+    def help_record(self):
+        self._log.info(
+            'View the recording status, or start or stop recording the stream\n\n'
+            'Usage:\n'
+            '  record [start|stop]'
+        )
+
     def help_config(self):
         self._log.info(
             'View or change the configuration\n\n'
@@ -222,7 +368,7 @@ def cmdloop(self, *args, **kwargs) -> None:
             super().cmdloop(*args, **kwargs)
         except KeyboardInterrupt:
             log.debug('Received KeyboardInterrupt, stopping and exiting')
-            self._player.stop()
+            self._player.close()
             raise
 
 
@@ -271,6 +417,25 @@ def _format_action_invocation(self, action):
         help='Config file path',
         metavar='<file>'
     )
+    parser.add_argument(
+        '-o',
+        '--output-sink',
+        choices=OUTPUT_SINKS,
+        help=f"Audio output: {', '.join(OUTPUT_SINKS)}",
+        metavar='<sink>'
+    )
+    parser.add_argument(
+        '-O',
+        '--output-path',
+        help="File or FIFO path of the 'wav' and 'pcm' outputs, '-' for stdout",
+        metavar='<file>'
+    )
+    parser.add_argument(
+        '-r',
+        '--relay',
+        action='store_true',
+        help='Relay the station stream to local clients instead of playing it'
+    )
     args = parser.parse_args()
 
     def error(msg, exc=None, tb=False):
@@ -280,14 +445,14 @@ def error(msg, exc=None, tb=False):
             print(msg, file=sys.stderr)
         sys.exit(1)
 
+    if platform.system() == 'Windows':
+        dir_name = 'Eternal Radio Player'
+    else:
+        dir_name = 'eternal-radio-player'
     if args.log:
         log_dir = Path(os.path.dirname(args.log))
         log_file = Path(args.log)
     else:
-        if platform.system() == 'Windows':
-            dir_name = 'Eternal Radio Player'
-        else:
-            dir_name = 'eternal-radio-player'
         log_dir = platformdirs.user_log_path(dir_name, False)
         log_file = log_dir.joinpath('eternal-radio-player.log')
     try:
@@ -303,19 +468,60 @@ def error(msg, exc=None, tb=False):
     stream_handler.setLevel(logging.NOTSET if args.debug else logging.INFO)
     file_handler = logging.FileHandler(str(log_file), 'w', 'utf-8')
     file_handler.setFormatter(file_formatter)
-    root_logger.addHandler(stream_handler)
-    root_logger.addHandler(file_handler)
     root_logger.setLevel(logging.NOTSET)
+    # Handlers run on a listener thread, so a slow terminal or disk never blocks the player
+    LogPipeline.start(stream_handler, file_handler)
+    atexit.register(LogPipeline.stop)
 
     log.debug(f'System information:\n{system_info()}')
 
+    # The default output device is resolved by the player when it's created
     defaults = {
-        'output-device': get_output_device()['index'],
-        'language': I18n.get_preferred_locale()
+        'output-device': None,
+        'language': I18n.get_preferred_locale(),
+        'recording-directory': str(platformdirs.user_music_path().joinpath(dir_name))
     }
     Config.init(args.config)
     Config.load(defaults)
 
+    from .transport import HTTPTransport, set_transport
+
+    set_transport(HTTPTransport(
+        Config.data['connection-timeout'],
+        Config.data['read-timeout'],
+        Config.data['socket-receive-buffer-size']
+    ))
+
+    if args.relay:
+        from .relay import StreamRelay
+
+        station, stream_url, _recent_songs_url = Config.get_station()
+        try:
+            relay = StreamRelay(
+                stream_url,
+                Config.data['relay-address'],
+                Config.data['relay-port'],
+                burst_size=Config.data['relay-burst-size'],
+                backlog_size=Config.data['relay-backlog-size'],
+                max_clients=Config.data['relay-max-clients'],
+                request_timeout=Config.data['connection-timeout'],
+                read_timeout=Config.data['read-timeout'],
+                stall_timeout=Config.data['stall-timeout'],
+                stream_chunk_size=Config.data['stream-chunk-size']
+            )
+        except (RelayError, ValueError) as e:
+            error('Could not start relay', e)
+        log.info(f"Starting in relay mode for station '{station}'")
+        relay.start()
+        try:
+            relay.join()
+        except KeyboardInterrupt:
+            print('Interrupted')
+        relay.stop()
+        if relay.error:
+            error('Relay stopped', relay.error)
+        sys.exit()
+
     if not args.cli:
         try:
             import PySide6
@@ -333,13 +539,21 @@ def error(msg, exc=None, tb=False):
             I18n.locale = Config.data['language']
 
             log.info('Starting in GUI mode')
-            sys.exit(gui_main())
+            try:
+                exit_code = gui_main(args.output_sink, args.output_path)
+            except PlayerError as e:
+                error('Could not start player', e)
+            sys.exit(exit_code)
 
     try:
         log.info('Starting in CLI mode')
-        App().cmdloop()
+        try:
+            app = App(output_sink=args.output_sink, output_path=args.output_path)
+        except PlayerError as e:
+            error('Could not start player', e)
+        app.cmdloop()
         log.info('Exiting')
         sys.exit()
     except KeyboardInterrupt:
-        print('Interrupted')
+        print('Interrupted', file=sys.stderr)
         sys.exit(1)
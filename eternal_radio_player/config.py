@@ -1,3 +1,4 @@
+import copy
 import errno
 import json
 import logging
@@ -7,7 +8,14 @@
 import schema
 from pathlib import Path
 
-from .constants import CONFIG_DEFAULTS
+from .constants import (
+    CONFIG_DEFAULTS,
+    DITHER_MODES,
+    LATENCY_PROFILES,
+    OUTPUT_SAMPLE_FORMATS,
+    OUTPUT_SINKS,
+    RESAMPLERS
+)
 from .exceptions import ConfigError
 
 
@@ -20,8 +28,46 @@ class Config:
     _file = None
     _schema = schema.Schema(
         {
-            schema.Optional('output-device'): int,
+            schema.Optional('output-device'): schema.Or(None, int),
             schema.Optional('connection-timeout'): float,
+            schema.Optional('read-timeout'): float,
+            schema.Optional('socket-receive-buffer-size'): int,
+            schema.Optional('stream-prebuffer-size'): int,
+            schema.Optional('stream-low-watermark'): int,
+            schema.Optional('stream-high-watermark'): int,
+            schema.Optional('stream-chunk-size'): int,
+            schema.Optional('decode-ahead-time'): float,
+            schema.Optional('reconnect-attempts'): int,
+            schema.Optional('stall-timeout'): float,
+            schema.Optional('warm-standby'): bool,
+            schema.Optional('standby-grace-time'): float,
+            schema.Optional('standby-buffer-size'): int,
+            schema.Optional('standby-bandwidth'): int,
+            schema.Optional('output-sink'): schema.Or(*OUTPUT_SINKS),
+            schema.Optional('output-sink-path'): schema.Or(None, str),
+            schema.Optional('sample-format'): schema.Or(*OUTPUT_SAMPLE_FORMATS),
+            schema.Optional('resampler'): schema.Or(*RESAMPLERS),
+            schema.Optional('dither'): schema.Or(*DITHER_MODES),
+            schema.Optional('latency-profile'): schema.Or(*LATENCY_PROFILES),
+            schema.Optional('output-blocksizes'): {schema.Optional(str): int},
+            schema.Optional('recording-directory'): schema.Or(None, str),
+            schema.Optional('timeshift'): bool,
+            schema.Optional('timeshift-length'): float,
+            schema.Optional('timeshift-directory'): schema.Or(None, str),
+            schema.Optional('stations'): {
+                str: {'stream-url': str, schema.Optional('recent-songs-url'): schema.Or(None, str)}
+            },
+            schema.Optional('station'): str,
+            schema.Optional('prewarm-stations'): int,
+            schema.Optional('relay-address'): str,
+            schema.Optional('relay-port'): int,
+            schema.Optional('relay-burst-size'): int,
+            schema.Optional('relay-backlog-size'): int,
+            schema.Optional('relay-max-clients'): int,
+            schema.Optional('console-max-lines'): int,
+            schema.Optional('device-params'): {
+                schema.Optional(str): {'sample-rate': int, 'channels': int, 'dtype': str}
+            },
             schema.Optional('volume'): float
         },
         ignore_extra_keys=True
@@ -75,10 +121,26 @@ def load(cls, defaults=None):
         except schema.SchemaError as e:
             raise ConfigError(f'Could not load config: {e}') from e
 
-        config_data = CONFIG_DEFAULTS.copy()
+        config_data = copy.deepcopy(CONFIG_DEFAULTS)
         config_data.update({**defaults, **raw_config_data})
         cls.data = config_data
 
+    @classmethod
+    def get_station(cls, name=None):
+        # Returns the name and URLs of the station, the configured one by default, falling back
+        # to the first station if it's not in the registry
+        stations = cls.data['stations']
+        if not stations:
+            raise ConfigError('No stations configured')
+        if name is None:
+            name = cls.data['station']
+        if name not in stations:
+            fallback = next(iter(stations))
+            log.warning(f"Station '{name}' not found, using '{fallback}'")
+            name = fallback
+        station = stations[name]
+        return name, station['stream-url'], station.get('recent-songs-url')
+
     @classmethod
     def save(cls, defaults=None, write_defaults=False):
         if not defaults:
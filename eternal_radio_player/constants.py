@@ -1,5 +1,3 @@
-import sounddevice
-
 from ._version import __version__
 
 
@@ -40,23 +38,133 @@
 
 USER_AGENT = f'Eternal Radio Player/{__version__}'
 REQUEST_TIMEOUT = 5.0
+READ_TIMEOUT = 10.0
+HTTP_POOL_SIZE = 4
+SOCKET_RECEIVE_BUFFER_SIZE = 0
+DNS_CACHE_SIZE = 16
+DNS_CACHE_TIME = 300.0
+TRANSPORT_TIMINGS_SIZE = 100
+HTTP_MAX_REDIRECTS = 5
 
 STREAM_URL = 'https://radio.jump.bg/proxy/mnikolov/stream'
 STREAM_ITER_CHUNK_SIZE = 16 * 1024
+STREAM_PREBUFFER_SIZE = 64 * 1024
+STREAM_LOW_WATERMARK = 8 * 1024
+STREAM_HIGH_WATERMARK = 512 * 1024
+STREAM_MIN_READ_SIZE = 1024
+STREAM_STALL_TIMEOUT = 2.0
+# Stream bytes waited for to read the sample rate and channels from the first frames
+STREAM_PROBE_SIZE = 4 * 1024
+
+RECONNECT_ATTEMPTS = 10
+RECONNECT_BACKOFF_MIN = 0.5
+RECONNECT_BACKOFF_MAX = 30.0
 
 PLAYER_FRAME_COUNT = 4 * 1024
+PLAYER_DECODE_AHEAD_TIME = 2.0
+PLAYER_EVENT_QUEUE_SIZE = 256
+
+# Output block sizes in frames and the output latency suggested to the device in blocks, or
+# None for the sink's default. The block size starts from the one learned for the device, or
+# the profile's, and only moves within the profile's limits.
+LATENCY_PROFILE = 'robust'
+LATENCY_PROFILES = {
+    'low-latency': {'blocksize': 512, 'min-blocksize': 256, 'max-blocksize': 4 * 1024, 'latency-blocks': 2},
+    'robust': {'blocksize': 4 * 1024, 'min-blocksize': 2 * 1024, 'max-blocksize': 16 * 1024, 'latency-blocks': 4},
+    'fixed': {
+        'blocksize': PLAYER_FRAME_COUNT,
+        'min-blocksize': PLAYER_FRAME_COUNT,
+        'max-blocksize': PLAYER_FRAME_COUNT,
+        'latency-blocks': None
+    }
+}
+# The block size doubles after this many underflows within the window, or one callback taking
+# more than the grow load of its block's duration. It halves after the shrink time without
+# underflows, callbacks above the shrink load or less than the minimum fill of decoded audio.
+LATENCY_GROW_UNDERFLOWS = 2
+LATENCY_UNDERFLOW_WINDOW = 30.0
+LATENCY_GROW_LOAD = 0.7
+LATENCY_SHRINK_LOAD = 0.2
+LATENCY_SHRINK_MIN_FILL = 0.5
+LATENCY_SHRINK_TIME = 300.0
+
+OUTPUT_SINK = 'sounddevice'
+OUTPUT_SINKS = ('sounddevice', 'null', 'null-fast', 'wav', 'pcm')
+# Used by the sinks without a device when the stream doesn't report its sample rate
+OUTPUT_SINK_SAMPLE_RATE = 44100
+# 'auto' picks the first sample format the output takes natively. With the 'device' resampler
+# the output is opened at the stream's sample rate if it's supported, so any resampling is left
+# to the device, with 'decoder' the decoder resamples to the device's default rate. Dither only
+# applies when the decoder converts float samples to int16.
+OUTPUT_SAMPLE_FORMAT = 'auto'
+OUTPUT_SAMPLE_FORMATS = ('auto', 'int16', 'float32')
+RESAMPLER = 'device'
+RESAMPLERS = ('device', 'decoder')
+DITHER = 'triangle'
+DITHER_MODES = ('none', 'rectangle', 'triangle')
+
+RECORDING_QUEUE_SIZE = 1024
+RECORDING_WRITE_BUFFER_SIZE = 1024 * 1024
+RECORDING_TITLE_MAX_LENGTH = 120
+
+# The ring file is sized for the length at the stream bitrate, or the default if it's unknown
+TIMESHIFT_LENGTH = 2 * 60 * 60.0
+TIMESHIFT_DEFAULT_BITRATE = 320 * 1000
+TIMESHIFT_INDEX_INTERVAL = 0.5
+TIMESHIFT_RELEASE_SIZE = 1024 * 1024
+TIMESHIFT_REWIND_TIME = 10.0
 
-# Default sounddevice host API
-for index, host_api in enumerate(sounddevice.query_hostapis()):
-    if host_api['name'] == 'Windows WASAPI' and host_api['default_output_device'] != -1:
-        SOUNDDEVICE_HOST_API = index
-        break
-else:
-    SOUNDDEVICE_HOST_API = sounddevice.default.hostapi
+# New relay clients get up to the burst size of the newest data at once, and clients that fall
+# more than the backlog size behind are dropped
+RELAY_ADDRESS = '127.0.0.1'
+RELAY_PORT = 8000
+RELAY_BURST_SIZE = 64 * 1024
+RELAY_BACKLOG_SIZE = 1024 * 1024
+RELAY_MAX_CLIENTS = 500
+RELAY_ICY_METAINT = 16 * 1024
+RELAY_CLIENT_TIMEOUT = 10.0
+# Caps the data queued by the OS for each client, so a slow client falls behind in the backlog
+RELAY_SEND_BUFFER_SIZE = 64 * 1024
+
+STANDBY_GRACE_TIME = 60.0
+STANDBY_BUFFER_SIZE = 64 * 1024
+STANDBY_BANDWIDTH = 4 * 1024
+# The standby read rate is at least the stream bitrate with this headroom, so it keeps up with live
+STANDBY_BANDWIDTH_HEADROOM = 1.1
+STANDBY_MAX_LAG = 10.0
+
+# Preferred sounddevice host API, if it has an output device. Resolved on first use.
+SOUNDDEVICE_PREFERRED_HOST_API = 'Windows WASAPI'
+DEVICE_CACHE_TIME = 30.0
+DEVICE_ENUMERATION_TIMEOUT = 5.0
 
 RECENT_SONGS_URL = 'https://radio.jump.bg/recentfeed/mnikolov/json'
 RECENT_SONGS_CACHE_TIME = 10.0
+RECENT_SONGS_STALE_TIME = 300.0
+RECENT_SONGS_ERROR_BACKOFF_MIN = 5.0
+RECENT_SONGS_ERROR_BACKOFF_MAX = 120.0
 RECENT_SONGS_UPDATE_TIME = 30.0
+RECENT_SONGS_UPDATE_TIME_MAX = 300.0
+RECENT_SONGS_TRACK_END_MARGIN = 5.0
+RECENT_SONGS_TIMESTAMP_UPDATE_TIME = 30.0
+
+# Stations are keyed by name, the recent songs feed URL is optional
+DEFAULT_STATION = 'Eternal Radio'
+STATIONS = {
+    DEFAULT_STATION: {
+        'stream-url': STREAM_URL,
+        'recent-songs-url': RECENT_SONGS_URL
+    }
+}
+# Number of the stations switched away from last kept connected at the standby bandwidth
+PREWARM_STATIONS = 0
+
+LOG_QUEUE_SIZE = 10000
+# Time to wait for room in a full log queue at shutdown before a record is dropped for it
+LOG_STOP_TIMEOUT = 0.1
+
+CONSOLE_MAX_LINES = 1000
+CONSOLE_FLUSH_INTERVAL = 0.2
 
 LOCALES = ('bg', 'en')
 DEFAULT_LOCALE = 'en'
@@ -66,6 +174,40 @@
 
 CONFIG_DEFAULTS = {
     'connection-timeout': REQUEST_TIMEOUT,
+    'read-timeout': READ_TIMEOUT,
+    'socket-receive-buffer-size': SOCKET_RECEIVE_BUFFER_SIZE,
     'recent-songs-update-time': RECENT_SONGS_UPDATE_TIME,
+    'stream-prebuffer-size': STREAM_PREBUFFER_SIZE,
+    'stream-low-watermark': STREAM_LOW_WATERMARK,
+    'stream-high-watermark': STREAM_HIGH_WATERMARK,
+    'stream-chunk-size': STREAM_ITER_CHUNK_SIZE,
+    'decode-ahead-time': PLAYER_DECODE_AHEAD_TIME,
+    'reconnect-attempts': RECONNECT_ATTEMPTS,
+    'stall-timeout': STREAM_STALL_TIMEOUT,
+    'warm-standby': False,
+    'standby-grace-time': STANDBY_GRACE_TIME,
+    'standby-buffer-size': STANDBY_BUFFER_SIZE,
+    'standby-bandwidth': STANDBY_BANDWIDTH,
+    'output-sink': OUTPUT_SINK,
+    'output-sink-path': None,
+    'sample-format': OUTPUT_SAMPLE_FORMAT,
+    'resampler': RESAMPLER,
+    'dither': DITHER,
+    'latency-profile': LATENCY_PROFILE,
+    'output-blocksizes': {},
+    'recording-directory': None,
+    'timeshift': False,
+    'timeshift-length': TIMESHIFT_LENGTH,
+    'timeshift-directory': None,
+    'stations': STATIONS,
+    'station': DEFAULT_STATION,
+    'prewarm-stations': PREWARM_STATIONS,
+    'relay-address': RELAY_ADDRESS,
+    'relay-port': RELAY_PORT,
+    'relay-burst-size': RELAY_BURST_SIZE,
+    'relay-backlog-size': RELAY_BACKLOG_SIZE,
+    'relay-max-clients': RELAY_MAX_CLIENTS,
+    'console-max-lines': CONSOLE_MAX_LINES,
+    'device-params': {},
     'volume': 1.0
 }
@@ -0,0 +1,135 @@
+import logging
+import time
+import miniaudio
+import numpy
+from threading import Thread
+
+from .buffers import SampleRingBuffer
+from .constants import PLAYER_DECODE_AHEAD_TIME, PLAYER_FRAME_COUNT
+
+
+log = logging.getLogger(__name__)
+
+SAMPLE_FORMATS = {'int16': miniaudio.SampleFormat.SIGNED16, 'float32': miniaudio.SampleFormat.FLOAT32}
+DITHER_MODES = {
+    'none': miniaudio.DitherMode.NONE,
+    'rectangle': miniaudio.DitherMode.RECTANGLE,
+    'triangle': miniaudio.DitherMode.TRIANGLE
+}
+
+
+class StreamDecoder:
+
+    def __init__(
+        self,
+        source,
+        encoding,
+        sample_rate,
+        channels=2,
+        sample_format='float32',
+        dither='none',
+        frames_to_read=PLAYER_FRAME_COUNT,
+        decode_ahead_time=PLAYER_DECODE_AHEAD_TIME,
+        metadata_callback=None
+    ):
+        buffer_frames = max(int(sample_rate * decode_ahead_time), 2 * frames_to_read)
+        self.buffer = SampleRingBuffer(buffer_frames, channels, sample_format)
+        self.finished = False
+        self.error = None
+        self.source = source
+        self.encoding = encoding
+        self._sample_rate = sample_rate
+        self._channels = channels
+        self._sample_format = sample_format
+        # Dither only applies when float samples are converted to int16
+        self._dither = dither if sample_format == 'int16' else 'none'
+        self._frames_to_read = frames_to_read
+        self._metadata_callback = metadata_callback
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = Thread(target=self._run, name='stream-decoder', daemon=True)
+        self._thread.start()
+
+    def stop(self, close_source=True):
+        # Returns False if the worker is still running, when it's kept waiting for stream data
+        self._running = False
+        # Closing the source wakes up the worker if it's waiting for stream data
+        if close_source:
+            self.source.close()
+        stopped = True
+        if self._thread:
+            self._thread.join(1.0)
+            stopped = not self._thread.is_alive()
+            self._thread = None
+        return stopped
+
+    def _run(self):
+        log.debug('Stream decoder started')
+        # Half the duration of one block, used to pace the worker while the buffer is full or the
+        # source is still buffering
+        idle_time = self._frames_to_read / self._sample_rate / 2
+        input_stream = None
+        try:
+            # miniaudio reads ahead on init to detect the format, which would drain the prebuffer
+            # before the first block is decoded
+            while self._running and not self.source.ready:
+                time.sleep(idle_time)
+            input_stream = miniaudio.stream_any(
+                source=self.source,
+                source_format=self.encoding,
+                output_format=SAMPLE_FORMATS[self._sample_format],
+                nchannels=self._channels,
+                sample_rate=self._sample_rate,
+                frames_to_read=self._frames_to_read,
+                dither=DITHER_MODES[self._dither]
+            )
+            while self._running:
+                # Decoded audio is part of the jitter buffer, so the source is only waited for to
+                # prebuffer again once it ran out. Waiting while decoded audio is left would play
+                # silence when prebuffering takes longer than the decoded audio lasts.
+                if self.buffer.free < self._frames_to_read or (
+                    not self.source.ready and not self.buffer.available
+                ):
+                    time.sleep(idle_time)
+                    continue
+                raw_samples = input_stream.send(self._frames_to_read)
+                samples = numpy.frombuffer(raw_samples, self._sample_format).reshape(-1, self._channels)
+                self.buffer.write(samples)
+                for byte_position, title in self.source.pop_metadata():
+                    self._on_metadata(title, byte_position, self._sample_position(byte_position))
+        except StopIteration:
+            log.debug('Stream decoder reached end of stream')
+        except Exception as e:
+            if self._running:
+                log.error(f'Decoder error: {e}')
+                self.error = e
+        finally:
+            if input_stream:
+                input_stream.close()
+            self.finished = True
+        log.debug('Stream decoder stopped')
+
+    def _sample_position(self, byte_position):
+        # The decoder reads ahead of the samples it returns, so map bytes to samples through the
+        # stream bitrate when known, else through the average ratio of decoded frames to bytes
+        if self.source.bitrate:
+            return int(byte_position * 8 / self.source.bitrate * self._sample_rate)
+        if not self.source.bytes_read:
+            return 0
+        return int(byte_position * self.buffer.frames_written / self.source.bytes_read)
+
+    def _on_metadata(self, title, byte_position, sample_position):
+        if not self._metadata_callback:
+            return
+        try:
+            self._metadata_callback(self, {
+                'type': 'metadata',
+                'title': title,
+                'byte_position': byte_position,
+                'sample_position': sample_position
+            })
+        except Exception as e:
+            log.error(f'Metadata callback error: {e}')
@@ -0,0 +1,225 @@
+import logging
+import time
+import sounddevice
+from threading import Event, Lock, RLock, Thread
+from types import MappingProxyType
+
+from .constants import DEVICE_CACHE_TIME, SOUNDDEVICE_PREFERRED_HOST_API
+
+
+log = logging.getLogger(__name__)
+
+
+_host_api_index = None
+
+# PortAudio is only re-initialized while no output streams are open, since that closes them. The
+# queries that could run meanwhile on other threads hold the lock too.
+_portaudio_lock = RLock()
+_open_streams = 0
+
+
+def get_host_api_index():
+    global _host_api_index
+    with _portaudio_lock:
+        if _host_api_index is None:
+            for index, host_api in enumerate(sounddevice.query_hostapis()):
+                if host_api['name'] == SOUNDDEVICE_PREFERRED_HOST_API and host_api['default_output_device'] != -1:
+                    _host_api_index = index
+                    break
+            else:
+                _host_api_index = sounddevice.default.hostapi
+        return _host_api_index
+
+
+def reinitialize_portaudio():
+    # Lets PortAudio see added and removed devices, returns False if output streams are open
+    global _host_api_index
+    with _portaudio_lock:
+        if _open_streams:
+            return False
+        log.debug('Re-initializing PortAudio')
+        sounddevice._terminate()
+        sounddevice._initialize()
+        _host_api_index = None
+    return True
+
+
+def open_output_stream(**kwargs):
+    global _open_streams
+    with _portaudio_lock:
+        stream = sounddevice.OutputStream(**kwargs)
+        _open_streams += 1
+    return stream
+
+
+def close_output_stream(stream):
+    global _open_streams
+    with _portaudio_lock:
+        if stream.closed:
+            return
+        stream.close()
+        _open_streams -= 1
+        streams_closed = not _open_streams
+    # A re-initialization put off while streams were open is done now
+    registry = _device_registry
+    if streams_closed and registry is not None and registry.reinitialize_pending:
+        registry.invalidate()
+
+
+def get_output_device(device_index=None, host_api_index=None):
+    with _portaudio_lock:
+        if host_api_index is None:
+            host_api_index = get_host_api_index()
+        host_api = sounddevice.query_hostapis(host_api_index)
+        if device_index is None:
+            device_index = host_api['default_output_device']
+        elif device_index not in host_api['devices']:
+            raise ValueError(f"Output device with index '{device_index}' not found")
+        try:
+            device = sounddevice.query_devices(device_index, 'output')
+        except (sounddevice.PortAudioError, ValueError) as e:
+            raise ValueError(f"Output device with index '{device_index}' not found") from e
+    return {
+        'name': device['name'],
+        'host_api': host_api['name'],
+        'sample_rate': int(device['default_samplerate']),
+        'index': device_index
+    }
+
+
+def get_output_devices(host_api_index=None):
+    with _portaudio_lock:
+        if host_api_index is None:
+            host_api_index = get_host_api_index()
+        host_api_name = sounddevice.query_hostapis(host_api_index)['name']
+        # A single query for all devices instead of one per device of the host API
+        all_devices = sounddevice.query_devices()
+    devices = []
+    for device_index, device in enumerate(all_devices):
+        if device['hostapi'] != host_api_index or device['max_output_channels'] < 1:
+            continue
+        devices.append({
+            'name': device['name'],
+            'host_api': host_api_name,
+            'sample_rate': int(device['default_samplerate']),
+            'index': device_index
+        })
+    return devices
+
+
+def device_params_key(device, sample_rate, channels):
+    # Device indexes change when devices are added or removed, names and host APIs don't
+    return f"{device['host_api']}/{device['name']}/{sample_rate}/{channels}"
+
+
+def output_blocksize_key(device, latency_profile):
+    return f"{device['host_api']}/{device['name']}/{latency_profile}"
+
+
+def check_output_device_params(device_index, channels, sample_rate, sample_width):
+    try:
+        with _portaudio_lock:
+            sounddevice.check_output_settings(
+                device=device_index,
+                channels=channels,
+                dtype=sample_width,
+                samplerate=sample_rate
+            )
+    except sounddevice.PortAudioError as e:
+        if e.args[1] == -9996:
+            raise ValueError(f"Invalid device with index '{device_index}'") from e
+        log.debug(
+            f'Incompatible device parameters: Index: {device_index}, Channels: {channels}, '
+            f'Width: {sample_width}, Rate: {sample_rate}, Error: {e}'
+        )
+        return False
+    return True
+
+
+class OutputDeviceRegistry:
+
+    # Keeps an immutable snapshot of the output devices, enumerated in a background thread so
+    # callers never wait for PortAudio. A stale snapshot is returned while it's refreshed.
+    # PortAudio only sees added or removed devices after it's re-initialized, which is done by
+    # invalidate(reinitialize=True) when output fails or the device list is opened.
+
+    def __init__(self, cache_time=DEVICE_CACHE_TIME):
+        self.cache_time = cache_time
+        self._devices = None
+        self._updated = 0.0
+        self._reinitialize = False
+        self._refresh_done = None
+        self._lock = Lock()
+
+    @property
+    def reinitialize_pending(self):
+        return self._reinitialize
+
+    def get_devices(self, timeout=0):
+        # Waits up to timeout (forever if None) only when nothing was enumerated yet
+        with self._lock:
+            devices = self._devices
+            refresh_done = None
+            if devices is None or time.monotonic() - self._updated > self.cache_time:
+                refresh_done = self._start_refresh()
+        if devices is None and refresh_done is not None and timeout != 0:
+            refresh_done.wait(timeout)
+            devices = self._devices
+        return devices or ()
+
+    def get_device(self, device_index, timeout=0):
+        for device in self.get_devices(timeout):
+            if device['index'] == device_index:
+                return device
+        raise ValueError(f"Output device with index '{device_index}' not found")
+
+    def refresh(self):
+        with self._lock:
+            return self._start_refresh()
+
+    def invalidate(self, reinitialize=False):
+        # With reinitialize, PortAudio is re-initialized before the devices are enumerated again,
+        # or after the last output stream is closed if any are open
+        with self._lock:
+            self._updated = 0.0
+            self._reinitialize = self._reinitialize or reinitialize
+            return self._start_refresh()
+
+    def _start_refresh(self):
+        if self._refresh_done is None:
+            self._refresh_done = Event()
+            Thread(target=self._refresh, name='device-registry-refresh', daemon=True).start()
+        return self._refresh_done
+
+    def _refresh(self):
+        started = time.perf_counter()
+        devices = None
+        try:
+            if self._reinitialize and reinitialize_portaudio():
+                with self._lock:
+                    self._reinitialize = False
+            devices = tuple(MappingProxyType(device) for device in get_output_devices())
+        except (sounddevice.PortAudioError, ValueError) as e:
+            log.error(f'Could not enumerate output devices: {e}')
+        finally:
+            # Waiters are released and later refreshes can start even after an unexpected error
+            with self._lock:
+                if devices is not None:
+                    if devices != self._devices:
+                        log.debug(f'Enumerated {len(devices)} output devices in {time.perf_counter() - started:.3f}s')
+                    self._devices = devices
+                    self._updated = time.monotonic()
+                self._refresh_done.set()
+                self._refresh_done = None
+
+
+_device_registry = None
+_device_registry_lock = Lock()
+
+
+def get_device_registry():
+    global _device_registry
+    with _device_registry_lock:
+        if _device_registry is None:
+            _device_registry = OutputDeviceRegistry()
+        return _device_registry
@@ -0,0 +1,93 @@
+import numpy
+
+
+def _scratch_buffer(frames, channels, dtype):
+    # Integer samples are processed in a float buffer and rounded back once, float ones in place
+    if numpy.issubdtype(dtype, numpy.floating):
+        return None
+    return numpy.zeros((frames, channels), numpy.float32)
+
+
+def _round_into(output, scratch):
+    numpy.rint(scratch, out=scratch)
+    numpy.copyto(output, scratch, casting='unsafe')
+
+
+class GainRamp:
+
+    # Applies gain in place. Gain changes are spread over one block as a linear ramp to avoid
+    # clicks, using preallocated buffers so nothing is allocated per block. The gain never
+    # exceeds 1.0, so rounded integer samples can't overflow.
+
+    def __init__(self, blocksize, channels, dtype=numpy.float32, gain=1.0):
+        self.target = gain
+        self._channels = channels
+        self._dtype = dtype
+        self._gain = gain
+        self._steps = None
+        self._ramp = None
+        self._scratch = None
+        self._resize(blocksize)
+
+    def apply(self, output):
+        target = self.target
+        if target == self._gain:
+            if target == 1.0:
+                return
+            gain = target
+        else:
+            if len(output) != len(self._steps):
+                self._resize(len(output))
+            numpy.multiply(self._steps, target - self._gain, out=self._ramp)
+            numpy.add(self._ramp, self._gain, out=self._ramp)
+            gain = self._ramp
+            self._gain = target
+        if self._scratch is None:
+            numpy.multiply(output, gain, out=output)
+            return
+        if len(output) != len(self._scratch):
+            self._resize(len(output))
+        numpy.multiply(output, gain, out=self._scratch)
+        _round_into(output, self._scratch)
+
+    def _resize(self, frames):
+        self._steps = numpy.linspace(0.0, 1.0, frames + 1, dtype=numpy.float32)[1:].reshape(-1, 1)
+        self._ramp = numpy.empty_like(self._steps)
+        self._scratch = _scratch_buffer(frames, self._channels, self._dtype)
+
+
+class Crossfade:
+
+    # Mixes one block of a new source into the output with linear fade in/out ramps, using
+    # preallocated buffers like GainRamp. The ramps sum to 1.0, so integer samples can't overflow.
+
+    def __init__(self, blocksize, channels, dtype=numpy.float32):
+        self._channels = channels
+        self._dtype = dtype
+        self._fade_in = None
+        self._fade_out = None
+        self._incoming = None
+        self._scratch = None
+        self._resize(blocksize)
+
+    def mix(self, output, ring_buffer):
+        frames = len(output)
+        if frames != len(self._fade_in):
+            self._resize(frames)
+        ring_buffer.read_into(self._incoming)
+        if self._scratch is None:
+            numpy.multiply(output, self._fade_out, out=output)
+            numpy.multiply(self._incoming, self._fade_in, out=self._incoming)
+            numpy.add(output, self._incoming, out=output)
+            return
+        # output + (incoming - output) * fade_in, computed in float
+        numpy.subtract(self._incoming, output, out=self._scratch, dtype=numpy.float32)
+        numpy.multiply(self._scratch, self._fade_in, out=self._scratch)
+        numpy.add(self._scratch, output, out=self._scratch, dtype=numpy.float32)
+        _round_into(output, self._scratch)
+
+    def _resize(self, frames):
+        self._fade_in = numpy.linspace(0.0, 1.0, frames, dtype=numpy.float32).reshape(-1, 1)
+        self._fade_out = 1.0 - self._fade_in
+        self._incoming = numpy.zeros((frames, self._channels), self._dtype)
+        self._scratch = _scratch_buffer(frames, self._channels, self._dtype)
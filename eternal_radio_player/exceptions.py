@@ -14,6 +14,14 @@ class PlayerError(EternalRadioPlayerError):
     pass
 
 
+class OutputError(EternalRadioPlayerError):
+    pass
+
+
+class RelayError(EternalRadioPlayerError):
+    pass
+
+
 class ResourceError(EternalRadioPlayerError):
     pass
 
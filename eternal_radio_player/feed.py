@@ -0,0 +1,238 @@
+import json
+import logging
+import statistics
+import time
+import requests.exceptions
+from threading import Event, Lock, Thread
+from types import MappingProxyType
+
+from .constants import (
+    RECENT_SONGS_CACHE_TIME,
+    RECENT_SONGS_ERROR_BACKOFF_MAX,
+    RECENT_SONGS_ERROR_BACKOFF_MIN,
+    RECENT_SONGS_STALE_TIME,
+    RECENT_SONGS_TRACK_END_MARGIN,
+    RECENT_SONGS_UPDATE_TIME,
+    RECENT_SONGS_UPDATE_TIME_MAX,
+    RECENT_SONGS_URL,
+    REQUEST_TIMEOUT
+)
+from .exceptions import PlayerError
+from .transport import get_transport
+
+
+log = logging.getLogger(__name__)
+
+
+def parse_recent_songs(data):
+    try:
+        items = data['items']
+        recent_songs = []
+        for recent_song in items:
+            title = recent_song['title'][:-6].strip() # Remove ID '[XXXX]' at the end
+            timestamp = min(int(recent_song['date']), int(time.time()))
+            recent_songs.append(MappingProxyType({'title': title, 'timestamp': timestamp}))
+    except (KeyError, TypeError, ValueError) as e:
+        raise PlayerError('Received bad recent songs data') from e
+    return tuple(recent_songs)
+
+
+class RecentSongsCachePolicy:
+
+    # Cache state and decisions shared by RecentSongsCache and the event loop cache in aio.py,
+    # which only differ in how they fetch and how concurrent callers wait. A list is served
+    # fresh for cache_time, then stale for stale_time while it's revalidated in the background.
+    # Failed fetches are cached too and retried after an exponential backoff.
+
+    def __init__(
+        self,
+        url=RECENT_SONGS_URL,
+        cache_time=RECENT_SONGS_CACHE_TIME,
+        stale_time=RECENT_SONGS_STALE_TIME,
+        error_backoff_min=RECENT_SONGS_ERROR_BACKOFF_MIN,
+        error_backoff_max=RECENT_SONGS_ERROR_BACKOFF_MAX
+    ):
+        self.url = url
+        self.cache_time = cache_time
+        self.stale_time = stale_time
+        self.error_backoff_min = error_backoff_min
+        self.error_backoff_max = error_backoff_max
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._data = None
+        self._updated = 0.0
+        self._etag = None
+        self._last_modified = None
+        self._error = None
+        self._error_backoff = 0.0
+        self._retry_time = 0.0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'errors': self.errors
+        }
+
+    def _lookup(self, max_age, fetching):
+        # Returns the list to serve, or None to wait for a fetch, and whether to start a fetch.
+        # With max_age, a list older than that isn't served stale, it's revalidated and waited for.
+        now = time.monotonic()
+        age = now - self._updated
+        cache_time = self.cache_time if max_age is None else min(max_age, self.cache_time)
+        stale_time = self.stale_time if max_age is None else 0.0
+        if self._data is not None and age <= cache_time:
+            self.hits += 1
+            return self._data, False
+        if self._data is not None and age <= cache_time + stale_time:
+            # Serve the stale list and revalidate in the background
+            self.stale_hits += 1
+            return self._data, not fetching and now >= self._retry_time
+        if not fetching and now < self._retry_time:
+            if self._data is not None and age <= self.cache_time + self.stale_time:
+                # Backing off after an error, the stale list is still better than nothing
+                self.stale_hits += 1
+                return self._data, False
+            raise PlayerError(f'Could not fetch recent songs: {self._error}')
+        self.misses += 1
+        return None, not fetching
+
+    def _request_headers(self):
+        headers = {}
+        if self._etag:
+            headers['If-None-Match'] = self._etag
+        if self._last_modified:
+            headers['If-Modified-Since'] = self._last_modified
+        return headers
+
+    def _store(self, data, response_headers, error):
+        # data is None if the list was not modified, response_headers is None on error
+        if error is None:
+            if data is not None:
+                self._data = data
+                self._etag = response_headers.get('ETag')
+                self._last_modified = response_headers.get('Last-Modified')
+            else:
+                log.debug('Recent songs not modified')
+            self._updated = time.monotonic()
+            self._error = None
+            self._error_backoff = 0.0
+            self._retry_time = 0.0
+        else:
+            log.debug(f'Could not fetch recent songs: {error}')
+            self.errors += 1
+            self._error = error
+            self._error_backoff = min(
+                max(self._error_backoff * 2, self.error_backoff_min),
+                self.error_backoff_max
+            )
+            self._retry_time = time.monotonic() + self._error_backoff
+
+    def _result(self):
+        # The list after a fetch the caller waited for
+        if self._data is not None and self._error is None:
+            return self._data
+        raise PlayerError(f'Could not fetch recent songs: {self._error}')
+
+
+class RecentSongsCache(RecentSongsCachePolicy):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._fetch_done = None
+        self._lock = Lock()
+
+    def get(self, timeout=REQUEST_TIMEOUT, max_age=None):
+        with self._lock:
+            data, fetch = self._lookup(max_age, self._fetch_done is not None)
+            if fetch:
+                self._fetch_done = Event()
+            if data is not None:
+                if fetch:
+                    Thread(target=self._fetch, args=(timeout,), name='recent-songs-fetch', daemon=True).start()
+                return data
+            fetch_done = self._fetch_done
+
+        # Concurrent callers share the request made by the first one
+        if fetch:
+            self._fetch(timeout)
+        elif not fetch_done.wait(timeout * 2):
+            raise PlayerError('Could not fetch recent songs: Timed out waiting for request')
+
+        with self._lock:
+            return self._result()
+
+    def _fetch(self, timeout):
+        # Waiting callers are released even if the fetch fails unexpectedly
+        try:
+            self._update(timeout)
+        finally:
+            with self._lock:
+                self._fetch_done.set()
+                self._fetch_done = None
+
+    def _update(self, timeout):
+        data = None
+        response_headers = None
+        error = None
+        try:
+            response = get_transport().get(self.url, timeout=timeout, headers=self._request_headers())
+            response.raise_for_status()
+            if response.status_code != 304:
+                data = parse_recent_songs(response.json())
+            response_headers = response.headers
+        except (requests.exceptions.RequestException, json.JSONDecodeError, PlayerError) as e:
+            error = e
+        with self._lock:
+            self._store(data, response_headers, error)
+
+
+class RecentSongsSchedule:
+
+    # Decides when to refresh the recent songs next. The interval doubles while the list is
+    # unchanged, and a refresh is moved earlier to just after the current song is expected to
+    # end, estimated from the typical gap between the feed timestamps.
+
+    def __init__(
+        self,
+        update_time=RECENT_SONGS_UPDATE_TIME,
+        max_update_time=RECENT_SONGS_UPDATE_TIME_MAX,
+        track_end_margin=RECENT_SONGS_TRACK_END_MARGIN
+    ):
+        self.update_time = update_time
+        self.max_update_time = max_update_time
+        self.track_end_margin = track_end_margin
+        self._interval = update_time
+        self._last_song = None
+
+    def reset(self):
+        self._interval = self.update_time
+        self._last_song = None
+
+    def next_delay(self, recent_songs=None):
+        # Pass None after a failed update to retry at the current interval
+        if recent_songs is None:
+            return self._interval
+        last_song = recent_songs[0] if recent_songs else None
+        if last_song != self._last_song:
+            self._last_song = last_song
+            self._interval = self.update_time
+        else:
+            self._interval = min(self._interval * 2, max(self.max_update_time, self.update_time))
+        song_end = self.estimate_song_end(recent_songs)
+        if song_end is not None:
+            delay = song_end + self.track_end_margin - time.time()
+            if 0 < delay < self._interval:
+                return delay
+        return self._interval
+
+    @staticmethod
+    def estimate_song_end(recent_songs):
+        timestamps = sorted((song['timestamp'] for song in recent_songs), reverse=True)
+        durations = [a - b for a, b in zip(timestamps, timestamps[1:]) if a > b]
+        if not durations:
+            return None
+        return timestamps[0] + statistics.median(durations)
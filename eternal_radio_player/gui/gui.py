@@ -1,19 +1,26 @@
 import logging
-import time
-import timeago
 import qdarktheme
 from functools import partial
 from PySide6 import QtCore, QtGui, QtWidgets
 
 from ..config import Config
-from ..constants import CREDITS, LOCALES, RECENT_SONGS_UPDATE_TIME, REQUEST_TIMEOUT
+from ..constants import (
+    CREDITS,
+    LOCALES,
+    RECENT_SONGS_TIMESTAMP_UPDATE_TIME,
+    RECENT_SONGS_UPDATE_TIME,
+    REQUEST_TIMEOUT
+)
 from ..exceptions import PlayerError
-from ..player import get_output_devices, RadioPlayer
+from ..feed import RecentSongsSchedule
+from ..player import RadioPlayer
 from ..utils import qt_resource, system_info
 from .generated.main_window import Ui_MainWindow
 from ..i18n import I18n
+from ..logging_ import LogPipeline
 from .logging_ import QPlainTextEditHandler
-from .widgets import RecentSong
+from .models import RecentSongsModel
+from .widgets import RecentSongDelegate
 
 
 log = logging.getLogger(__name__)
@@ -22,62 +29,117 @@
 
 class RecentSongsUpdateWorker(QtCore.QObject):
 
-    result = QtCore.Signal(list)
-
-    def __init__(self, update_time=RECENT_SONGS_UPDATE_TIME, timeout=REQUEST_TIMEOUT, **kwargs):
+    result = QtCore.Signal(object)
+    _settings_changed = QtCore.Signal(float, float)
+    _stop_requested = QtCore.Signal()
+
+    def __init__(
+        self,
+        get_recent_songs,
+        update_time=RECENT_SONGS_UPDATE_TIME,
+        timeout=REQUEST_TIMEOUT,
+        **kwargs
+    ):
         super().__init__(**kwargs)
-        self.update_time = update_time
         self.timeout = timeout
-        self._running = False
-
+        self._get_recent_songs = get_recent_songs
+        self._schedule = RecentSongsSchedule(update_time)
+        self._timer = None
+        # Emitted from the GUI thread, delivered to the slots in the worker thread
+        self._settings_changed.connect(self._on_settings_changed)
+        self._stop_requested.connect(self._on_stop)
+
+    @QtCore.Slot()
     def run(self):
-        self._running = True
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._update)
+        self._update()
+
+    def set_settings(self, update_time, timeout):
+        self._settings_changed.emit(update_time, timeout)
+
+    def stop(self):
+        self._stop_requested.emit()
+
+    @QtCore.Slot()
+    def _update(self):
+        # The schedule needs the current list to tell whether it changed, not a stale cached one
         try:
-            data = RadioPlayer.get_recent_songs(self.timeout)
+            data = self._get_recent_songs(self.timeout, max_age=0)
         except PlayerError as e:
             log.error(f'Recent songs update worker error: {e}')
+            data = None
         else:
             self.result.emit(data)
-        last_update = time.time()
-        while self._running:
-            if time.time() - last_update < self.update_time:
-                time.sleep(1)
-                continue
-            try:
-                data = RadioPlayer.get_recent_songs(self.timeout)
-            except PlayerError as e:
-                log.error(f'Recent songs update worker error: {e}')
-            else:
-                self.result.emit(data)
-            last_update = time.time()
+        delay = self._schedule.next_delay(data)
+        log.debug(f'Next recent songs update in {delay:.1f}s')
+        self._timer.start(int(delay * 1000))
 
-    def stop(self):
-        self._running = False
+    @QtCore.Slot(float, float)
+    def _on_settings_changed(self, update_time, timeout):
+        self.timeout = timeout
+        self._schedule.update_time = update_time
+        self._schedule.reset()
+        if self._timer:
+            self._timer.stop()
+            self._update()
+
+    @QtCore.Slot()
+    def _on_stop(self):
+        if self._timer:
+            self._timer.stop()
+        self.thread().quit()
 
 
 class MainWindow(QtWidgets.QMainWindow):
 
-    def __init__(self, *args, logging_level=logging.INFO, **kwargs):
+    # Player events come from the player threads and are handled in the GUI thread
+    player_event = QtCore.Signal(object)
+
+    def __init__(self, *args, logging_level=logging.INFO, output_sink=None, output_path=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.ui = Ui_MainWindow()
         self.ui.setupUi(self)
 
         # Set up logging handler for the console
         log.debug('Initializing GUI console logging handler')
-        root_logger = logging.getLogger()
-        self.console_handler = QPlainTextEditHandler(self.ui.console, level=logging_level)
+        self.console_handler = QPlainTextEditHandler(
+            self.ui.console,
+            level=logging_level,
+            max_lines=Config.data['console-max-lines']
+        )
         formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s', '%H:%M:%S')
         self.console_handler.setFormatter(formatter)
-        self.console_handler.message.connect(self.ui.console.appendPlainText)
-        root_logger.addHandler(self.console_handler)
+        # Buffered records are written out once the console page is shown
+        self.ui.main_widget.currentChanged.connect(lambda _: self.console_handler.flush_records())
+        LogPipeline.add_handler(self.console_handler)
 
         self.retranslate_ui()
 
-        self.player = RadioPlayer(Config.data['output-device'], Config.data['connection-timeout'])
-        self.player.set_volume(Config.data['volume'])
-        Config.data['output-device'] = self.player.output_device['index']
+        # The player is created for the configured station, or the fallback one if it's gone
+        Config.data['station'] = Config.get_station()[0]
+        try:
+            self.player = RadioPlayer.from_config(Config.data, output_sink=output_sink, output_path=output_path)
+        except PlayerError:
+            LogPipeline.remove_handler(self.console_handler)
+            raise
+        self.player_event.connect(self.on_player_event)
+        self._player_event_listener = self.player_event.emit
+        self.player.add_event_listener(self._player_event_listener)
+        # Sinks without a device don't replace the saved one
+        if self.player.output_device['index'] is not None:
+            Config.data['output-device'] = self.player.output_device['index']
+        self.player.start_standby()
+        if self.player.uses_output_device:
+            # Imported only for device sinks, importing sounddevice fails without PortAudio
+            from ..devices import get_device_registry
+
+            # Enumerate the output devices in the background before the menu is first opened
+            get_device_registry().refresh()
         self.playing = False
         self.muted = False
+        self.recording = False
 
         self.play_icon_normal = QtGui.QIcon(':icons/play.svg')
         self.play_icon_accent = QtGui.QIcon(':icons/play_accent.svg')
@@ -87,6 +149,9 @@ def __init__(self, *args, logging_level=logging.INFO, **kwargs):
         self.volume_normal_icon_accent = QtGui.QIcon(':icons/volume-normal_accent.svg')
         self.volume_muted_icon_normal = QtGui.QIcon(':icons/volume-muted.svg')
         self.volume_muted_icon_accent = QtGui.QIcon(':icons/volume-muted_accent.svg')
+        self.record_icon_normal = QtGui.QIcon(':icons/record.svg')
+        self.record_icon_accent = QtGui.QIcon(':icons/record_accent.svg')
+        self.recording_icon = QtGui.QIcon(':icons/recording.svg')
         self.output_device_icon_normal = QtGui.QIcon(':icons/output-device.svg')
         self.output_device_icon_accent = QtGui.QIcon(':icons/output-device_accent.svg')
         self.console_icon_normal = QtGui.QIcon(':icons/console.svg')
@@ -105,13 +170,16 @@ def __init__(self, *args, logging_level=logging.INFO, **kwargs):
             widget.hovered.connect(fn)
             widget.focused.connect(fn)
 
-        # Assign special handlers for play/stop and mute/unmute button events
+        # Assign special handlers for play/stop, mute/unmute and record button events
         self.ui.play_button.hovered.connect(self.set_play_button_icon)
         self.ui.play_button.focused.connect(self.set_play_button_icon)
         self.ui.play_button.toggled.connect(self.on_play)
         self.ui.volume_button.hovered.connect(self.set_volume_button_icon)
         self.ui.volume_button.focused.connect(self.set_volume_button_icon)
         self.ui.volume_button.clicked.connect(self.on_mute)
+        self.ui.record_button.hovered.connect(self.set_record_button_icon)
+        self.ui.record_button.focused.connect(self.set_record_button_icon)
+        self.ui.record_button.clicked.connect(self.on_record)
 
         self.ui.volume_slider.setValue(int(Config.data['volume'] * 100))
         self.ui.volume_slider.valueChanged.connect(self.on_volume_change)
@@ -119,6 +187,8 @@ def __init__(self, *args, logging_level=logging.INFO, **kwargs):
         self.output_device_menu = QtWidgets.QMenu(self.ui.controls_widget)
         self.output_device_menu.setObjectName('output_device_menu')
         self.ui.output_device_button.clicked.connect(self.open_output_devices_menu)
+        # Sinks without a device have no devices to choose from
+        self.ui.output_device_button.setEnabled(self.player.uses_output_device)
 
         self.ui.console_button.clicked.connect(lambda: self.ui.main_widget.setCurrentIndex(1))
         self.ui.settings_button.clicked.connect(lambda: self.ui.main_widget.setCurrentIndex(2))
@@ -149,14 +219,21 @@ def __init__(self, *args, logging_level=logging.INFO, **kwargs):
         self.ui.settings_back_button.clicked.connect(lambda: self.ui.main_widget.setCurrentIndex(0))
 
         # Setup recent songs page widgets
-        self.recent_songs_container_layout = QtWidgets.QVBoxLayout(self.ui.recent_songs_container)
-        self.recent_songs_container_layout.setContentsMargins(0, 0, 0, 0)
-        self.recent_songs_spacer = QtWidgets.QSpacerItem(0, 0, QtWidgets.QSizePolicy.Fixed, QtWidgets.QSizePolicy.Expanding)
+        self.recent_songs_model = RecentSongsModel(self)
+        self.ui.recent_songs.setModel(self.recent_songs_model)
+        self.ui.recent_songs.setItemDelegate(RecentSongDelegate(self.ui.recent_songs))
+        self.recent_songs_timestamp_timer = QtCore.QTimer(self)
+        self.recent_songs_timestamp_timer.setInterval(int(RECENT_SONGS_TIMESTAMP_UPDATE_TIME * 1000))
+        self.recent_songs_timestamp_timer.timeout.connect(self.recent_songs_model.refresh_timestamps)
+        self.recent_songs_timestamp_timer.start()
 
         # Setup recent songs update worker
-        self.recent_songs_widgets = []
         self.recent_songs_update_worker_thread = QtCore.QThread(self)
-        self.recent_songs_update_worker = RecentSongsUpdateWorker(Config.data['recent-songs-update-time'])
+        self.recent_songs_update_worker = RecentSongsUpdateWorker(
+            self.player.get_recent_songs,
+            Config.data['recent-songs-update-time'],
+            Config.data['connection-timeout']
+        )
         self.recent_songs_update_worker.result.connect(self.update_recent_songs)
         self.recent_songs_update_worker.moveToThread(self.recent_songs_update_worker_thread)
         self.recent_songs_update_worker_thread.started.connect(self.recent_songs_update_worker.run)
@@ -192,6 +269,27 @@ def on_mute(self, state):
             self.player.set_volume(self.ui.volume_slider.value() / 100)
             self.ui.volume_button.setToolTip(t('volume_button_tooltip_mute'))
 
+    def on_record(self, state):
+        if state:
+            try:
+                self.player.start_recording()
+            except PlayerError as e:
+                log.error(f'Could not start recording: {e}')
+                self.ui.record_button.setChecked(False)
+                return
+            self.ui.record_button.setToolTip(t('record_button_tooltip_stop'))
+        else:
+            self.player.stop_recording()
+            self.ui.record_button.setToolTip(t('record_button_tooltip_start'))
+        self.recording = state
+        self.set_record_button_icon(self.ui.record_button.underMouse() or self.ui.record_button.hasFocus())
+
+    def on_player_event(self, event):
+        # The recording stops by itself on a write error
+        if event['type'] == 'recording' and 'error' in event and self.recording:
+            self.ui.record_button.setChecked(False)
+            self.on_record(False)
+
     def on_volume_change(self, value):
         volume = value / 100
         if not self.muted:
@@ -231,9 +329,23 @@ def set_volume_button_icon(self, highlight):
                 highlight
             )
 
+    def set_record_button_icon(self, highlight):
+        if self.recording:
+            self.set_widget_icon(self.ui.record_button, self.recording_icon, self.record_icon_accent, highlight)
+        else:
+            self.set_widget_icon(self.ui.record_button, self.record_icon_normal, self.record_icon_accent, highlight)
+
     def open_output_devices_menu(self):
+        from ..devices import get_device_registry
+
         self.output_device_menu.clear()
-        for output_device in get_output_devices():
+        device_registry = get_device_registry()
+        output_devices = device_registry.get_devices()
+        # Added and removed devices show up the next time the menu is opened
+        device_registry.invalidate(reinitialize=True)
+        if not output_devices:
+            self.output_device_menu.addAction(t('output_device_menu_loading')).setEnabled(False)
+        for output_device in output_devices:
             action = self.output_device_menu.addAction(output_device['name'])
             action.setData(output_device)
             action.triggered.connect(partial(self.on_output_device_change, action))
@@ -245,39 +357,24 @@ def save_settings(self):
         self.retranslate_ui()
         Config.data['language'] = locale
         connection_timeout = self.ui.connection_timeout_input.value()
-        self.recent_songs_update_worker.timeout = connection_timeout
         Config.data['connection-timeout'] = connection_timeout
         recent_songs_update_time = self.ui.recent_songs_update_time_input.value()
-        self.recent_songs_update_worker.update_time = recent_songs_update_time
         Config.data['recent-songs-update-time'] = recent_songs_update_time
+        self.recent_songs_update_worker.set_settings(recent_songs_update_time, connection_timeout)
         Config.save()
 
     def update_recent_songs(self, recent_songs):
-        for recent_song_widget in self.recent_songs_widgets:
-            recent_song_widget.deleteLater()
-        self.recent_songs_widgets.clear()
-        self.recent_songs_container_layout.removeItem(self.recent_songs_spacer)
-
-        for i, recent_song in enumerate(recent_songs):
-            title = recent_song['title']
-            timestamp = recent_song['timestamp']
-            timestamp_fmt = timeago.format(timestamp)
-
-            recent_song = RecentSong(self.ui.recent_songs_container, title, timestamp_fmt)
-            recent_song.setObjectName('recent_song_entry')
-            if i % 2 == 0:
-                recent_song.setProperty('class', 'alternate')
-
-            self.recent_songs_container_layout.addWidget(recent_song)
-            self.recent_songs_widgets.append(recent_song)
-        self.recent_songs_container_layout.addSpacerItem(self.recent_songs_spacer)
+        self.recent_songs_model.set_recent_songs(recent_songs)
 
     def closeEvent(self, event):
         log.debug('Stopping recent songs update worker')
+        # The worker quits its thread as soon as any update in progress is done
         self.recent_songs_update_worker.stop()
-        self.recent_songs_update_worker_thread.quit()
         self.recent_songs_update_worker_thread.wait()
         self.recent_songs_update_worker.deleteLater()
+        self.player.remove_event_listener(self._player_event_listener)
+        self.player.close()
+        LogPipeline.remove_handler(self.console_handler)
         Config.save()
         super().closeEvent(event)
 
@@ -285,6 +382,9 @@ def retranslate_ui(self):
         self.ui.play_button.setToolTip(t('play_button_tooltip_play'))
         self.ui.volume_button.setToolTip(t('volume_button_tooltip_mute'))
         self.ui.volume_slider.setToolTip(t('volume_slider_tooltip'))
+        self.ui.record_button.setToolTip(
+            t('record_button_tooltip_stop' if self.ui.record_button.isChecked() else 'record_button_tooltip_start')
+        )
         self.ui.output_device_button.setToolTip(t('output_device_button_tooltip'))
         self.ui.console_button.setToolTip(t('console_button_tooltip'))
         self.ui.settings_button.setToolTip(t('settings_button_tooltip'))
@@ -299,7 +399,7 @@ def retranslate_ui(self):
         self.ui.settings_back_button.setText(t('generic_back'))
 
 
-def gui_main():
+def gui_main(output_sink=None, output_path=None):
     # Enable high DPI support
     if hasattr(QtCore.Qt, 'AA_EnableHighDpiScaling'):
         QtWidgets.QApplication.setAttribute(QtCore.Qt.AA_EnableHighDpiScaling, True)
@@ -318,6 +418,7 @@ def gui_main():
     qdarktheme_stylesheet = qdarktheme.load_stylesheet('dark')
     app.setStyleSheet(qdarktheme_stylesheet + custom_stylesheet)
 
-    main_window = MainWindow()
+    # A PlayerError is reported by the caller, like in CLI mode
+    main_window = MainWindow(output_sink=output_sink, output_path=output_path)
     main_window.show()
     return app.exec()
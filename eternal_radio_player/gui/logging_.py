@@ -1,19 +1,90 @@
 import logging
-from PySide6 import QtCore
+from collections import deque
+from PySide6 import QtCore, QtGui
+
+from ..constants import CONSOLE_FLUSH_INTERVAL, CONSOLE_MAX_LINES
 
 
 class _SignalProxy(QtCore.QObject):
 
-    message = QtCore.Signal(str)
+    pending = QtCore.Signal()
 
 
 class QPlainTextEditHandler(logging.Handler):
 
-    def __init__(self, widget, *args, **kwargs):
+    # Buffers records and appends them to the widget in batches on a timer. Records are only
+    # formatted once the widget is visible, and at most max_lines of them are kept.
+
+    def __init__(
+        self,
+        widget,
+        *args,
+        max_lines=CONSOLE_MAX_LINES,
+        flush_interval=CONSOLE_FLUSH_INTERVAL,
+        **kwargs
+    ):
         super().__init__(*args, **kwargs)
         self._widget = widget
+        self._widget.setMaximumBlockCount(max_lines)
+        self._records = deque(maxlen=max_lines)
+        self._dropped = 0
+        self._last_key = None
+        self._last_line = None
+        self._last_count = 0
+        self._timer = QtCore.QTimer(widget)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(int(flush_interval * 1000))
+        self._timer.timeout.connect(self.flush_records)
+        # Emitted from any thread when the buffer stops being empty, starts the timer in the GUI thread
         self._signal_proxy = _SignalProxy()
-        self.message = self._signal_proxy.message
+        self._signal_proxy.pending.connect(self._timer.start)
 
     def emit(self, record):
-        self._signal_proxy.message.emit(self.format(record))
+        # Called with the handler lock held
+        notify = not self._records
+        if len(self._records) == self._records.maxlen:
+            self._dropped += 1
+        self._records.append(record)
+        if notify:
+            self._signal_proxy.pending.emit()
+
+    def flush_records(self):
+        if not self._widget.isVisible():
+            return
+        with self.lock:
+            records = list(self._records)
+            self._records.clear()
+            dropped = self._dropped
+            self._dropped = 0
+        if not records:
+            return
+
+        lines = []
+        if dropped:
+            lines.append(f'... {dropped} older messages not shown')
+            self._last_key = None
+        last_block_text = None
+        for record in records:
+            key = (record.levelno, record.getMessage())
+            if key == self._last_key:
+                self._last_count += 1
+                text = f'{self._last_line} (x{self._last_count})'
+                if lines:
+                    lines[-1] = text
+                else:
+                    last_block_text = text
+                continue
+            self._last_line = self.format(record)
+            # Multi-line records such as tracebacks are never collapsed
+            self._last_key = key if '\n' not in self._last_line else None
+            self._last_count = 1
+            lines.append(self._last_line)
+
+        if last_block_text is not None:
+            # Update the counter of the repeated message already in the document
+            cursor = QtGui.QTextCursor(self._widget.document())
+            cursor.movePosition(QtGui.QTextCursor.End)
+            cursor.movePosition(QtGui.QTextCursor.StartOfBlock, QtGui.QTextCursor.KeepAnchor)
+            cursor.insertText(last_block_text)
+        if lines:
+            self._widget.appendPlainText('\n'.join(lines))
@@ -0,0 +1,70 @@
+import timeago
+from PySide6 import QtCore
+
+
+class RecentSongsModel(QtCore.QAbstractListModel):
+
+    TimestampRole = QtCore.Qt.UserRole + 1
+    AlternateRole = QtCore.Qt.UserRole + 2
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # Rows of [song, formatted timestamp, serial], newest first. Serials decrease towards the
+        # top and stay with a song, so the rows keep their stripes when new songs are inserted.
+        self._rows = []
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._rows)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < len(self._rows):
+            return None
+        song, timestamp_fmt, serial = self._rows[index.row()]
+        if role == QtCore.Qt.DisplayRole:
+            return song['title']
+        if role == self.TimestampRole:
+            return timestamp_fmt
+        if role == self.AlternateRole:
+            return serial % 2 == 0
+        return None
+
+    def set_recent_songs(self, recent_songs):
+        new_songs = list(recent_songs)
+        old_songs = [row[0] for row in self._rows]
+        if new_songs == old_songs:
+            return
+
+        # New songs appear at the top of the feed and the oldest ones drop off the bottom, so
+        # only those rows are inserted and removed
+        insert_count = None
+        if old_songs:
+            insert_count = next((i for i, song in enumerate(new_songs) if song == old_songs[0]), None)
+        if insert_count is None or new_songs[insert_count:] != old_songs[:len(new_songs) - insert_count]:
+            self.beginResetModel()
+            self._rows = [[song, timeago.format(song['timestamp']), i] for i, song in enumerate(new_songs)]
+            self.endResetModel()
+            return
+
+        if insert_count:
+            first_serial = self._rows[0][2] - insert_count
+            self.beginInsertRows(QtCore.QModelIndex(), 0, insert_count - 1)
+            self._rows[0:0] = [
+                [song, timeago.format(song['timestamp']), first_serial + i]
+                for i, song in enumerate(new_songs[:insert_count])
+            ]
+            self.endInsertRows()
+        if len(self._rows) > len(new_songs):
+            self.beginRemoveRows(QtCore.QModelIndex(), len(new_songs), len(self._rows) - 1)
+            del self._rows[len(new_songs):]
+            self.endRemoveRows()
+
+    def refresh_timestamps(self):
+        # Only rows whose relative time text changed are repainted
+        for i, row in enumerate(self._rows):
+            timestamp_fmt = timeago.format(row[0]['timestamp'])
+            if timestamp_fmt != row[1]:
+                row[1] = timestamp_fmt
+                index = self.index(i)
+                self.dataChanged.emit(index, index, [self.TimestampRole])
@@ -1,5 +1,7 @@
 from PySide6 import QtCore, QtGui, QtWidgets
 
+from .models import RecentSongsModel
+
 
 class ControlToolButton(QtWidgets.QToolButton):
 
@@ -23,48 +25,122 @@ def focusOutEvent(self, event):
         super().focusOutEvent(event)
 
 
-class RecentSong(QtWidgets.QWidget):
+class RecentSongsView(QtWidgets.QListView):
+
+    # The colors RecentSongDelegate paints with, set from the stylesheet with
+    # 'qproperty-timestampColor' and 'qproperty-alternateColor'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._timestamp_color = self.palette().color(QtGui.QPalette.PlaceholderText)
+        self._alternate_color = self.palette().color(QtGui.QPalette.AlternateBase)
+
+    def _get_timestamp_color(self):
+        return self._timestamp_color
+
+    def _set_timestamp_color(self, color):
+        self._timestamp_color = QtGui.QColor(color)
+        self.viewport().update()
+
+    def _get_alternate_color(self):
+        return self._alternate_color
+
+    def _set_alternate_color(self, color):
+        self._alternate_color = QtGui.QColor(color)
+        self.viewport().update()
+
+    timestampColor = QtCore.Property(QtGui.QColor, _get_timestamp_color, _set_timestamp_color)
+    alternateColor = QtCore.Property(QtGui.QColor, _get_alternate_color, _set_alternate_color)
+
+
+class RecentSongDelegate(QtWidgets.QStyledItemDelegate):
+
+    # Paints recent songs entries directly instead of creating a widget for each one. The colors
+    # come from the RecentSongsView, or the palette in any other view.
 
     def __init__(
         self,
         parent=None,
-        title=None,
-        timestamp=None,
         margins=8,
         spacing=6,
+        right_margin=8,
+        border_radius=4,
         title_font_size=12,
         timestamp_font_size=10,
         **kwargs
     ):
         super().__init__(parent=parent, **kwargs)
-        self._layout = QtWidgets.QVBoxLayout(self)
-        self._layout.setContentsMargins(margins, margins, margins, margins)
-        self._layout.setSpacing(spacing)
-        self.title = QtWidgets.QLabel(self, text=title)
-        self.title.setObjectName('title')
-        self.title.setWordWrap(True)
-        self.set_title_font_size(title_font_size)
-        self.timestamp = QtWidgets.QLabel(self, text=timestamp)
-        self.timestamp.setObjectName('timestamp')
-        self.timestamp.setWordWrap(True)
-        self.set_timestamp_font_size(timestamp_font_size)
-        self._layout.addWidget(self.title)
-        self._layout.addWidget(self.timestamp)
-        self.setLayout(self._layout)
-
-    def set_title_font_size(self, value):
-        font = self.title.font()
-        font.setPointSize(value)
-        self.title.setFont(font)
-
-    def set_timestamp_font_size(self, value):
-        font = self.timestamp.font()
-        font.setPointSize(value)
-        self.timestamp.setFont(font)
-
-    def paintEvent(self, pe):
-        opt = QtWidgets.QStyleOption()
-        opt.initFrom(self)
-        painter = QtGui.QPainter(self)
-        s = self.style()
-        s.drawPrimitive(QtWidgets.QStyle.PE_Widget, opt, painter, self)
+        self._margins = margins
+        self._spacing = spacing
+        self._right_margin = right_margin
+        self._border_radius = border_radius
+        self._title_font_size = title_font_size
+        self._timestamp_font_size = timestamp_font_size
+        self._title_font = None
+        self._timestamp_font = None
+
+    def paint(self, painter, option, index):
+        self._init_fonts(option.font)
+        title = index.data(QtCore.Qt.DisplayRole) or ''
+        timestamp = index.data(RecentSongsModel.TimestampRole) or ''
+        rect = option.rect.adjusted(0, 0, -self._right_margin, 0)
+        text_rect = rect.adjusted(self._margins, self._margins, -self._margins, -self._margins)
+        title_height = self._text_height(self._title_font, text_rect.width(), title)
+
+        view = option.widget
+        if isinstance(view, RecentSongsView):
+            timestamp_color = view.timestampColor
+            alternate_color = view.alternateColor
+        else:
+            timestamp_color = option.palette.color(QtGui.QPalette.PlaceholderText)
+            alternate_color = option.palette.color(QtGui.QPalette.AlternateBase)
+
+        painter.save()
+        if index.data(RecentSongsModel.AlternateRole):
+            painter.setRenderHint(QtGui.QPainter.Antialiasing)
+            painter.setPen(QtCore.Qt.NoPen)
+            painter.setBrush(alternate_color)
+            painter.drawRoundedRect(rect, self._border_radius, self._border_radius)
+        painter.setFont(self._title_font)
+        painter.setPen(option.palette.color(QtGui.QPalette.Text))
+        painter.drawText(
+            QtCore.QRect(text_rect.left(), text_rect.top(), text_rect.width(), title_height),
+            QtCore.Qt.TextWordWrap,
+            title
+        )
+        painter.setFont(self._timestamp_font)
+        painter.setPen(timestamp_color)
+        timestamp_top = text_rect.top() + title_height + self._spacing
+        painter.drawText(
+            QtCore.QRect(text_rect.left(), timestamp_top, text_rect.width(), text_rect.bottom() - timestamp_top + 1),
+            QtCore.Qt.TextWordWrap,
+            timestamp
+        )
+        painter.restore()
+
+    def sizeHint(self, option, index):
+        self._init_fonts(option.font)
+        width = option.rect.width()
+        if option.widget:
+            width = option.widget.viewport().width()
+        text_width = max(width - self._right_margin - 2 * self._margins, 1)
+        height = (
+            2 * self._margins
+            + self._text_height(self._title_font, text_width, index.data(QtCore.Qt.DisplayRole) or '')
+            + self._spacing
+            + self._text_height(self._timestamp_font, text_width, index.data(RecentSongsModel.TimestampRole) or '')
+        )
+        return QtCore.QSize(width, height)
+
+    def _init_fonts(self, font):
+        if self._title_font is not None:
+            return
+        self._title_font = QtGui.QFont(font)
+        self._title_font.setPointSize(self._title_font_size)
+        self._timestamp_font = QtGui.QFont(font)
+        self._timestamp_font.setPointSize(self._timestamp_font_size)
+
+    @staticmethod
+    def _text_height(font, width, text):
+        metrics = QtGui.QFontMetrics(font)
+        return metrics.boundingRect(QtCore.QRect(0, 0, width, 0), QtCore.Qt.TextWordWrap, text).height()
@@ -0,0 +1,74 @@
+import logging
+import time
+from collections import deque
+
+from .constants import (
+    LATENCY_GROW_LOAD,
+    LATENCY_GROW_UNDERFLOWS,
+    LATENCY_PROFILES,
+    LATENCY_SHRINK_LOAD,
+    LATENCY_SHRINK_MIN_FILL,
+    LATENCY_SHRINK_TIME,
+    LATENCY_UNDERFLOW_WINDOW
+)
+
+
+log = logging.getLogger(__name__)
+
+
+class LatencyController:
+
+    # Picks the output block size from what the stream callback measured since the last update:
+    # output underflows, the longest callback and the lowest fill of decoded audio. It grows the
+    # block size as soon as the output struggles, but only shrinks it after a long stable period,
+    # so it doesn't keep switching between two sizes.
+
+    def __init__(self, profile, blocksize=None):
+        settings = LATENCY_PROFILES[profile]
+        self.profile = profile
+        self.min_blocksize = settings['min-blocksize']
+        self.max_blocksize = settings['max-blocksize']
+        self._latency_blocks = settings['latency-blocks']
+        if blocksize is None:
+            blocksize = settings['blocksize']
+        self.blocksize = min(max(blocksize, self.min_blocksize), self.max_blocksize)
+        self._underflow_times = deque()
+        self._stable_since = time.monotonic()
+
+    def latency(self, sample_rate):
+        # Output latency to suggest to the device in seconds, or None for the sink's default
+        if self._latency_blocks is None:
+            return None
+        return self.blocksize * self._latency_blocks / sample_rate
+
+    def update(self, underflows, callback_time, min_fill, sample_rate):
+        # Returns the new block size if it should change, min_fill is None if no block was played
+        now = time.monotonic()
+        load = callback_time * sample_rate / self.blocksize
+        self._underflow_times.extend([now] * underflows)
+        while self._underflow_times and now - self._underflow_times[0] > LATENCY_UNDERFLOW_WINDOW:
+            self._underflow_times.popleft()
+        if len(self._underflow_times) >= LATENCY_GROW_UNDERFLOWS or load > LATENCY_GROW_LOAD:
+            self._stable_since = now
+            if self.blocksize >= self.max_blocksize:
+                return None
+            if len(self._underflow_times) >= LATENCY_GROW_UNDERFLOWS:
+                reason = f'{len(self._underflow_times)} underflows'
+            else:
+                reason = f'callback load {load:.0%}'
+            return self._resize(self.blocksize * 2, reason, now)
+        if underflows or load > LATENCY_SHRINK_LOAD or (
+            min_fill is not None and min_fill < LATENCY_SHRINK_MIN_FILL * sample_rate
+        ):
+            self._stable_since = now
+            return None
+        if now - self._stable_since < LATENCY_SHRINK_TIME or self.blocksize <= self.min_blocksize:
+            return None
+        return self._resize(self.blocksize // 2, f'stable for {now - self._stable_since:.0f}s', now)
+
+    def _resize(self, blocksize, reason, now):
+        log.debug(f'Latency controller: block size {self.blocksize} -> {blocksize} frames ({reason})')
+        self.blocksize = blocksize
+        self._underflow_times.clear()
+        self._stable_since = now
+        return blocksize
@@ -0,0 +1,93 @@
+import logging
+import logging.handlers
+import queue
+
+from .constants import LOG_QUEUE_SIZE, LOG_STOP_TIMEOUT
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+
+    # Never blocks the logging thread: records are dropped and counted while the queue is full
+
+    def __init__(self, queue_):
+        super().__init__(queue_)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        # Called with the handler lock held
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class DrainingQueueListener(logging.handlers.QueueListener):
+
+    # The base class queues the stop sentinel with put_nowait(), which raises if the bounded queue
+    # is full at shutdown. This waits for the handlers to make room, and drops the oldest record
+    # for the sentinel if they can't keep up.
+
+    def __init__(self, *args, stop_timeout=LOG_STOP_TIMEOUT, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stop_timeout = stop_timeout
+        self.dropped = 0
+
+    def enqueue_sentinel(self):
+        while True:
+            try:
+                self.queue.put(self._sentinel, timeout=self.stop_timeout)
+                return
+            except queue.Full:
+                pass
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                continue
+            self.queue.task_done()
+            self.dropped += 1
+
+
+class LogPipeline:
+
+    # Moves all log handlers to a listener thread behind a bounded queue, so slow terminals,
+    # files or GUI widgets never stall the threads that log
+
+    handler = None
+    _listener = None
+
+    @classmethod
+    def start(cls, *handlers, queue_size=LOG_QUEUE_SIZE):
+        if cls._listener:
+            return
+        log_queue = queue.Queue(queue_size)
+        cls.handler = DroppingQueueHandler(log_queue)
+        cls._listener = DrainingQueueListener(log_queue, *handlers, respect_handler_level=True)
+        cls._listener.start()
+        logging.getLogger().addHandler(cls.handler)
+
+    @classmethod
+    def stop(cls):
+        if not cls._listener:
+            return
+        logging.getLogger().removeHandler(cls.handler)
+        # Handles the records left in the queue before returning
+        cls._listener.stop()
+        cls._listener = None
+
+    @classmethod
+    def add_handler(cls, handler):
+        if not cls._listener:
+            logging.getLogger().addHandler(handler)
+            return
+        cls._listener.handlers = (*cls._listener.handlers, handler)
+
+    @classmethod
+    def remove_handler(cls, handler):
+        if not cls._listener:
+            logging.getLogger().removeHandler(handler)
+            return
+        cls._listener.handlers = tuple(h for h in cls._listener.handlers if h is not handler)
+
+    @classmethod
+    def dropped(cls):
+        return cls.handler.dropped if cls.handler else 0
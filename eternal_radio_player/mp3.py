@@ -0,0 +1,86 @@
+# Bitrates in kbps by (MPEG-1, layer) and (MPEG-2/2.5, layer), sample rates by version
+MP3_BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+}
+MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+def parse_mp3_frame_header(header):
+    # Returns (frame length, samples per frame, sample rate), or None if it's not a valid header
+    if header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version = (header[1] >> 3) & 3
+    layer = 4 - ((header[1] >> 1) & 3)
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 3
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    bitrate = MP3_BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][sample_rate_index]
+    padding = (header[2] >> 1) & 1
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4, 384, sample_rate
+    if layer == 3 and not mpeg1:
+        return 72 * bitrate // sample_rate + padding, 576, sample_rate
+    return 144 * bitrate // sample_rate + padding, 1152, sample_rate
+
+
+class MP3FrameScanner:
+
+    # Follows the MP3 frame headers across chunks, jumping from one header to the next, and
+    # resyncs on the next frame sync after invalid data or a discontinuity. Calls
+    # frame_callback(offset, duration) for each frame, with the offset counted across chunks.
+
+    def __init__(self, frame_callback):
+        self._frame_callback = frame_callback
+        self._offset = 0
+        self._skip = 0
+        self._header = bytearray()
+        self._sample_rate = None
+
+    def reset(self):
+        # The next data doesn't continue the previous frame
+        self._skip = 0
+        self._header.clear()
+
+    def scan(self, data):
+        position = 0
+        size = len(data)
+        while position < size:
+            if self._skip:
+                step = min(self._skip, size - position)
+                self._skip -= step
+                position += step
+                continue
+            if not self._header:
+                # Resync on the next possible frame start
+                position = data.find(b'\xff', position)
+                if position < 0:
+                    break
+            step = min(4 - len(self._header), size - position)
+            self._header += data[position:position + step]
+            position += step
+            if len(self._header) < 4:
+                break
+            header_offset = self._offset + position - 4
+            frame = parse_mp3_frame_header(self._header)
+            if frame is None or (self._sample_rate and frame[2] != self._sample_rate):
+                # Not a frame start, resync from the byte after the false sync. The header bytes
+                # may have come from the previous chunk, so they are searched where they are.
+                sync = self._header.find(b'\xff', 1)
+                if sync < 0:
+                    self._header.clear()
+                else:
+                    del self._header[:sync]
+                continue
+            frame_length, samples, self._sample_rate = frame
+            self._header.clear()
+            self._skip = frame_length - 4
+            self._frame_callback(header_offset, samples / self._sample_rate)
+        self._offset += size
@@ -1,100 +1,218 @@
-import json
 import logging
 import time
 import miniaudio
-import numpy
-import requests
-import requests.exceptions
-import sounddevice
-from threading import Lock
+from collections import OrderedDict
+from functools import partial
+from threading import current_thread, Event, Lock, Thread, Timer
 
 from .constants import (
+    DITHER,
+    LATENCY_PROFILE,
+    OUTPUT_SAMPLE_FORMAT,
+    OUTPUT_SINK,
+    PLAYER_DECODE_AHEAD_TIME,
     PLAYER_FRAME_COUNT,
-    RECENT_SONGS_CACHE_TIME,
+    PREWARM_STATIONS,
+    READ_TIMEOUT,
+    RECONNECT_ATTEMPTS,
+    RECONNECT_BACKOFF_MAX,
+    RECONNECT_BACKOFF_MIN,
     RECENT_SONGS_URL,
     REQUEST_TIMEOUT,
-    SOUNDDEVICE_HOST_API
+    RESAMPLER,
+    STANDBY_BANDWIDTH,
+    STANDBY_BUFFER_SIZE,
+    STANDBY_GRACE_TIME,
+    STREAM_HIGH_WATERMARK,
+    STREAM_ITER_CHUNK_SIZE,
+    STREAM_LOW_WATERMARK,
+    STREAM_PREBUFFER_SIZE,
+    STREAM_PROBE_SIZE,
+    STREAM_STALL_TIMEOUT,
+    STREAM_URL,
+    TIMESHIFT_DEFAULT_BITRATE,
+    TIMESHIFT_LENGTH
 )
-from .exceptions import PlayerError
-from .stream import HTTPStreamSource, stream_request
+from .decoder import StreamDecoder
+from .dsp import Crossfade, GainRamp
+from .exceptions import OutputError, PlayerError
+from .feed import RecentSongsCache
+from .latency import LatencyController
+from .recorder import StreamRecorder
+from .sinks import CallbackAbort, get_output_sink
+from .standby import WarmStandby
+from .stream import HTTPStreamSource, probe_stream_format, stream_request
+from .timeshift import TimeshiftBuffer
 
 
 log = logging.getLogger(__name__)
 
 
-def get_output_device(device_index=None, host_api_index=SOUNDDEVICE_HOST_API):
-    host_api = sounddevice.query_hostapis(host_api_index)
-    if device_index is None:
-        device_index = host_api['default_output_device']
-    elif device_index not in host_api['devices']:
-        raise ValueError(f"Output device with index '{device_index}' not found")
-    try:
-        device = sounddevice.query_devices(device_index, 'output')
-    except (sounddevice.PortAudioError, ValueError) as e:
-        raise ValueError(f"Output device with index '{device_index}' not found") from e
-    return {
-        'name': device['name'],
-        'sample_rate': int(device['default_samplerate']),
-        'index': device_index
-    }
-
-
-def get_output_devices(host_api_index=SOUNDDEVICE_HOST_API):
-    host_api = sounddevice.query_hostapis(host_api_index)
-    devices = []
-    for device_index in host_api['devices']:
-        try:
-            device = sounddevice.query_devices(device_index, 'output')
-        except (sounddevice.PortAudioError, ValueError):
-            continue
-        devices.append({
-            'name': device['name'],
-            'sample_rate': int(device['default_samplerate']),
-            'index': device_index
-        })
-    return devices
-
-
-def check_output_device_params(device_index, channels, sample_rate, sample_width):
-    try:
-        sounddevice.check_output_settings(
-            device=device_index,
-            channels=channels,
-            dtype=sample_width,
-            samplerate=sample_rate
-        )
-    except sounddevice.PortAudioError as e:
-        if e.args[1] == -9996:
-            raise ValueError(f"Invalid device with index '{device_index}'") from e
-        log.debug(
-            f'Incompatible device parameters: Index: {device_index}, Channels: {channels}, '
-            f'Width: {sample_width}, Rate: {sample_rate}, Error: {e}'
-        )
-        return False
-    return True
-
-
 class RadioPlayer:
 
-    recent_songs_cache_time = RECENT_SONGS_CACHE_TIME
-    _recent_songs_cache_last = 0.0
-    _recent_songs_cache_data = None
-
-    def __init__(self, output_device_index=None, request_timeout=REQUEST_TIMEOUT):
+    def __init__(
+        self,
+        output_device_index=None,
+        request_timeout=REQUEST_TIMEOUT,
+        read_timeout=READ_TIMEOUT,
+        stream_prebuffer_size=STREAM_PREBUFFER_SIZE,
+        stream_low_watermark=STREAM_LOW_WATERMARK,
+        stream_high_watermark=STREAM_HIGH_WATERMARK,
+        stream_chunk_size=STREAM_ITER_CHUNK_SIZE,
+        decode_ahead_time=PLAYER_DECODE_AHEAD_TIME,
+        reconnect_attempts=RECONNECT_ATTEMPTS,
+        stall_timeout=STREAM_STALL_TIMEOUT,
+        device_params=None,
+        latency_profile=LATENCY_PROFILE,
+        output_blocksizes=None,
+        warm_standby=False,
+        standby_grace_time=STANDBY_GRACE_TIME,
+        standby_buffer_size=STANDBY_BUFFER_SIZE,
+        standby_bandwidth=STANDBY_BANDWIDTH,
+        stream_url=STREAM_URL,
+        recent_songs_url=RECENT_SONGS_URL,
+        prewarm_stations=PREWARM_STATIONS,
+        output_sink=OUTPUT_SINK,
+        output_path=None,
+        sample_format=OUTPUT_SAMPLE_FORMAT,
+        resampler=RESAMPLER,
+        dither=DITHER,
+        recording_directory=None,
+        timeshift=False,
+        timeshift_length=TIMESHIFT_LENGTH,
+        timeshift_directory=None
+    ):
         self.running = False
+        self.stream_url = stream_url
+        self.recent_songs_url = recent_songs_url
+        self.recent_songs_cache = RecentSongsCache(recent_songs_url) if recent_songs_url else None
+        self.prewarm_stations = prewarm_stations
+        self.output_sink = output_sink
+        self.output_path = output_path
+        self.sample_format = sample_format
+        self.resampler = resampler
+        self.dither = dither
         self.request_timeout = request_timeout
+        self.read_timeout = read_timeout
+        self.stream_prebuffer_size = stream_prebuffer_size
+        self.stream_low_watermark = stream_low_watermark
+        self.stream_high_watermark = stream_high_watermark
+        self.stream_chunk_size = stream_chunk_size
+        self.decode_ahead_time = decode_ahead_time
+        self.reconnect_attempts = reconnect_attempts
+        self.stall_timeout = stall_timeout
+        self.warm_standby = warm_standby
+        self.standby_buffer_size = standby_buffer_size
+        self.standby_bandwidth = standby_bandwidth
+        self.recording_directory = recording_directory
+        self.timeshift = timeshift
+        self.timeshift_length = timeshift_length
+        self.timeshift_directory = timeshift_directory
+        self.paused = False
+        # Negotiated output parameters by device_params_key(), pass a dict to persist them
+        self.device_params = device_params if device_params is not None else {}
+        # Block sizes learned by the latency controller by output_blocksize_key(), likewise
+        self.latency_profile = latency_profile
+        self.output_blocksizes = output_blocksizes if output_blocksizes is not None else {}
+        self.underflow_count = 0
+        self.decoder_error_count = 0
+        self.reconnect_count = 0
+        self.last_reconnect_gap = 0.0
+        self.total_reconnect_gap = 0.0
         try:
-            self.output_device = get_output_device(output_device_index)
-        except ValueError:
-            self.output_device = get_output_device()
-        self._stream_source = None
-        self._input_stream = None
+            self._sink = get_output_sink(output_sink)
+        except OutputError as e:
+            raise PlayerError(str(e)) from e
+        # Sinks without a device report a placeholder one
+        try:
+            self.output_device = self._sink.get_device(output_device_index)
+        except OutputError as e:
+            raise PlayerError(str(e)) from e
+        self.now_playing = None
+        self._event_listeners = []
+        self._now_playing_timers = []
+        self._decoder = None
+        self._next_decoder = None
+        self._gain_ramp = None
+        self._crossfade = None
         self._output_stream = None
+        self._sample_rate = None
+        self._channels = None
+        self._sample_format = None
+        self._latency_controller = None
+        # Longest callback and lowest decoded buffer fill since the supervisor last checked
+        self._callback_time = 0.0
+        self._min_fill = None
+        self._reopening = False
+        self._silence_frames = 0
+        self._abort = False
+        self._abort_reason = None
+        self._supervisor_thread = None
+        self._supervisor_stop = Event()
+        self._swap_lock = Lock()
         self._linear_volume = 1.0
         self._volume = 1.0
         self._lock = Lock()
+        self._recorder = None
+        # Ring of the compressed stream that playback reads from in timeshift mode, and
+        # whether the next decoder replaces the current one right away, after a seek
+        self._timeshift = None
+        self._seek_splice = False
+        self._seek_lock = Lock()
+        # Keeps the stream while stopped for warm standby, or at full rate while recording
+        self._standby = WarmStandby(
+            self._open_stream,
+            grace_time=standby_grace_time,
+            buffer_size=standby_buffer_size,
+            bandwidth=standby_bandwidth
+        )
+        # Warm standbys keeping the streams of the stations switched away from last, by stream URL
+        self._prewarmed = OrderedDict()
+        self._prewarm_lock = Lock()
+
+    @classmethod
+    def from_config(cls, config, output_sink=None, output_path=None):
+        # Creates a player for the station of a configuration like Config.data, the output sink
+        # and path override the configured ones
+        station = config['stations'][config['station']]
+        player = cls(
+            config['output-device'],
+            config['connection-timeout'],
+            read_timeout=config['read-timeout'],
+            stream_prebuffer_size=config['stream-prebuffer-size'],
+            stream_low_watermark=config['stream-low-watermark'],
+            stream_high_watermark=config['stream-high-watermark'],
+            stream_chunk_size=config['stream-chunk-size'],
+            decode_ahead_time=config['decode-ahead-time'],
+            reconnect_attempts=config['reconnect-attempts'],
+            stall_timeout=config['stall-timeout'],
+            device_params=config['device-params'],
+            latency_profile=config['latency-profile'],
+            output_blocksizes=config['output-blocksizes'],
+            warm_standby=config['warm-standby'],
+            standby_grace_time=config['standby-grace-time'],
+            standby_buffer_size=config['standby-buffer-size'],
+            standby_bandwidth=config['standby-bandwidth'],
+            stream_url=station['stream-url'],
+            recent_songs_url=station.get('recent-songs-url'),
+            prewarm_stations=config['prewarm-stations'],
+            output_sink=output_sink or config['output-sink'],
+            output_path=output_path or config['output-sink-path'],
+            sample_format=config['sample-format'],
+            resampler=config['resampler'],
+            dither=config['dither'],
+            recording_directory=config['recording-directory'],
+            timeshift=config['timeshift'],
+            timeshift_length=config['timeshift-length'],
+            timeshift_directory=config['timeshift-directory']
+        )
+        player.set_volume(config['volume'])
+        return player
 
     def play(self):
+        if self.paused:
+            self._resume()
+            return
         if self.running:
             log.debug('Cannot start radio player, already running')
             return
@@ -107,14 +225,200 @@ def play(self):
             except Exception as e:
                 raise PlayerError(f'Could not initialize player: {e}') from e
             self._output_stream.start()
+            self._start_supervisor()
             self.running = True
+        self._emit_event({'type': 'state', 'state': 'playing'})
 
     def stop(self):
         with self._lock:
             log.debug('Stopping radio player')
+            self._stop_output(keep=self.warm_standby)
+            self._stop_input()
+            self.running = False
+            self.paused = False
+            self.start_standby()
+        self._emit_event({'type': 'state', 'state': 'stopped'})
+
+    def pause(self):
+        # Only stops the output, the stream keeps filling the timeshift buffer
+        with self._lock:
+            if not self.running or self.paused:
+                return
+            if self._timeshift is None:
+                raise PlayerError('Cannot pause without timeshift')
+            log.debug('Pausing radio player')
+            self.paused = True
+            self._output_stream.abort()
+        self._emit_event({'type': 'state', 'state': 'paused'})
+
+    def rewind(self, seconds):
+        with self._lock:
+            if self._timeshift is None:
+                raise PlayerError('Cannot rewind without timeshift')
+            self._seek(self._position() - seconds)
+
+    def live(self):
+        with self._lock:
+            if self._timeshift is None:
+                raise PlayerError('Cannot go to live without timeshift')
+            self._seek(None)
+
+    def switch_station(self, stream_url, recent_songs_url=None):
+        # While playing, the new station is crossfaded in on the same output stream
+        with self._lock:
+            old_stream_url = self.stream_url
+            if stream_url != old_stream_url:
+                if self.running:
+                    self._switch_input(stream_url)
+                    self.stream_url = stream_url
+                else:
+                    # The standby stream is of the old station, and is replaced by the new one
+                    stream = self._standby.take_stream()
+                    self.stream_url = stream_url
+                    if stream:
+                        self._keep_prewarmed(old_stream_url, stream)
+                    self.start_standby()
+                log.info(f"Switched station to '{stream_url}'")
+            if recent_songs_url != self.recent_songs_url:
+                self.recent_songs_url = recent_songs_url
+                self.recent_songs_cache = RecentSongsCache(recent_songs_url) if recent_songs_url else None
+        self._emit_event({'type': 'station', 'stream_url': stream_url, 'recent_songs_url': recent_songs_url})
+
+    @property
+    def timeshift_delay(self):
+        # Seconds behind the newest audio received
+        timeshift = self._timeshift
+        if timeshift is None or self._decoder is None:
+            return 0.0
+        return max(timeshift.live_time - self._position(), 0.0)
+
+    @property
+    def uses_output_device(self):
+        return self._sink.uses_device
+
+    @property
+    def standby_ready(self):
+        return self._standby.ready
+
+    @property
+    def recording(self):
+        recorder = self._recorder
+        return recorder is not None and not recorder.failed
+
+    @property
+    def recording_path(self):
+        recorder = self._recorder
+        return recorder.path if recorder else None
+
+    def start_standby(self):
+        # Only has an effect with warm_standby or while recording, and only while stopped
+        if not self.running and (self.warm_standby or self._recorder):
+            self._standby.start()
+
+    def start_recording(self, directory=None):
+        with self._lock:
+            if self._recorder:
+                log.debug('Already recording')
+                return
+            directory = directory or self.recording_directory
+            if not directory:
+                raise PlayerError('No recording directory')
+            recorder = StreamRecorder(
+                directory,
+                get_recent_songs=self.get_recent_songs,
+                on_error=self._on_recording_error
+            )
+            try:
+                recorder.start()
+            except OSError as e:
+                raise PlayerError(f'Could not start recording: {e}') from e
+            self._recorder = recorder
+            self._standby.bandwidth = None
+            if self.running:
+                with self._swap_lock:
+                    decoder = self._next_decoder or self._decoder
+                    if decoder:
+                        recorder.attach(self._input_sources()[-1], decoder.encoding)
+            else:
+                # The standby stream is replaced with one read at full rate and recorded
+                self._standby.discard_stream()
+                self._standby.start()
+        self._emit_event({'type': 'recording', 'recording': True, 'directory': str(recorder.directory)})
+
+    def stop_recording(self):
+        recorder = self._detach_recorder()
+        if not recorder:
+            return
+        recorder.stop()
+        log.info(f'Recording stopped ({recorder.bytes_written} bytes written)')
+        self._emit_event({'type': 'recording', 'recording': False, 'directory': str(recorder.directory)})
+
+    def _detach_recorder(self, recorder=None):
+        # Detaches the current recorder, or only the given one if it's still current
+        with self._lock:
+            if not self._recorder or recorder not in (None, self._recorder):
+                return None
+            recorder = self._recorder
+            self._recorder = None
+            with self._swap_lock:
+                for source in self._input_sources():
+                    if source.tee is recorder:
+                        source.tee = None
+            self._standby.bandwidth = self.standby_bandwidth
+            if not self.running:
+                self._standby.discard_stream()
+                if not self.warm_standby:
+                    self._standby.stop()
+        return recorder
+
+    def _on_recording_error(self, recorder):
+        # Called from the writer thread of the recorder, which already stopped
+        if not self._detach_recorder(recorder):
+            return
+        log.info(f'Recording stopped ({recorder.bytes_written} bytes written)')
+        self._emit_event({
+            'type': 'recording',
+            'recording': False,
+            'directory': str(recorder.directory),
+            'error': str(recorder.error)
+        })
+
+    def close(self):
+        # Stops the player and recording, and releases everything kept for warm standby
+        self.stop_recording()
+        with self._lock:
             self._stop_output()
             self._stop_input()
+            running = self.running
             self.running = False
+            self.paused = False
+        self._standby.close()
+        with self._prewarm_lock:
+            prewarmed = list(self._prewarmed.values())
+            self._prewarmed.clear()
+        for standby in prewarmed:
+            standby.close()
+        if running:
+            self._emit_event({'type': 'state', 'state': 'stopped'})
+
+    def add_event_listener(self, listener):
+        self._event_listeners.append(listener)
+
+    def remove_event_listener(self, listener):
+        if listener in self._event_listeners:
+            self._event_listeners.remove(listener)
+
+    def get_stats(self):
+        return {
+            'underflows': self.underflow_count,
+            'decoder_errors': self.decoder_error_count,
+            'reconnects': self.reconnect_count,
+            'last_reconnect_gap': self.last_reconnect_gap,
+            'total_reconnect_gap': self.total_reconnect_gap,
+            'timeshift_delay': self.timeshift_delay,
+            'output_blocksize': self._latency_controller.blocksize if self._latency_controller else None,
+            'output_latency': self._output_stream.latency if self._output_stream else None
+        }
 
     def get_volume(self):
         return self._linear_volume
@@ -123,102 +427,716 @@ def set_volume(self, volume):
         self._linear_volume = volume
         self._volume = volume ** 3
 
-    @classmethod
-    def get_recent_songs(cls, timeout=REQUEST_TIMEOUT):
-        if time.time() - cls._recent_songs_cache_last <= cls.recent_songs_cache_time:
-            return cls._recent_songs_cache_data
-        try:
-            response = requests.get(url=RECENT_SONGS_URL, timeout=timeout)
-            response.raise_for_status()
-        except requests.exceptions.RequestException as e:
-            raise PlayerError(f'Could not fetch recent songs: {e}') from e
-        try:
-            items = response.json()['items']
-            recent_songs = []
-            for recent_song in items:
-                title = recent_song['title'][:-6].strip() # Remove ID '[XXXX]' at the end
-                timestamp = min(int(recent_song['date']), int(time.time()))
-                recent_songs.append({'title': title, 'timestamp': timestamp})
-        except (json.JSONDecodeError, KeyError, ValueError) as e:
-            raise PlayerError('Received bad recent songs data') from e
-        cls._recent_songs_cache_data = recent_songs
-        cls._recent_songs_cache_last = time.time()
-        return recent_songs
+    def get_recent_songs(self, timeout=REQUEST_TIMEOUT, max_age=None):
+        recent_songs_cache = self.recent_songs_cache
+        if recent_songs_cache is None:
+            raise PlayerError('The station has no recent songs feed')
+        return recent_songs_cache.get(timeout, max_age)
 
     def _init(self):
-        request, encoding, sample_rate = stream_request(self.request_timeout)
-        if not sample_rate:
-            sample_rate = self.output_device['sample_rate']
+        stream_source, encoding, sample_rate = self._standby.take_stream() or self._open_stream()
+        try:
+            # The first frames tell the channels, and the sample rate more reliably than icy-sr
+            data = stream_source.peek(STREAM_PROBE_SIZE, self.request_timeout)
+            stream_format = probe_stream_format(data, encoding)
+            if stream_format is not None:
+                sample_rate, channels = stream_format
+            else:
+                log.debug('Could not read the stream format from its first frames')
+                channels = 2
+            if not sample_rate:
+                sample_rate = self.output_device['sample_rate']
+            started = time.perf_counter()
+            device_params, cached = self._get_device_params(sample_rate, channels)
+            self._latency_controller = LatencyController(
+                self.latency_profile,
+                self.output_blocksizes.get(self._output_blocksize_key()) if self._sink.uses_device else None
+            )
+            log.debug(
+                f'Initializing player with encoding: {encoding}, sample rate: {sample_rate}, '
+                f'channels: {channels}, device parameters: {device_params}, '
+                f'block size: {self._latency_controller.blocksize}'
+            )
+            if self.warm_standby:
+                self._output_stream = self._standby.take_output(self._output_stream_key(device_params))
+            try:
+                if self._output_stream is None:
+                    self._output_stream = self._create_output_stream(device_params)
+            except OutputError as e:
+                if not cached:
+                    raise
+                # The device changed since the parameters were saved, negotiate them again
+                log.warning(f'Could not open output stream with saved device parameters: {e}')
+                self.device_params.pop(self._device_params_key(sample_rate, channels), None)
+                device_params, cached = self._get_device_params(sample_rate, channels)
+                self._output_stream = self._create_output_stream(device_params)
+            log.debug(
+                f"Opened output stream in {time.perf_counter() - started:.3f}s "
+                f"({'saved' if cached else 'negotiated'} device parameters)"
+            )
+        except Exception:
+            stream_source.close()
+            raise
+        self._sample_rate = device_params['sample-rate']
+        self._channels = device_params['channels']
+        self._sample_format = device_params['dtype']
+        self._create_block_buffers()
+        self._callback_time = 0.0
+        self._min_fill = None
+        self._silence_frames = 0
+        self._abort = False
+        self._abort_reason = None
+        self._supervisor_stop.clear()
+        self._decoder = self._create_decoder(self._start_timeshift(stream_source, encoding), encoding)
 
-        for sr in (sample_rate, self.output_device['sample_rate']):
-            if check_output_device_params(self.output_device['index'], 2, sr, 'float32'):
-                sample_rate = sr
-                break
+    def _device_params_key(self, sample_rate, channels):
+        # Imported here, since importing the devices module initializes PortAudio
+        from .devices import device_params_key
+
+        return device_params_key(self.output_device, sample_rate, channels)
+
+    def _output_blocksize_key(self):
+        from .devices import output_blocksize_key
+
+        return output_blocksize_key(self.output_device, self.latency_profile)
+
+    def _device_params_candidates(self, sample_rate, channels):
+        # In order of preference, the stream's own sample rate and channels, so the decoder
+        # doesn't resample or upmix, then the sample formats the sink takes natively
+        sample_rates = [sample_rate]
+        if self.output_device['sample_rate'] != sample_rate:
+            if self.resampler == 'decoder':
+                sample_rates.insert(0, self.output_device['sample_rate'])
+            else:
+                sample_rates.append(self.output_device['sample_rate'])
+        channel_counts = (channels, 2) if channels != 2 else (2,)
+        if self.sample_format == 'auto':
+            sample_formats = self._sink.sample_formats
         else:
-            raise PlayerError('Could not find supported device parameters')
+            sample_formats = (self.sample_format,)
+        return [
+            {'sample-rate': sr, 'channels': ch, 'dtype': dtype}
+            for sr in sample_rates for ch in channel_counts for dtype in sample_formats
+        ]
 
-        log.debug(
-            f'Initializing player with request status: {request.status_code}, '
-            f'encoding: {encoding}, sample rate: {sample_rate}'
+    def _get_device_params(self, sample_rate, channels):
+        # Returns the parameters and whether they were saved from an earlier negotiation
+        candidates = self._device_params_candidates(sample_rate, channels)
+        if not self._sink.uses_device:
+            return candidates[0], False
+        key = self._device_params_key(sample_rate, channels)
+        device_params = self.device_params.get(key)
+        # Saved parameters the settings no longer allow are negotiated again
+        if device_params in candidates:
+            return device_params, True
+        for device_params in candidates:
+            if self._sink.check_params(
+                self.output_device['index'],
+                device_params['channels'],
+                device_params['sample-rate'],
+                device_params['dtype']
+            ):
+                self.device_params[key] = device_params
+                return device_params, False
+        raise PlayerError('Could not find supported device parameters')
+
+    def _output_stream_key(self, device_params, blocksize=None):
+        return (
+            self.output_device['index'],
+            device_params['sample-rate'],
+            device_params['channels'],
+            device_params['dtype'],
+            blocksize or self._latency_controller.blocksize
         )
-        self._output_stream = sounddevice.OutputStream(
-            samplerate=sample_rate,
-            blocksize=PLAYER_FRAME_COUNT,
+
+    def _create_output_stream(self, device_params):
+        return self._sink(
+            samplerate=device_params['sample-rate'],
+            blocksize=self._latency_controller.blocksize,
             device=self.output_device['index'],
-            channels=2,
-            dtype=numpy.float32,
+            channels=device_params['channels'],
+            dtype=device_params['dtype'],
             callback=self._stream_callback_wrapper,
-            finished_callback=self._finished_callback
+            finished_callback=self._finished_callback,
+            path=self.output_path,
+            latency=self._latency_controller.latency(device_params['sample-rate'])
+        )
+
+    def _create_block_buffers(self):
+        # Sized for the output block size, so the callback never resizes them
+        blocksize = self._latency_controller.blocksize
+        self._gain_ramp = GainRamp(blocksize, self._channels, self._sample_format, self._volume)
+        self._crossfade = Crossfade(blocksize, self._channels, self._sample_format)
+
+    def _update_latency(self, underflows):
+        callback_time, self._callback_time = self._callback_time, 0.0
+        min_fill, self._min_fill = self._min_fill, None
+        controller = self._latency_controller
+        blocksize = controller.blocksize
+        if controller.update(underflows, callback_time, min_fill, self._sample_rate) is None:
+            return
+        latency = self._reopen_output(blocksize)
+        if latency is None:
+            controller.blocksize = blocksize
+            return
+        log.info(f'Output block size changed to {controller.blocksize} frames, latency: {latency * 1000:.0f}ms')
+        if self._sink.uses_device:
+            self.output_blocksizes[self._output_blocksize_key()] = controller.blocksize
+        self._emit_event({'type': 'latency', 'blocksize': controller.blocksize, 'latency': latency})
+
+    def _reopen_output(self, old_blocksize):
+        # Returns the latency of the reopened stream, or None if the block size didn't change.
+        # Runs on the supervisor thread and gives up if play(), stop() or a switch holds the lock,
+        # which may be waiting for the supervisor. The decoder keeps filling its buffer meanwhile.
+        if not self._lock.acquire(False):
+            return None
+        stopped = False
+        try:
+            if not self.running or self.paused or self._output_stream is None:
+                return None
+            device_params = {
+                'sample-rate': self._sample_rate,
+                'channels': self._channels,
+                'dtype': self._sample_format
+            }
+            self._reopening = True
+            self._output_stream.abort()
+            self._output_stream.close()
+            self._output_stream = None
+            try:
+                self._output_stream = self._create_output_stream(device_params)
+            except OutputError as e:
+                log.warning(f'Could not reopen output stream with the new block size: {e}')
+                self._latency_controller.blocksize = old_blocksize
+                try:
+                    self._output_stream = self._create_output_stream(device_params)
+                except OutputError as e:
+                    log.error(f'Could not reopen output stream: {e}')
+                    self._stop_input()
+                    self.running = False
+                    self.start_standby()
+                    stopped = True
+                    return None
+            self._create_block_buffers()
+            self._output_stream.start()
+            if self._latency_controller.blocksize == old_blocksize:
+                return None
+            return self._output_stream.latency
+        finally:
+            self._reopening = False
+            self._lock.release()
+            if stopped:
+                self._emit_event({'type': 'state', 'state': 'stopped'})
+
+    def _open_stream(self):
+        stream = self._take_prewarmed(self.stream_url) or self._connect_stream()
+        recorder = self._recorder
+        if recorder:
+            recorder.attach(stream[0], stream[1])
+        return stream
+
+    def _connect_stream(self, url=None):
+        request, encoding, sample_rate = stream_request(
+            self.request_timeout,
+            self.read_timeout,
+            url=url or self.stream_url
+        )
+        log.debug(f'Stream request status: {request.status_code}')
+        stream_source = HTTPStreamSource(
+            request,
+            iter_chunk_size=self.stream_chunk_size,
+            **self._stream_source_params()
+        )
+        return stream_source, encoding, sample_rate
+
+    def _keep_prewarmed(self, stream_url, stream):
+        # Keeps the stream of a station switched away from, read at the standby bandwidth
+        stream[0].tee = None
+        if not self.prewarm_stations:
+            stream[0].close()
+            return
+        log.debug(f"Keeping pre-warmed stream of '{stream_url}'")
+        standby = WarmStandby(
+            partial(self._connect_stream, stream_url),
+            buffer_size=self.standby_buffer_size,
+            bandwidth=self.standby_bandwidth
         )
-        self._stream_source = HTTPStreamSource(request)
-        self._input_stream = miniaudio.stream_any(
-            source=self._stream_source,
-            source_format=encoding,
-            output_format=miniaudio.SampleFormat.FLOAT32,
-            nchannels=2,
-            sample_rate=sample_rate,
+        standby.keep_stream(stream)
+        standby.start()
+        closed = []
+        with self._prewarm_lock:
+            old_standby = self._prewarmed.pop(stream_url, None)
+            if old_standby:
+                closed.append(old_standby)
+            self._prewarmed[stream_url] = standby
+            while len(self._prewarmed) > self.prewarm_stations:
+                closed.append(self._prewarmed.popitem(last=False)[1])
+        for standby in closed:
+            standby.close()
+
+    def _take_prewarmed(self, stream_url):
+        with self._prewarm_lock:
+            standby = self._prewarmed.pop(stream_url, None)
+        if standby is None:
+            return None
+        stream = standby.take_stream()
+        standby.close()
+        if stream:
+            log.debug(f"Using pre-warmed stream of '{stream_url}'")
+        return stream
+
+    def _switch_input(self, stream_url):
+        try:
+            stream = self._take_prewarmed(stream_url) or self._connect_stream(stream_url)
+        except Exception as e:
+            raise PlayerError(f'Could not open station stream: {e}') from e
+        stream_source, encoding, _sample_rate = stream
+        # The supervisor is restarted after the switch, so it doesn't reconnect to the old station
+        self._stop_supervisor(None)
+        self._supervisor_stop.clear()
+        with self._swap_lock:
+            for timer in self._now_playing_timers:
+                timer.cancel()
+            self._now_playing_timers.clear()
+            old_sources = self._input_sources()
+            for source in old_sources:
+                source.tee = None
+        old_timeshift = self._timeshift
+        old_decoders = [decoder for decoder in (self._decoder, self._next_decoder) if decoder]
+        old_encoding = old_decoders[-1].encoding
+        if self._recorder:
+            self._recorder.attach(stream_source, encoding)
+        self._timeshift = None
+        try:
+            decoder = self._create_decoder(self._start_timeshift(stream_source, encoding), encoding)
+        except Exception:
+            stream_source.close()
+            if self._timeshift is not None:
+                self._timeshift.close()
+            self._timeshift = old_timeshift
+            if self._recorder:
+                self._recorder.attach(old_sources[-1], old_encoding)
+            self._start_supervisor()
+            raise
+        with self._swap_lock:
+            if self.paused:
+                # The audio callback isn't running, so the decoder is replaced here
+                self._decoder = decoder
+                self._next_decoder = None
+            else:
+                self._next_decoder = decoder
+                self._seek_splice = True
+        # Wait for the audio callback to crossfade into the new decoder, the old station keeps
+        # playing until the new one is buffered
+        deadline = time.monotonic() + self.read_timeout
+        while self._next_decoder is decoder and not decoder.finished and time.monotonic() < deadline:
+            time.sleep(0.01)
+        with self._swap_lock:
+            if self._next_decoder is decoder:
+                log.warning('Timed out waiting for the station stream, switching without crossfade')
+                self._decoder = decoder
+                self._next_decoder = None
+                self._seek_splice = False
+        # The newest stream of the old station is kept pre-warmed
+        keep_source = None
+        if old_timeshift is not None:
+            keep_source = old_timeshift.detach()
+            old_timeshift.close()
+            for old_decoder in old_decoders:
+                old_decoder.stop()
+        else:
+            for old_decoder in old_decoders:
+                if old_decoder is not old_decoders[-1]:
+                    old_decoder.stop()
+                elif old_decoder.stop(close_source=False):
+                    keep_source = old_decoder.source
+                else:
+                    old_decoder.source.close()
+        if keep_source is not None:
+            if keep_source.finished:
+                keep_source.close()
+            else:
+                self._keep_prewarmed(self.stream_url, (keep_source, old_encoding, self._sample_rate))
+        self._start_supervisor()
+
+    def _start_timeshift(self, stream_source, encoding):
+        # Returns the source for the decoder, a reader of the timeshift buffer if it's enabled
+        if not self.timeshift:
+            return stream_source
+        # Readers start at MP3 frames, a Vorbis decoder can't start mid-stream
+        if encoding != miniaudio.FileFormat.MP3:
+            log.warning(f'Timeshift is not supported for {encoding.name} streams, playing live')
+            return stream_source
+        size = int(self.timeshift_length * (stream_source.bitrate or TIMESHIFT_DEFAULT_BITRATE) / 8)
+        try:
+            timeshift = TimeshiftBuffer(
+                size,
+                self.timeshift_length,
+                self.timeshift_directory,
+                chunk_size=self.stream_chunk_size
+            )
+        except OSError as e:
+            stream_source.close()
+            raise PlayerError(f'Could not create timeshift buffer: {e}') from e
+        log.debug(f'Timeshift buffer of {size} bytes')
+        timeshift.attach(stream_source)
+        self._timeshift = timeshift
+        return timeshift.reader(0, 0.0, **self._stream_source_params())
+
+    def _input_sources(self):
+        # The network stream sources, the newest last
+        if self._timeshift is not None:
+            return [self._timeshift.source]
+        return [decoder.source for decoder in (self._decoder, self._next_decoder) if decoder]
+
+    def _position(self):
+        # Stream time of the audio played last in timeshift mode
+        decoder = self._decoder
+        return decoder.source.start_time + decoder.buffer.frames_read / self._sample_rate
+
+    def _seek(self, stream_time):
+        # Restarts playback from stream_time in the timeshift buffer, or from live if it's None
+        with self._seek_lock:
+            timeshift = self._timeshift
+            if stream_time is None:
+                # Far enough behind the newest data that the decoder doesn't run low filling its buffer
+                bitrate = timeshift.bitrate or TIMESHIFT_DEFAULT_BITRATE
+                start = timeshift.live_offset(self.stream_prebuffer_size + int(self.decode_ahead_time * bitrate / 8))
+            else:
+                start = timeshift.offset_at(stream_time)
+            if start is None:
+                return
+            offset, start_time = start
+            log.info(f'Playing from {timeshift.live_time - start_time:.1f}s behind live')
+            reader = timeshift.reader(offset, start_time, **self._stream_source_params())
+            decoder = self._create_decoder(reader, miniaudio.FileFormat.MP3)
+            with self._swap_lock:
+                old_decoders = [self._next_decoder, self._decoder]
+                if self.paused:
+                    # The audio callback isn't running, so the decoder is replaced here
+                    self._decoder = decoder
+                    self._next_decoder = None
+                else:
+                    self._next_decoder = decoder
+                    self._seek_splice = True
+            # Wait for the audio callback to splice in the new decoder
+            deadline = time.monotonic() + self.read_timeout
+            while self._next_decoder is decoder and self._timeshift is timeshift and time.monotonic() < deadline:
+                time.sleep(0.01)
+            with self._swap_lock:
+                if self._next_decoder is decoder:
+                    log.warning('Timed out waiting for the timeshift decoder')
+                    self._next_decoder = None
+                    self._seek_splice = False
+                    old_decoders = [decoder]
+            for old_decoder in old_decoders:
+                if old_decoder:
+                    old_decoder.stop()
+        self._emit_event({'type': 'timeshift', 'delay': self.timeshift_delay})
+
+    def _resume(self):
+        with self._lock:
+            if not self.paused:
+                return
+            log.debug('Resuming radio player')
+            self.paused = False
+            self._output_stream.start()
+        self._emit_event({'type': 'state', 'state': 'playing'})
+
+    def _stream_source_params(self):
+        return {
+            'prebuffer_size': self.stream_prebuffer_size,
+            'low_watermark': self.stream_low_watermark,
+            'high_watermark': self.stream_high_watermark,
+            'read_timeout': self.read_timeout
+        }
+
+    def _create_decoder(self, stream_source, encoding):
+        decoder = StreamDecoder(
+            stream_source,
+            encoding,
+            self._sample_rate,
+            channels=self._channels,
+            sample_format=self._sample_format,
+            dither=self.dither,
             frames_to_read=PLAYER_FRAME_COUNT,
-            dither=miniaudio.DitherMode.TRIANGLE
+            decode_ahead_time=self.decode_ahead_time,
+            metadata_callback=self._on_metadata
         )
+        decoder.start()
+        return decoder
 
     def _stream_callback_wrapper(self, *args, **kwargs):
+        started = time.perf_counter()
         try:
             self._stream_callback(*args, **kwargs)
+            callback_time = time.perf_counter() - started
+            if callback_time > self._callback_time:
+                self._callback_time = callback_time
             return
-        except sounddevice.CallbackAbort:
+        except CallbackAbort:
             raise
-        except miniaudio.MiniaudioError as e:
-            log.error(f'Decoder error: {e}')
         except Exception as e:
-            log.error(f'Stream callback exception: {e}')
-        raise sounddevice.CallbackAbort
+            self._abort_reason = f'Stream callback exception: {e}'
+        raise CallbackAbort
 
     def _stream_callback(self, output, frames, _time, status):
+        # Runs on the audio thread, so nothing here logs. Underflows are only counted and reported
+        # by the supervisor, and the reason for aborting is logged from the finished callback.
         if status and status.output_underflow:
-            log.warning('Output buffer underflow')
-        raw_samples = self._input_stream.send(frames)
-        samples = numpy.asarray(raw_samples, raw_samples.typecode).reshape(-1, 2) * self._volume
-        if len(samples) < len(output):
-            log.error(f'Length of stream data is less than expected: ({len(samples)}/{len(output)})')
-            raise sounddevice.CallbackAbort
-        output[:] = samples
+            self.underflow_count += 1
+        if self._abort:
+            raise CallbackAbort
+        decoder = self._decoder
+        available = decoder.buffer.available
+        if self._min_fill is None or available < self._min_fill:
+            self._min_fill = available
+        frames_read = decoder.buffer.read_into(output)
+        if frames_read < frames:
+            output[frames_read:] = 0
+            self._silence_frames += frames - frames_read
+        # Splice in the reconnected stream once the old one is drained, or right away after a seek
+        next_decoder = self._next_decoder
+        if (
+            next_decoder is not None
+            and (decoder.buffer.available == 0 or self._seek_splice)
+            and next_decoder.buffer.available >= frames
+        ):
+            self._crossfade.mix(output, next_decoder.buffer)
+            self._decoder = next_decoder
+            self._next_decoder = None
+            self._seek_splice = False
+        elif frames_read < frames and decoder.finished and not self.reconnect_attempts:
+            self._abort_reason = f'Length of stream data is less than expected: ({frames_read}/{frames})'
+            raise CallbackAbort
+        self._gain_ramp.target = self._volume
+        self._gain_ramp.apply(output)
 
     def _finished_callback(self):
+        if self._abort_reason:
+            log.error(self._abort_reason)
+            self._abort_reason = None
         log.debug('Stream callback stopped')
+        # Pausing only stops the output, and the latency controller reopens it
+        if self.paused or self._reopening:
+            return
         if self._lock.acquire(False):
             self._stop_input()
             self.running = False
+            self.start_standby()
             self._lock.release()
+            self._emit_event({'type': 'state', 'state': 'stopped'})
+
+    def _emit_event(self, event):
+        for listener in list(self._event_listeners):
+            try:
+                listener(event)
+            except Exception as e:
+                log.error(f'Event listener error: {e}')
+
+    def _on_metadata(self, decoder, event):
+        self._emit_event(event)
+        # Delay 'now playing' until the samples the title applies to reach the output
+        delay = max(event['sample_position'] - decoder.buffer.frames_read, 0)
+        current_decoder = self._decoder
+        if decoder is self._next_decoder and current_decoder:
+            delay += current_decoder.buffer.available
+        delay /= self._sample_rate
+        output_stream = self._output_stream
+        if output_stream:
+            delay += output_stream.latency
+        timer = Timer(delay, self._on_now_playing, (event,))
+        timer.daemon = True
+        with self._swap_lock:
+            if self._supervisor_stop.is_set():
+                return
+            self._now_playing_timers = [t for t in self._now_playing_timers if t.is_alive()]
+            self._now_playing_timers.append(timer)
+            timer.start()
+
+    def _on_now_playing(self, event):
+        self.now_playing = event['title']
+        log.info(f"Now playing: {event['title']}")
+        self._emit_event({**event, 'type': 'now_playing'})
+
+    def _start_supervisor(self):
+        self._supervisor_thread = Thread(target=self._supervise, name='stream-supervisor', daemon=True)
+        self._supervisor_thread.start()
+
+    def _supervise(self):
+        log.debug('Stream supervisor started')
+        stalled_time = 0
+        last_bytes_received = 0
+        last_underflow_count = self.underflow_count
+        decoder = self._decoder
+        decoder_error_counted = False
+        while not self._supervisor_stop.wait(1.0):
+            # Underflows are only counted on the audio thread and reported from here
+            underflow_count = self.underflow_count
+            underflows = underflow_count - last_underflow_count
+            if underflows:
+                log.warning(f'Output buffer underflow ({underflows} blocks)')
+                last_underflow_count = underflow_count
+                self._emit_event({'type': 'underflow', 'count': underflow_count})
+            if not self.paused:
+                self._update_latency(underflows)
+            # The decoder is swapped by the audio callback after a reconnect
+            if decoder is not self._decoder:
+                decoder = self._decoder
+                decoder_error_counted = False
+                last_bytes_received = 0
+            if decoder is None:
+                break
+            if decoder.error is not None and not decoder_error_counted:
+                self.decoder_error_count += 1
+                decoder_error_counted = True
+            if self._timeshift is not None and decoder.finished:
+                # The timeshift buffer outlives the decoder, so only the decoder is restarted
+                log.warning('Timeshift decoder stopped, restarting')
+                self._seek(self._position())
+                continue
+            if not self.reconnect_attempts:
+                continue
+            source = self._input_sources()[0]
+            throughput = source.bytes_received - last_bytes_received
+            last_bytes_received = source.bytes_received
+            if throughput or source.full:
+                stalled_time = 0
+            else:
+                stalled_time += 1
+            # Reconnect as soon as the connection drops, while the buffered audio keeps playing
+            if source.finished or (decoder.finished and self._timeshift is None):
+                log.warning('Stream connection lost, reconnecting')
+            elif stalled_time >= self.stall_timeout:
+                log.warning(f'Stream stalled for {stalled_time}s, reconnecting')
+            else:
+                continue
+            if not self._reconnect():
+                break
+            stalled_time = 0
+        log.debug('Stream supervisor stopped')
+
+    def _reconnect(self):
+        gap_start = self._silence_frames
+        backoff = RECONNECT_BACKOFF_MIN
+        # The recording continues from the new connection
+        self._input_sources()[0].tee = None
+        for attempt in range(1, self.reconnect_attempts + 1):
+            log.debug(f'Reconnect attempt {attempt}/{self.reconnect_attempts}')
+            try:
+                stream_source, encoding, _sample_rate = self._open_stream()
+                if self._timeshift is None:
+                    decoder = self._create_decoder(stream_source, encoding)
+            except Exception as e:
+                log.warning(f'Reconnect attempt {attempt} failed: {e}')
+                if self._supervisor_stop.wait(backoff):
+                    return False
+                backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+                continue
+            if self._timeshift is not None:
+                # The decoder keeps reading the timeshift buffer, only the network side is replaced
+                with self._swap_lock:
+                    if self._supervisor_stop.is_set():
+                        stream_source.close()
+                        return False
+                    self._timeshift.attach(stream_source)
+            else:
+                with self._swap_lock:
+                    if self._supervisor_stop.is_set():
+                        decoder.stop()
+                        return False
+                    old_decoder = self._decoder
+                    self._next_decoder = decoder
+                # Wait for the audio callback to splice in the new decoder once the old one drains.
+                # A stalled old decoder stops a read timeout after its buffered audio, if it takes
+                # much longer the old connection resumed and the new one isn't needed.
+                old_source = old_decoder.source
+                bitrate = old_source.bitrate or TIMESHIFT_DEFAULT_BITRATE
+                buffered_time = old_decoder.buffer.available / self._sample_rate + old_source.buffered * 8 / bitrate
+                deadline = time.monotonic() + buffered_time + self.read_timeout * 2
+                while self._next_decoder is decoder and time.monotonic() < deadline:
+                    if self._supervisor_stop.wait(0.1):
+                        return False
+                with self._swap_lock:
+                    cancelled = self._next_decoder is decoder
+                    if cancelled:
+                        self._next_decoder = None
+                if cancelled:
+                    log.warning('Old stream connection still playing, cancelling reconnect')
+                    decoder.stop()
+                    recorder = self._recorder
+                    if recorder:
+                        recorder.attach(old_source, old_decoder.encoding)
+                    return True
+                old_decoder.stop()
+            gap = (self._silence_frames - gap_start) / self._sample_rate
+            self.reconnect_count += 1
+            self.last_reconnect_gap = gap
+            self.total_reconnect_gap += gap
+            log.info(f'Reconnected to stream (reconnects: {self.reconnect_count}, gap: {gap:.2f}s)')
+            self._emit_event({'type': 'reconnect', 'reconnects': self.reconnect_count, 'gap': gap})
+            return True
+        log.error(f'Could not reconnect to stream after {self.reconnect_attempts} attempts')
+        self._emit_event({'type': 'reconnect_failed', 'attempts': self.reconnect_attempts})
+        self._abort = True
+        return False
+
+    def _stop_supervisor(self, timeout=1.0):
+        with self._swap_lock:
+            self._supervisor_stop.set()
+        if self._supervisor_thread:
+            log.debug('Stopping stream supervisor')
+            if self._supervisor_thread is not current_thread():
+                self._supervisor_thread.join(timeout)
+            self._supervisor_thread = None
 
     def _stop_input(self):
-        if self._input_stream:
-            log.debug('Closing and destroying input stream')
-            self._input_stream.close()
-            self._input_stream = None
+        self._stop_supervisor()
+        with self._swap_lock:
+            for timer in self._now_playing_timers:
+                timer.cancel()
+            self._now_playing_timers.clear()
+        # While recording, the stream is kept by the standby, so there's no gap in the recording
+        keep_decoder = None
+        timeshift = self._timeshift
+        self._timeshift = None
+        if timeshift is not None:
+            stream_source = timeshift.detach()
+            timeshift.close()
+            if self._recorder and stream_source and not stream_source.finished:
+                self._standby.keep_stream((stream_source, miniaudio.FileFormat.MP3, self._sample_rate))
+            elif stream_source:
+                stream_source.close()
+        elif self._recorder and self._decoder and self._next_decoder is None and not self._decoder.source.finished:
+            keep_decoder = self._decoder
+        for decoder in (self._decoder, self._next_decoder):
+            if not decoder:
+                continue
+            if decoder is keep_decoder:
+                log.debug('Stopping stream decoder, keeping the stream for recording')
+                if decoder.stop(close_source=False):
+                    self._standby.keep_stream((decoder.source, decoder.encoding, self._sample_rate))
+                    continue
+                decoder.source.close()
+            else:
+                log.debug('Stopping and destroying stream decoder')
+                decoder.stop()
+        self.now_playing = None
+        self._decoder = None
+        self._next_decoder = None
 
-    def _stop_output(self):
+    def _stop_output(self, keep=False):
         if self._output_stream:
-            log.debug('Closing and destroying output stream')
             self._output_stream.abort()
-            self._output_stream.close()
+            if keep:
+                # Kept open to be restarted by the next play() on the same device
+                log.debug('Keeping output stream for warm standby')
+                self._standby.keep_output(self._output_stream, self._output_stream_key({
+                    'sample-rate': self._sample_rate,
+                    'channels': self._output_stream.channels,
+                    'dtype': self._output_stream.dtype
+                }, self._output_stream.blocksize))
+            else:
+                log.debug('Closing and destroying output stream')
+                self._output_stream.close()
             self._output_stream = None
@@ -0,0 +1,205 @@
+import logging
+import os
+import queue
+import re
+import time
+import miniaudio
+from pathlib import Path
+from threading import Event, Thread
+
+from .constants import (
+    RECENT_SONGS_UPDATE_TIME,
+    RECORDING_QUEUE_SIZE,
+    RECORDING_TITLE_MAX_LENGTH,
+    RECORDING_WRITE_BUFFER_SIZE
+)
+
+
+log = logging.getLogger(__name__)
+
+INVALID_FILENAME_CHARS_PATTERN = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+
+
+def recording_filename(title):
+    name = INVALID_FILENAME_CHARS_PATTERN.sub('_', title)[:RECORDING_TITLE_MAX_LENGTH]
+    # Windows doesn't allow names ending with a dot or a space
+    return name.rstrip('. ') or 'Untitled'
+
+
+class StreamRecorder:
+
+    # Tees the compressed stream bytes to disk as they are received, without decoding. Stream
+    # sources call write() and set_title() with their lock held, so both only queue the data for
+    # the writer thread, and data that doesn't fit in the queue is dropped and counted. Files are
+    # split on title changes, except for Ogg streams, where a file can't start mid-stream. On a
+    # write error the recorder stops by itself and calls on_error(recorder) from the writer thread.
+
+    def __init__(
+        self,
+        directory,
+        get_recent_songs=None,
+        on_error=None,
+        queue_size=RECORDING_QUEUE_SIZE,
+        write_buffer_size=RECORDING_WRITE_BUFFER_SIZE
+    ):
+        self.directory = Path(directory)
+        self.write_buffer_size = write_buffer_size
+        self.path = None
+        self.bytes_written = 0
+        self.dropped_bytes = 0
+        self.error = None
+        self._get_recent_songs = get_recent_songs
+        self._on_error = on_error
+        self._queue = queue.Queue(queue_size)
+        self._stopped = False
+        self._extension = 'mp3'
+        self._split = True
+        self._title = None
+        self._file = None
+        self._writer_thread = None
+        self._feed_thread = None
+        self._feed_stop = Event()
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+    def start(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._writer_thread = Thread(target=self._write_loop, name='stream-recorder', daemon=True)
+        self._writer_thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._feed_stop.set()
+        # Waits for the queued data to be written, unless the writer already stopped on an error
+        while self._writer_thread.is_alive():
+            try:
+                self._queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self._writer_thread.join()
+        if self.dropped_bytes:
+            log.warning(f'Recording dropped {self.dropped_bytes} bytes, the disk could not keep up')
+
+    def attach(self, source, encoding):
+        # Records the stream of source from now on, replacing any earlier one
+        self._put(('stream', encoding))
+        if source.icy_title:
+            self._put(('title', source.icy_title))
+        source.tee = self
+        if not source.icy_metadata and self._get_recent_songs and not self._feed_thread:
+            # Without in-band titles, tracks are split on the changes in the recent songs feed
+            self._feed_thread = Thread(target=self._feed_loop, name='recorder-feed', daemon=True)
+            self._feed_thread.start()
+
+    def write(self, data):
+        if not self._put(('data', data)):
+            self.dropped_bytes += len(data)
+
+    def set_title(self, title):
+        self._put(('title', title))
+
+    def _put(self, item):
+        # Sources still attached after stop() are ignored
+        if self._stopped:
+            return True
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            return False
+        return True
+
+    def _write_loop(self):
+        log.debug(f"Recording to '{self.directory}'")
+        try:
+            try:
+                while True:
+                    item = self._queue.get()
+                    if item is None:
+                        break
+                    kind, value = item
+                    if kind == 'data':
+                        if self._file is None:
+                            self._open_file()
+                        self._file.write(value)
+                        self.bytes_written += len(value)
+                    elif kind == 'title':
+                        self._on_title(value)
+                    else:
+                        self._on_stream(value)
+            finally:
+                self._close_file()
+        except OSError as e:
+            log.error(f'Recording error: {e}')
+            self.error = e
+            self._stopped = True
+            self._feed_stop.set()
+        log.debug('Recording stopped')
+        if self.error and self._on_error:
+            self._on_error(self)
+
+    def _on_title(self, title):
+        if title == self._title:
+            return
+        previous_title = self._title
+        self._title = title
+        if self._file is None:
+            return
+        if previous_title is None:
+            # The part before the first title is kept with it, it's the rest of the same track
+            self._close_file(rename=True)
+            self._open_file(append=True)
+        elif self._split:
+            self._close_file()
+            self._open_file()
+
+    def _on_stream(self, encoding):
+        self._extension = 'ogg' if encoding == miniaudio.FileFormat.VORBIS else 'mp3'
+        self._split = encoding != miniaudio.FileFormat.VORBIS
+        # A new Ogg stream starts with its own headers, so it goes to a new file
+        if self._file is not None and not self._split:
+            self._close_file()
+
+    def _new_path(self):
+        if self._title is None:
+            name = time.strftime('Recording %Y-%m-%d %H-%M-%S')
+        else:
+            name = recording_filename(self._title)
+        path = self.directory / f'{name}.{self._extension}'
+        i = 2
+        while path.exists():
+            path = self.directory / f'{name} ({i}).{self._extension}'
+            i += 1
+        return path
+
+    def _open_file(self, append=False):
+        if not append:
+            self.path = self._new_path()
+        log.info(f"Recording to '{self.path.name}'")
+        self._file = open(self.path, 'ab' if append else 'wb', buffering=self.write_buffer_size)
+
+    def _close_file(self, rename=False):
+        if self._file is None:
+            return
+        file = self._file
+        self._file = None
+        file.close()
+        if rename:
+            path = self._new_path()
+            os.replace(self.path, path)
+            self.path = path
+
+    def _feed_loop(self):
+        last_title = None
+        while not self._feed_stop.is_set():
+            try:
+                recent_songs = self._get_recent_songs(max_age=0)
+            except Exception as e:
+                log.debug(f'Could not get recent songs for recording: {e}')
+            else:
+                if recent_songs and recent_songs[0]['title'] != last_title:
+                    last_title = recent_songs[0]['title']
+                    self.set_title(last_title)
+            self._feed_stop.wait(RECENT_SONGS_UPDATE_TIME)
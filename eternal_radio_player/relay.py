@@ -0,0 +1,376 @@
+import logging
+import socket
+import miniaudio
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Condition, Event, Lock, Thread
+
+from ._version import __version__
+from .constants import (
+    READ_TIMEOUT,
+    RECONNECT_BACKOFF_MAX,
+    RECONNECT_BACKOFF_MIN,
+    RELAY_ADDRESS,
+    RELAY_BACKLOG_SIZE,
+    RELAY_BURST_SIZE,
+    RELAY_CLIENT_TIMEOUT,
+    RELAY_ICY_METAINT,
+    RELAY_MAX_CLIENTS,
+    RELAY_PORT,
+    RELAY_SEND_BUFFER_SIZE,
+    REQUEST_TIMEOUT,
+    STREAM_ITER_CHUNK_SIZE,
+    STREAM_STALL_TIMEOUT,
+    STREAM_URL
+)
+from .exceptions import RelayError, StreamError
+from .stream import HTTPStreamSource, stream_request
+
+
+log = logging.getLogger(__name__)
+
+
+def icy_metadata_block(title):
+    metadata = f"StreamTitle='{title}';".encode('utf-8', 'replace')
+    metadata += b'\0' * (-len(metadata) % 16)
+    return bytes((len(metadata) // 16,)) + metadata
+
+
+class RelayBuffer:
+
+    # Backlog of the relayed audio shared by all clients. Chunks are kept as received, without
+    # copying, and each client reads from its own byte offset, so nothing is stored per client.
+
+    def __init__(self, backlog_size=RELAY_BACKLOG_SIZE):
+        self.backlog_size = backlog_size
+        self.headers = None
+        self._chunks = deque()
+        self._titles = deque()
+        self._head = 0
+        self._tail = 0
+        self._closed = False
+        self._cond = Condition()
+
+    @property
+    def head(self):
+        return self._head
+
+    @property
+    def tail(self):
+        return self._tail
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def write(self, data):
+        with self._cond:
+            if self._closed or not data:
+                return
+            self._chunks.append((self._head, data))
+            self._head += len(data)
+            # Whole chunks are dropped, so the backlog is at least backlog_size
+            while self._head - self._chunks[0][0] - len(self._chunks[0][1]) >= self.backlog_size:
+                offset, chunk = self._chunks.popleft()
+                self._tail = offset + len(chunk)
+            while len(self._titles) > 1 and self._titles[1][0] <= self._tail:
+                self._titles.popleft()
+            self._cond.notify_all()
+
+    def add_title(self, offset, title):
+        with self._cond:
+            self._titles.append((offset, title))
+
+    def set_headers(self, headers):
+        with self._cond:
+            self.headers = headers
+            self._cond.notify_all()
+
+    def wait_for_headers(self, timeout):
+        with self._cond:
+            self._cond.wait_for(lambda: self.headers is not None or self._closed, timeout)
+            return self.headers
+
+    def start_offset(self, burst_size):
+        with self._cond:
+            return max(self._head - burst_size, self._tail)
+
+    def read(self, offset, timeout):
+        # Returns memoryviews of the data from offset, an empty list if there's none before the
+        # timeout, or None once offset fell out of the backlog or the buffer is closed
+        with self._cond:
+            self._cond.wait_for(lambda: self._head > offset or self._closed, timeout)
+            if self._closed or offset < self._tail:
+                return None
+            views = []
+            # Clients read close to the head, so the chunks are searched from the newest
+            for chunk_offset, chunk in reversed(self._chunks):
+                if chunk_offset + len(chunk) <= offset:
+                    break
+                views.append(memoryview(chunk)[max(offset - chunk_offset, 0):])
+            views.reverse()
+            return views
+
+    def title_at(self, offset):
+        with self._cond:
+            for title_offset, title in reversed(self._titles):
+                if title_offset <= offset:
+                    return title
+            return None
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._chunks.clear()
+            self._cond.notify_all()
+
+
+class RelayRequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.0'
+    server_version = f'EternalRadioPlayerRelay/{__version__}'
+    # Socket timeout, a client that doesn't take data for this long is dropped
+    timeout = RELAY_CLIENT_TIMEOUT
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, RELAY_SEND_BUFFER_SIZE)
+
+    def log_message(self, format, *args):
+        log.debug(f'{self.address_string()} - {format % args}')
+
+    def do_GET(self):
+        if self.path != '/':
+            self.send_error(404)
+            return
+        relay = self.server.relay
+        headers = relay.buffer.wait_for_headers(relay.request_timeout)
+        if headers is None:
+            self.send_error(503, 'Stream not available')
+            return
+        if not relay.add_client(self):
+            self.send_error(503, 'Too many clients')
+            return
+        try:
+            self._send_stream(relay, headers)
+        except socket.timeout:
+            log.info(f'Dropping relay client {self.address_string()}, not taking data')
+            relay.dropped_clients += 1
+        except OSError as e:
+            log.debug(f'Relay client {self.address_string()} disconnected: {e}')
+        finally:
+            relay.remove_client(self)
+
+    def _send_stream(self, relay, headers):
+        buffer = relay.buffer
+        metaint = RELAY_ICY_METAINT if self.headers.get('Icy-MetaData') == '1' else 0
+        self.send_response(200)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if metaint:
+            self.send_header('icy-metaint', str(metaint))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        offset = buffer.start_offset(relay.burst_size)
+        metadata_remaining = metaint
+        title = None
+        log.debug(f'Relay client {self.address_string()} connected')
+        while True:
+            views = buffer.read(offset, relay.read_timeout)
+            if views is None:
+                if not buffer.closed:
+                    log.info(f'Dropping relay client {self.address_string()}, too far behind')
+                    relay.dropped_clients += 1
+                return
+            for view in views:
+                while view:
+                    size = min(len(view), metadata_remaining) if metaint else len(view)
+                    self.wfile.write(view[:size])
+                    self.bytes_sent += size
+                    offset += size
+                    view = view[size:]
+                    if not metaint:
+                        continue
+                    metadata_remaining -= size
+                    if metadata_remaining == 0:
+                        # Like the stations, the title is only sent again when it changes
+                        new_title = buffer.title_at(offset)
+                        if new_title is not None and new_title != title:
+                            title = new_title
+                            self.wfile.write(icy_metadata_block(title))
+                        else:
+                            self.wfile.write(b'\0')
+                        metadata_remaining = metaint
+
+
+class RelayServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, relay):
+        super().__init__(address, RelayRequestHandler)
+        self.relay = relay
+
+
+class StreamRelay:
+
+    # Re-streams one upstream connection to many local HTTP clients. The compressed stream is
+    # relayed as received, with the ICY headers of the station and in-band titles at the relay's
+    # own interval for the clients that ask for them.
+
+    def __init__(
+        self,
+        stream_url=STREAM_URL,
+        address=RELAY_ADDRESS,
+        port=RELAY_PORT,
+        burst_size=RELAY_BURST_SIZE,
+        backlog_size=RELAY_BACKLOG_SIZE,
+        max_clients=RELAY_MAX_CLIENTS,
+        request_timeout=REQUEST_TIMEOUT,
+        read_timeout=READ_TIMEOUT,
+        stall_timeout=STREAM_STALL_TIMEOUT,
+        stream_chunk_size=STREAM_ITER_CHUNK_SIZE
+    ):
+        if burst_size > backlog_size:
+            raise ValueError(f'Relay burst size {burst_size} is larger than the backlog size {backlog_size}')
+        self.stream_url = stream_url
+        self.burst_size = burst_size
+        self.max_clients = max_clients
+        self.request_timeout = request_timeout
+        self.read_timeout = read_timeout
+        self.stall_timeout = stall_timeout
+        self.stream_chunk_size = stream_chunk_size
+        self.buffer = RelayBuffer(backlog_size)
+        self.bytes_received = 0
+        self.reconnect_count = 0
+        self.dropped_clients = 0
+        # Set when the stream can't be relayed, the server is shut down then
+        self.error = None
+        self._clients = set()
+        self._clients_lock = Lock()
+        self._bytes_sent = 0
+        self._source = None
+        self._stop = Event()
+        self._upstream_thread = None
+        self._server_thread = None
+        try:
+            self._server = RelayServer((address, port), self)
+        except OSError as e:
+            raise RelayError(f'Could not listen on {address}:{port}: {e}') from e
+
+    @property
+    def url(self):
+        address, port = self._server.server_address[:2]
+        return f'http://{address}:{port}/'
+
+    def start(self):
+        self._upstream_thread = Thread(target=self._upstream, name='relay-upstream', daemon=True)
+        self._upstream_thread.start()
+        self._server_thread = Thread(target=self._server.serve_forever, name='relay-server', daemon=True)
+        self._server_thread.start()
+        log.info(f"Relaying '{self.stream_url}' at {self.url}")
+
+    def join(self):
+        # Waits in steps, so KeyboardInterrupt is handled on all platforms
+        while self._server_thread.is_alive():
+            self._server_thread.join(1.0)
+
+    def stop(self):
+        log.debug('Stopping relay')
+        self._stop.set()
+        self._server.shutdown()
+        self._server.server_close()
+        self.buffer.close()
+        source = self._source
+        if source:
+            source.close()
+        self._upstream_thread.join(1.0)
+
+    def add_client(self, client):
+        client.bytes_sent = 0
+        with self._clients_lock:
+            if len(self._clients) >= self.max_clients:
+                return False
+            self._clients.add(client)
+        return True
+
+    def remove_client(self, client):
+        with self._clients_lock:
+            self._clients.discard(client)
+            self._bytes_sent += client.bytes_sent
+
+    def get_stats(self):
+        with self._clients_lock:
+            clients = len(self._clients)
+            bytes_sent = self._bytes_sent + sum(client.bytes_sent for client in self._clients)
+        return {
+            'clients': clients,
+            'dropped_clients': self.dropped_clients,
+            'bytes_received': self.bytes_received,
+            'bytes_sent': bytes_sent,
+            'reconnects': self.reconnect_count
+        }
+
+    def _connect(self):
+        request, encoding, _sample_rate = stream_request(self.request_timeout, self.read_timeout, url=self.stream_url)
+        # A Vorbis stream can only be decoded from its start, not from the newest data
+        if encoding != miniaudio.FileFormat.MP3:
+            request.close()
+            raise RelayError(f'Relay is not supported for {encoding.name} streams')
+        # The content type and ICY headers are passed through, the metadata interval is the relay's
+        headers = {
+            name: value for name, value in request.headers.items()
+            if name.lower() == 'content-type' or (name.lower().startswith('icy-') and name.lower() != 'icy-metaint')
+        }
+        # Reads time out once no data came for the stall timeout
+        source = HTTPStreamSource(
+            request,
+            iter_chunk_size=self.stream_chunk_size,
+            read_timeout=self.stall_timeout
+        )
+        self.buffer.set_headers(headers)
+        return source
+
+    def _upstream(self):
+        log.debug('Relay upstream reader started')
+        backoff = RECONNECT_BACKOFF_MIN
+        wait_time = 0.0
+        while not self._stop.wait(wait_time):
+            try:
+                source = self._connect()
+            except RelayError as e:
+                # Retrying won't help, so clients are turned away and join() returns
+                self.error = e
+                self.buffer.close()
+                self._server.shutdown()
+                break
+            except Exception as e:
+                log.warning(f'Could not connect relay to stream: {e}')
+                wait_time = backoff
+                backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+                continue
+            if self._source is not None:
+                self.reconnect_count += 1
+                log.info(f'Relay reconnected to stream (reconnects: {self.reconnect_count})')
+            self._source = source
+            backoff = RECONNECT_BACKOFF_MIN
+            wait_time = 0.0
+            # Moves the title positions of this connection to the relay buffer offsets
+            base_offset = self.buffer.head
+            try:
+                while not self._stop.is_set():
+                    # Reads return slices of the received chunks, which are shared without copying
+                    data = source.read(self.stream_chunk_size)
+                    if not data:
+                        log.warning('Relay stream ended, reconnecting')
+                        break
+                    self.buffer.write(data)
+                    self.bytes_received += len(data)
+                    for position, title in source.pop_metadata():
+                        self.buffer.add_title(base_offset + position, title)
+            except StreamError as e:
+                if not self._stop.is_set():
+                    log.warning(f'Relay stream error: {e}, reconnecting')
+            source.close()
+        log.debug('Relay upstream reader stopped')
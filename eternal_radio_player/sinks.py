@@ -0,0 +1,328 @@
+import logging
+import sys
+import time
+import wave
+import numpy
+from abc import ABC, abstractmethod
+from threading import current_thread, Thread
+from types import SimpleNamespace
+
+from .constants import OUTPUT_SINK_SAMPLE_RATE
+from .exceptions import OutputError
+
+
+log = logging.getLogger(__name__)
+
+
+class CallbackAbort(Exception):
+    # Raised by a sink callback to stop the sink, like sounddevice.CallbackAbort
+    pass
+
+
+class OutputSink(ABC):
+
+    # All sinks follow the sounddevice.OutputStream contract: callback(output, frames, time, status)
+    # fills one block of output at a time until it raises CallbackAbort or the sink is aborted,
+    # then finished_callback() is called. A sink can be restarted after stop() or abort().
+
+    name = None
+    uses_device = False
+    # Sample formats the sink takes, in order of preference for the 'auto' sample format
+    sample_formats = ('int16', 'float32')
+
+    def __init__(
+        self,
+        samplerate,
+        blocksize,
+        channels,
+        dtype,
+        callback,
+        finished_callback=None,
+        device=None,
+        path=None,
+        latency=None
+    ):
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.channels = channels
+        self.dtype = dtype
+        self.device = device
+        self.path = path
+        # The suggested latency in seconds only applies to device sinks, the others have one block
+        self.suggested_latency = latency
+        self.latency = blocksize / samplerate
+        self._callback = callback
+        self._finished_callback = finished_callback
+
+    @classmethod
+    def get_device(cls, device_index=None):
+        return {'name': cls.name, 'host_api': None, 'sample_rate': OUTPUT_SINK_SAMPLE_RATE, 'index': None}
+
+    @classmethod
+    def check_params(cls, device_index, channels, sample_rate, dtype):
+        return True
+
+    @classmethod
+    def writes_stdout(cls, path):
+        return False
+
+    @abstractmethod
+    def start(self):
+        pass
+
+    def stop(self):
+        self.abort()
+
+    @abstractmethod
+    def abort(self):
+        pass
+
+    def close(self):
+        self.abort()
+
+
+class SoundDeviceSink(OutputSink):
+
+    name = 'sounddevice'
+    uses_device = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        import sounddevice
+        from .devices import get_device_registry, open_output_stream
+
+        self._callback_abort = sounddevice.CallbackAbort
+        try:
+            self._stream = open_output_stream(
+                samplerate=self.samplerate,
+                blocksize=self.blocksize,
+                device=self.device,
+                channels=self.channels,
+                dtype=self.dtype,
+                latency=self.suggested_latency,
+                callback=self._stream_callback,
+                finished_callback=self._finished_callback
+            )
+        except sounddevice.PortAudioError as e:
+            # The device may have been removed, which PortAudio only sees once re-initialized
+            get_device_registry().invalidate(reinitialize=True)
+            raise OutputError(f'Could not open output stream: {e}') from e
+        self.latency = self._stream.latency
+
+    @property
+    def active(self):
+        return self._stream.active
+
+    @classmethod
+    def get_device(cls, device_index=None):
+        # Importing sounddevice raises OSError when the PortAudio library is missing
+        try:
+            import sounddevice
+            from .devices import get_output_device
+        except OSError as e:
+            raise OutputError(
+                f"Could not load PortAudio: {e}, use '--output-sink null|wav|pcm' to play without it"
+            ) from e
+
+        try:
+            try:
+                return get_output_device(device_index)
+            except ValueError:
+                return get_output_device()
+        except (sounddevice.PortAudioError, ValueError) as e:
+            raise OutputError(
+                f"Could not find an output device: {e}, use '--output-sink null|wav|pcm' to play without one"
+            ) from e
+
+    @classmethod
+    def check_params(cls, device_index, channels, sample_rate, dtype):
+        from .devices import check_output_device_params
+
+        return check_output_device_params(device_index, channels, sample_rate, dtype)
+
+    def start(self):
+        self._stream.start()
+
+    def stop(self):
+        self._stream.stop()
+
+    def abort(self):
+        self._stream.abort()
+
+    def close(self):
+        from .devices import close_output_stream
+
+        close_output_stream(self._stream)
+
+    def _stream_callback(self, *args):
+        try:
+            self._callback(*args)
+        except CallbackAbort:
+            raise self._callback_abort
+
+
+class ThreadSink(OutputSink):
+
+    # Calls the callback from its own thread, paced at the real-time rate if realtime is set.
+    # A block that finishes after its deadline is reported as an output underflow in the status
+    # of the next one, like PortAudio does.
+
+    realtime = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.active = False
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._running = True
+        self.active = True
+        self._thread = Thread(target=self._run, name='output-sink', daemon=True)
+        self._thread.start()
+
+    def abort(self):
+        self._running = False
+        thread = self._thread
+        self._thread = None
+        if thread and thread is not current_thread():
+            thread.join(1.0)
+
+    def close(self):
+        self.abort()
+        self._close()
+
+    def _open(self):
+        pass
+
+    def _write(self, output):
+        pass
+
+    def _close(self):
+        pass
+
+    def _run(self):
+        output = numpy.zeros((self.blocksize, self.channels), self.dtype)
+        underflow = SimpleNamespace(output_underflow=True)
+        status = None
+        block_time = self.blocksize / self.samplerate
+        deadline = time.perf_counter()
+        try:
+            self._open()
+            while self._running:
+                self._callback(output, self.blocksize, None, status)
+                self._write(output)
+                if not self.realtime:
+                    continue
+                deadline += block_time
+                now = time.perf_counter()
+                if now > deadline:
+                    status = underflow
+                    deadline = now
+                else:
+                    status = None
+                    time.sleep(deadline - now)
+        except CallbackAbort:
+            pass
+        except Exception as e:
+            log.error(f'Output sink error: {e}')
+        self.active = False
+        if self._finished_callback:
+            self._finished_callback()
+
+
+class NullSink(ThreadSink):
+
+    name = 'null'
+
+
+class FastNullSink(ThreadSink):
+
+    # For throughput tests, the stream can't keep up with it
+
+    name = 'null-fast'
+    realtime = False
+
+
+class WavFileSink(ThreadSink):
+
+    name = 'wav'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.path:
+            raise OutputError('WAV output sink requires a file path')
+        # The wave module only writes integer PCM, float blocks are converted to 16 bits
+        try:
+            self._file = wave.open(self.path, 'wb')
+        except OSError as e:
+            raise OutputError(f"Could not open WAV file '{self.path}': {e}") from e
+        dtype = numpy.dtype(self.dtype)
+        self._file.setnchannels(self.channels)
+        self._file.setsampwidth(2 if dtype.kind == 'f' else dtype.itemsize)
+        self._file.setframerate(self.samplerate)
+        self._samples = numpy.empty((self.blocksize, self.channels), numpy.int16)
+
+    def _write(self, output):
+        if output.dtype.kind == 'f':
+            numpy.clip(output, -1.0, 1.0, out=output)
+            numpy.multiply(output, 32767, out=self._samples, casting='unsafe')
+            self._file.writeframesraw(self._samples)
+        else:
+            self._file.writeframesraw(output)
+
+    def _close(self):
+        # Finalizes the header with the number of frames written
+        self._file.close()
+
+
+class PCMSink(ThreadSink):
+
+    # Writes raw interleaved samples in the output format to a file, a FIFO or '-' for stdout.
+    # A FIFO is opened by the sink thread, since opening it waits for a reader.
+
+    name = 'pcm'
+    # Float samples by default, since readers of the raw samples can't tell the format
+    sample_formats = ('float32', 'int16')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.path:
+            self.path = '-'
+        self._file = None
+
+    @classmethod
+    def writes_stdout(cls, path):
+        return not path or path == '-'
+
+    def _open(self):
+        if self._file is not None:
+            return
+        if self.path == '-':
+            self._file = sys.stdout.buffer
+        else:
+            self._file = open(self.path, 'wb')
+
+    def _write(self, output):
+        self._file.write(output)
+
+    def _close(self):
+        if self._file is None:
+            return
+        if self._file is sys.stdout.buffer:
+            self._file.flush()
+        else:
+            self._file.close()
+        self._file = None
+
+
+OUTPUT_SINKS = {sink.name: sink for sink in (SoundDeviceSink, NullSink, FastNullSink, WavFileSink, PCMSink)}
+
+
+def get_output_sink(name):
+    try:
+        return OUTPUT_SINKS[name]
+    except KeyError:
+        raise OutputError(f"Unknown output sink '{name}'") from None
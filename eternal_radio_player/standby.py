@@ -0,0 +1,189 @@
+import logging
+import time
+import miniaudio
+from threading import Event, Lock, Thread, Timer
+
+from .constants import (
+    RECONNECT_BACKOFF_MAX,
+    RECONNECT_BACKOFF_MIN,
+    STANDBY_BANDWIDTH,
+    STANDBY_BANDWIDTH_HEADROOM,
+    STANDBY_BUFFER_SIZE,
+    STANDBY_GRACE_TIME,
+    STANDBY_MAX_LAG
+)
+
+
+log = logging.getLogger(__name__)
+
+
+class WarmStandby:
+
+    # Keeps what play() needs ready while the player is stopped: a stream connection reading a
+    # small rolling buffer at a capped rate, and the last output stream, idle, for a grace period.
+    # The cap is raised to the stream bitrate with some headroom, since a stream read slower than
+    # it falls behind live. Streams without a known bitrate aren't capped. A stream that still
+    # falls behind, on a slow network, is replaced once it lags max_lag seconds.
+
+    def __init__(
+        self,
+        open_stream,
+        grace_time=STANDBY_GRACE_TIME,
+        buffer_size=STANDBY_BUFFER_SIZE,
+        bandwidth=STANDBY_BANDWIDTH,
+        max_lag=STANDBY_MAX_LAG
+    ):
+        self.grace_time = grace_time
+        self.buffer_size = buffer_size
+        self.bandwidth = bandwidth
+        self.max_lag = max_lag
+        self._open_stream = open_stream
+        self._stream = None
+        self._stream_opened = 0.0
+        self._output_stream = None
+        self._output_key = None
+        self._output_timer = None
+        self._stop = None
+        self._lock = Lock()
+
+    @property
+    def ready(self):
+        stream = self._stream
+        return stream is not None and not stream[0].finished
+
+    def start(self):
+        if self._stop:
+            return
+        # Each run gets its own stop event, so a run still connecting after stop() never
+        # keeps going alongside the next one
+        self._stop = Event()
+        Thread(target=self._run, args=(self._stop,), name='warm-standby', daemon=True).start()
+
+    def stop(self):
+        # Doesn't wait for the thread, a stream it opens after this is closed by the thread itself
+        if self._stop:
+            self._stop.set()
+            self._stop = None
+
+    def close(self):
+        self.stop()
+        with self._lock:
+            stream = self._stream
+            self._stream = None
+        if stream:
+            stream[0].close()
+        self._close_output()
+
+    def keep_stream(self, stream):
+        # Keeps an open (source, encoding, sample rate) stream, replacing the current one
+        stream[0].standby(self.buffer_size, self._bandwidth(stream[0]))
+        with self._lock:
+            old_stream = self._stream
+            self._stream = stream
+            self._stream_opened = time.monotonic()
+        if old_stream:
+            old_stream[0].close()
+
+    def discard_stream(self):
+        with self._lock:
+            stream = self._stream
+            self._stream = None
+        if stream:
+            stream[0].close()
+
+    def take_stream(self):
+        # Returns the standby (source, encoding, sample rate) resumed at full rate, or None
+        self.stop()
+        with self._lock:
+            stream = self._stream
+            self._stream = None
+        if stream is None:
+            return None
+        # A new decoder can't start mid-stream in Ogg, without the Vorbis headers
+        if stream[0].finished or (stream[0].bytes_read and stream[1] == miniaudio.FileFormat.VORBIS):
+            stream[0].close()
+            return None
+        stream[0].resume()
+        log.debug(f'Using standby stream with {stream[0].buffered} bytes buffered')
+        return stream
+
+    def keep_output(self, output_stream, key):
+        # Keeps a stopped output stream for reuse by take_output() with the same key
+        self._close_output()
+        timer = Timer(self.grace_time, self._close_output)
+        timer.daemon = True
+        with self._lock:
+            self._output_stream = output_stream
+            self._output_key = key
+            self._output_timer = timer
+        timer.start()
+
+    def take_output(self, key):
+        with self._lock:
+            output_stream = self._output_stream
+            matches = output_stream is not None and self._output_key == key
+            if matches:
+                self._output_timer.cancel()
+                self._output_stream = None
+                self._output_key = None
+                self._output_timer = None
+        if not matches:
+            self._close_output()
+            return None
+        log.debug('Using standby output stream')
+        return output_stream
+
+    def _close_output(self):
+        with self._lock:
+            output_stream = self._output_stream
+            if self._output_timer:
+                self._output_timer.cancel()
+            self._output_stream = None
+            self._output_key = None
+            self._output_timer = None
+        if output_stream:
+            log.debug('Closing standby output stream')
+            output_stream.close()
+
+    def _bandwidth(self, source):
+        if not self.bandwidth or not source.bitrate:
+            return None
+        return max(self.bandwidth, source.bitrate / 8 * STANDBY_BANDWIDTH_HEADROOM)
+
+    def _lag(self):
+        source = self._stream[0]
+        if not self._bandwidth(source):
+            return 0.0
+        elapsed = time.monotonic() - self._stream_opened
+        return elapsed - source.bytes_received * 8 / source.bitrate
+
+    def _run(self, stop):
+        log.debug('Warm standby started')
+        backoff = RECONNECT_BACKOFF_MIN
+        wait_time = 0.0
+        while not stop.wait(wait_time):
+            wait_time = 1.0
+            with self._lock:
+                stream = self._stream
+                if stream is not None and not stream[0].finished and self._lag() < self.max_lag:
+                    continue
+                self._stream = None
+            if stream is not None:
+                log.debug('Replacing standby stream')
+                stream[0].close()
+            try:
+                stream = self._open_stream()
+            except Exception as e:
+                log.debug(f'Could not open standby stream: {e}')
+                wait_time = backoff
+                backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+                continue
+            backoff = RECONNECT_BACKOFF_MIN
+            stream[0].standby(self.buffer_size, self._bandwidth(stream[0]))
+            with self._lock:
+                if stop.is_set():
+                    stream[0].close()
+                    break
+                self._stream = stream
+                self._stream_opened = time.monotonic()
+        log.debug('Warm standby stopped')
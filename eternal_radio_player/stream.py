@@ -1,47 +1,311 @@
 import logging
+import re
+import time
 import miniaudio
-import requests
+from collections import deque
+from threading import Condition, Thread
 
-from .constants import REQUEST_TIMEOUT, STREAM_ITER_CHUNK_SIZE, STREAM_URL, USER_AGENT
+from .buffers import ChunkBuffer
+from .constants import (
+    READ_TIMEOUT,
+    REQUEST_TIMEOUT,
+    STREAM_HIGH_WATERMARK,
+    STREAM_ITER_CHUNK_SIZE,
+    STREAM_LOW_WATERMARK,
+    STREAM_MIN_READ_SIZE,
+    STREAM_PREBUFFER_SIZE,
+    STREAM_URL
+)
 from .exceptions import StreamError
+from .mp3 import parse_mp3_frame_header
+from .transport import get_transport
 
 
 log = logging.getLogger(__name__)
 
+ICY_STREAM_TITLE_PATTERN = re.compile(rb"StreamTitle='(.*?)';", re.DOTALL)
 
-class HTTPStreamSource(miniaudio.StreamableSource):
 
-    def __init__(self, request, iter_chunk_size=STREAM_ITER_CHUNK_SIZE):
+class StreamSource(miniaudio.StreamableSource):
+
+    # Jitter buffer between a network reader feeding chunks with write() and the decoder
+
+    def __init__(
+        self,
+        headers,
+        prebuffer_size=STREAM_PREBUFFER_SIZE,
+        low_watermark=STREAM_LOW_WATERMARK,
+        high_watermark=STREAM_HIGH_WATERMARK,
+        read_timeout=READ_TIMEOUT
+    ):
+        if not 0 < low_watermark <= prebuffer_size <= high_watermark:
+            raise ValueError(
+                f'Invalid stream buffer sizes: low watermark: {low_watermark}, '
+                f'prebuffer: {prebuffer_size}, high watermark: {high_watermark}'
+            )
         super().__init__()
-        self._request = request
-        self._stream_iter = self._request.raw.stream(iter_chunk_size, False)
-        self._buffer = bytearray()
+        self._prebuffer_size = prebuffer_size
+        self._low_watermark = low_watermark
+        self._high_watermark = high_watermark
+        self._read_timeout = read_timeout
+        self._buffer = ChunkBuffer()
+        self.bytes_received = 0
+        self.bytes_read = 0
+        # Audio bytes received and pending (position, title) pairs from in-band ICY metadata
+        self._audio_received = 0
+        self._metadata = deque()
+        try:
+            self._icy_metaint = int(headers.get('icy-metaint', 0))
+        except ValueError:
+            self._icy_metaint = 0
+        self._icy_audio_remaining = self._icy_metaint
+        self._icy_metadata_remaining = None
+        self._icy_metadata = bytearray()
+        self._icy_title = None
+        try:
+            self.bitrate = int(headers.get('icy-br', '').split(',')[0]) * 1000
+        except ValueError:
+            self.bitrate = None
+        # Rolling buffer size and read rate cap while kept in warm standby
+        self._standby_buffer_size = None
+        self._standby_bandwidth = None
+        self._throttle_until = 0.0
+        # Receives the audio bytes and titles as they arrive, see StreamRecorder
+        self.tee = None
+        self._cond = Condition()
+        self._ready = False
+        self._eof = False
+        self._error = None
+        self._closed = False
+
+    @property
+    def ready(self):
+        # Set once the prebuffer is filled, cleared when the buffer drops below the low watermark
+        return self._ready
+
+    @property
+    def buffered(self):
+        return len(self._buffer)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def finished(self):
+        return self._eof or self._error is not None
+
+    @property
+    def full(self):
+        # The reader is paused while the buffer is full, so no throughput is expected
+        return len(self._buffer) >= self._high_watermark
+
+    @property
+    def icy_metadata(self):
+        return bool(self._icy_metaint)
+
+    @property
+    def icy_title(self):
+        # The title of the audio received last
+        return self._icy_title
+
+    @property
+    def throttle_delay(self):
+        # Time the reader should wait before reading more while the read rate is capped
+        if not self._standby_bandwidth:
+            return 0.0
+        return max(self._throttle_until - time.monotonic(), 0.0)
 
     def read(self, size):
-        if self._request.raw.closed:
-            raise StreamError('Cannot read from a closed stream')
-        while len(self._buffer) < size:
-            try:
-                self._buffer.extend(next(self._stream_iter))
-            except StopIteration:
-                break
-        data = self._buffer[:size]
-        del self._buffer[:size]
+        with self._cond:
+            if self._closed:
+                raise StreamError('Cannot read from a closed stream')
+            if not self._buffer:
+                self._cond.wait_for(
+                    lambda: self._buffer or self._eof or self._error or self._closed,
+                    self._read_timeout
+                )
+            if not self._buffer:
+                if self._closed:
+                    raise StreamError('Cannot read from a closed stream')
+                if self._error:
+                    raise StreamError(f'Could not read from stream: {self._error}')
+                if self._eof:
+                    return b''
+                raise StreamError('Timed out waiting for stream data')
+            data = self._buffer.read(size)
+            # Fragments left by dropped data or split ICY metadata are joined with the next
+            # chunk, since decoders take a short read at init for the end of the stream
+            if len(data) < min(size, STREAM_MIN_READ_SIZE) and self._buffer:
+                data = bytes(data) + bytes(self._buffer.read(size - len(data)))
+            self.bytes_read += len(data)
+            if self._ready and not self._eof and len(self._buffer) < self._low_watermark:
+                self._ready = False
+            self._cond.notify_all()
         return data
 
+    def peek(self, size, timeout):
+        # Returns up to size bytes of the buffered audio without consuming them, waiting up to
+        # timeout for that much to arrive
+        with self._cond:
+            self._cond.wait_for(
+                lambda: len(self._buffer) >= size or self._eof or self._error or self._closed,
+                timeout
+            )
+            return self._buffer.peek(size)
 
-def stream_request(timeout=REQUEST_TIMEOUT, **kwargs):
-    log.debug(f"Making stream request with URL: '{STREAM_URL}', timeout: {timeout}")
+    def pop_metadata(self):
+        # Returns the metadata that applies to the audio read so far
+        events = []
+        with self._cond:
+            while self._metadata and self._metadata[0][0] <= self.bytes_read:
+                events.append(self._metadata.popleft())
+        return events
 
-    response = requests.get(
-        url=STREAM_URL,
-        headers={'User-Agent': USER_AGENT},
-        timeout=timeout,
-        stream=True,
-        **kwargs
-    )
+    def write(self, chunk):
+        with self._cond:
+            if self._closed:
+                return
+            self._feed(chunk)
+            self.bytes_received += len(chunk)
+            if self._standby_bandwidth:
+                self._throttle_until = max(self._throttle_until, time.monotonic()) + len(chunk) / self._standby_bandwidth
+            if self._standby_buffer_size is not None:
+                self._drop_excess(self._standby_buffer_size)
+            if not self._ready and len(self._buffer) >= self._prebuffer_size:
+                self._ready = True
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        with self._cond:
+            if self._closed:
+                return
+            if error is None:
+                log.debug('Stream reached end of data')
+                self._eof = True
+            else:
+                log.error(f'Stream reader error: {error}')
+                self._error = error
+            # Let the consumer drain the buffer and surface the error
+            self._ready = True
+            self._cond.notify_all()
+
+    def wait_for_space(self):
+        # Blocks the reader while the buffer is full or the read rate is capped, returns False
+        # once the source is closed
+        with self._cond:
+            self._cond.wait_for(lambda: self._closed or len(self._buffer) < self._high_watermark)
+            while not self._closed and self.throttle_delay:
+                self._cond.wait(self.throttle_delay)
+            return not self._closed
+
+    def standby(self, buffer_size, bandwidth=None):
+        # Keeps only the newest buffer_size bytes and caps the read rate in bytes per second
+        with self._cond:
+            self._standby_buffer_size = buffer_size
+            self._standby_bandwidth = bandwidth
+            self._drop_excess(buffer_size)
+
+    def resume(self):
+        with self._cond:
+            self._standby_buffer_size = None
+            self._standby_bandwidth = None
+            self._cond.notify_all()
 
-    content_type = response.headers.get('Content-Type')
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _drop_excess(self, size):
+        # Dropped audio counts as read, so metadata positions stay valid, and only the newest
+        # title before the read position is kept
+        while len(self._buffer) > size:
+            self.bytes_read += len(self._buffer.read(len(self._buffer) - size))
+        while len(self._metadata) > 1 and self._metadata[1][0] <= self.bytes_read:
+            self._metadata.popleft()
+        if self._ready and len(self._buffer) < self._low_watermark:
+            self._ready = False
+
+    def _feed(self, chunk):
+        tee = self.tee
+        if not self._icy_metaint:
+            self._buffer.append(chunk)
+            self._audio_received += len(chunk)
+            if tee:
+                tee.write(chunk)
+            return
+        # Split the metadata blocks out of the audio data, slicing the chunk without copying
+        view = memoryview(chunk)
+        while view:
+            if self._icy_audio_remaining:
+                size = min(len(view), self._icy_audio_remaining)
+                self._buffer.append(view[:size])
+                self._audio_received += size
+                if tee:
+                    tee.write(view[:size])
+                self._icy_audio_remaining -= size
+                view = view[size:]
+            elif self._icy_metadata_remaining is None:
+                self._icy_metadata_remaining = view[0] * 16
+                view = view[1:]
+            else:
+                size = min(len(view), self._icy_metadata_remaining)
+                self._icy_metadata += view[:size]
+                self._icy_metadata_remaining -= size
+                view = view[size:]
+            if self._icy_metadata_remaining == 0:
+                self._parse_metadata(bytes(self._icy_metadata))
+                self._icy_metadata.clear()
+                self._icy_metadata_remaining = None
+                self._icy_audio_remaining = self._icy_metaint
+
+    def _parse_metadata(self, data):
+        match = ICY_STREAM_TITLE_PATTERN.search(data)
+        if not match:
+            return
+        title = match.group(1).decode('utf-8', 'replace').strip()
+        if title == self._icy_title:
+            return
+        self._icy_title = title
+        log.debug(f"Received stream title at byte {self._audio_received}: '{title}'")
+        self._metadata.append((self._audio_received, title))
+        if self.tee:
+            self.tee.set_title(title)
+
+
+class HTTPStreamSource(StreamSource):
+
+    def __init__(self, request, iter_chunk_size=STREAM_ITER_CHUNK_SIZE, **kwargs):
+        super().__init__(request.headers, **kwargs)
+        self._request = request
+        self._stream_iter = self._request.raw.stream(iter_chunk_size, False)
+        self._reader_thread = Thread(target=self._reader, name='stream-reader', daemon=True)
+        self._reader_thread.start()
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        self._request.close()
+        self._reader_thread.join(1.0)
+
+    def _reader(self):
+        log.debug('Stream reader started')
+        try:
+            while self.wait_for_space():
+                chunk = next(self._stream_iter, None)
+                if chunk is None:
+                    self.finish()
+                    break
+                self.write(chunk)
+        except Exception as e:
+            self.finish(e)
+        log.debug('Stream reader stopped')
+
+
+def parse_stream_headers(headers):
+    content_type = headers.get('Content-Type')
     if content_type == 'audio/mpeg':
         encoding = miniaudio.FileFormat.MP3
     elif content_type == 'audio/ogg':
@@ -49,12 +313,59 @@ def stream_request(timeout=REQUEST_TIMEOUT, **kwargs):
     else:
         raise ValueError(f'Unsupported stream encoding: {content_type}')
 
-    if 'icy-sr' in response.headers:
+    if 'icy-sr' in headers:
         try:
-            sample_rate = int(response.headers['icy-sr'])
+            sample_rate = int(headers['icy-sr'])
         except ValueError:
             sample_rate = None
     else:
         sample_rate = None
 
+    return encoding, sample_rate
+
+
+def probe_stream_format(data, encoding):
+    # Returns (sample rate, channels) from the first bytes of the stream, or None if they're not
+    # found. An MP3 frame header is only trusted if the next frame starts where it says.
+    if encoding == miniaudio.FileFormat.VORBIS:
+        index = data.find(b'\x01vorbis')
+        if index == -1 or len(data) < index + 16:
+            return None
+        channels = data[index + 11]
+        sample_rate = int.from_bytes(data[index + 12:index + 16], 'little')
+        return (sample_rate, channels) if sample_rate and channels else None
+    index = data.find(b'\xff')
+    while 0 <= index <= len(data) - 4:
+        frame = parse_mp3_frame_header(data[index:index + 4])
+        next_index = index + frame[0] if frame else None
+        if frame and next_index <= len(data) - 4:
+            next_frame = parse_mp3_frame_header(data[next_index:next_index + 4])
+            if next_frame and next_frame[2] == frame[2]:
+                # Channel mode 3 is mono, the others are two channels
+                return frame[2], 1 if data[index + 3] >> 6 == 3 else 2
+        index = data.find(b'\xff', index + 1)
+    return None
+
+
+def stream_request(timeout=REQUEST_TIMEOUT, read_timeout=READ_TIMEOUT, transport=None, url=STREAM_URL, **kwargs):
+    log.debug(
+        f"Making stream request with URL: '{url}', timeout: {timeout}, read timeout: {read_timeout}"
+    )
+
+    if transport is None:
+        transport = get_transport()
+    response = transport.get(
+        url,
+        timeout=timeout,
+        read_timeout=read_timeout,
+        headers={'Icy-MetaData': '1'},
+        stream=True,
+        **kwargs
+    )
+
+    try:
+        encoding, sample_rate = parse_stream_headers(response.headers)
+    except ValueError:
+        response.close()
+        raise
     return response, encoding, sample_rate
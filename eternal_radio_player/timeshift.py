@@ -0,0 +1,374 @@
+import logging
+import mmap
+import tempfile
+import miniaudio
+import numpy
+from collections import deque
+from threading import Condition, Thread
+
+from .constants import (
+    READ_TIMEOUT,
+    STREAM_ITER_CHUNK_SIZE,
+    STREAM_LOW_WATERMARK,
+    STREAM_PREBUFFER_SIZE,
+    TIMESHIFT_INDEX_INTERVAL,
+    TIMESHIFT_RELEASE_SIZE
+)
+from .exceptions import StreamError
+from .mp3 import MP3FrameScanner
+
+
+log = logging.getLogger(__name__)
+
+
+class TimeshiftBuffer:
+
+    # Ring of the last size bytes of the compressed stream in a memory mapped temporary file,
+    # filled by a pump thread reading from the network stream source. An index of MP3 frame
+    # offsets and stream times, one entry every index_interval seconds, maps stream times to
+    # frame starts, so readers can start anywhere in the ring. Offsets and times count from the
+    # start of the timeshift and never wrap. Pages behind the writer and readers are released,
+    # so the resident memory stays flat however long the ring is.
+
+    def __init__(
+        self,
+        size,
+        length,
+        directory=None,
+        index_interval=TIMESHIFT_INDEX_INTERVAL,
+        chunk_size=STREAM_ITER_CHUNK_SIZE
+    ):
+        self.size = size
+        self.chunk_size = chunk_size
+        self.index_interval = index_interval
+        self.bitrate = None
+        self._file = tempfile.TemporaryFile(prefix='timeshift-', dir=directory)
+        try:
+            self._file.truncate(size)
+            self._mmap = mmap.mmap(self._file.fileno(), size)
+        except Exception:
+            self._file.close()
+            raise
+        self._head = 0
+        self._released = 0
+        self._time = 0.0
+        self._next_index_time = 0.0
+        # Fixed capacity for the length of the ring with room to spare, compacted when full
+        capacity = int(length / index_interval) * 2 + 16
+        self._index_offsets = numpy.zeros(capacity, numpy.int64)
+        self._index_times = numpy.zeros(capacity, numpy.float64)
+        self._index_size = 0
+        self._titles = deque()
+        self._scanner = MP3FrameScanner(self._on_frame)
+        self._source = None
+        self._source_offset = 0
+        self._cond = Condition()
+        self._closed = False
+        self._pump_thread = None
+
+    @property
+    def source(self):
+        return self._source
+
+    @property
+    def head(self):
+        return self._head
+
+    @property
+    def tail(self):
+        return max(self._head - self.size, 0)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def live_time(self):
+        return self._time
+
+    @property
+    def oldest_time(self):
+        with self._cond:
+            first = self._first_index()
+            if first >= self._index_size:
+                return self._time
+            return float(self._index_times[first])
+
+    def attach(self, source):
+        # Replaces the network source, the old one is closed
+        with self._cond:
+            old_source = self._source
+            self._source = source
+            # Metadata positions count from the start of the source, which may have been read from
+            self._source_offset = self._head - source.bytes_read
+            self._scanner.reset()
+            if source.bitrate:
+                self.bitrate = source.bitrate
+            self._cond.notify_all()
+        if old_source is not None:
+            old_source.close()
+        if self._pump_thread is None:
+            self._pump_thread = Thread(target=self._pump, name='timeshift-pump', daemon=True)
+            self._pump_thread.start()
+
+    def detach(self):
+        # Returns the network source without closing it, the pump stops reading from it
+        with self._cond:
+            source = self._source
+            self._source = None
+            self._cond.notify_all()
+        return source
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            source = self._source
+            self._cond.notify_all()
+        if source is not None:
+            source.close()
+        if self._pump_thread:
+            self._pump_thread.join(1.0)
+        with self._cond:
+            self._mmap.close()
+            self._file.close()
+
+    def offset_at(self, stream_time):
+        # Returns (offset, time) of the last indexed frame at or before stream_time, or the
+        # oldest one in the ring
+        with self._cond:
+            first = self._first_index()
+            if first >= self._index_size:
+                return None
+            times = self._index_times[first:self._index_size]
+            i = max(int(numpy.searchsorted(times, stream_time, 'right')) - 1, 0) + first
+            return int(self._index_offsets[i]), float(self._index_times[i])
+
+    def live_offset(self, delay_size):
+        # Returns (offset, time) of the last indexed frame at least delay_size bytes behind the head
+        with self._cond:
+            first = self._first_index()
+            if first >= self._index_size:
+                return None
+            offsets = self._index_offsets[first:self._index_size]
+            i = max(int(numpy.searchsorted(offsets, self._head - delay_size, 'right')) - 1, 0) + first
+            return int(self._index_offsets[i]), float(self._index_times[i])
+
+    def reader(self, offset, stream_time, **kwargs):
+        return TimeshiftReader(self, offset, stream_time, **kwargs)
+
+    def read(self, reader, offset, size, timeout):
+        # Returns the data at offset, possibly less than size, the offset it was read from, and
+        # if the ring overwrote the data at offset, the stream time of the oldest frame read instead
+        stream_time = None
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._closed or reader.closed or self._head > offset, timeout):
+                raise StreamError('Timed out waiting for stream data')
+            if self._closed or reader.closed:
+                raise StreamError('Cannot read from a closed stream')
+            if offset < self.tail:
+                first = self._first_index()
+                if first < self._index_size:
+                    new_offset = int(self._index_offsets[first])
+                    stream_time = float(self._index_times[first])
+                else:
+                    new_offset = self.tail
+                    stream_time = self._time
+                log.warning(f'Timeshift reader overrun, skipping {new_offset - offset} bytes')
+                offset = new_offset
+            size = min(size, self._head - offset)
+            start = offset % self.size
+            end = start + size
+            if end <= self.size:
+                data = self._mmap[start:end]
+            else:
+                data = self._mmap[start:] + self._mmap[:end - self.size]
+            return data, offset, stream_time
+
+    def wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def titles_between(self, start, end):
+        # Titles received in (start, end], or the one in effect at start if start is None
+        with self._cond:
+            if start is None:
+                title = None
+                for offset, t in self._titles:
+                    if offset > end:
+                        break
+                    title = (offset, t)
+                return [title] if title else []
+            return [(offset, t) for offset, t in self._titles if start < offset <= end]
+
+    def release(self, start, end):
+        # Drops the pages of a range of offsets from the resident memory, the data stays in the file
+        if not hasattr(self._mmap, 'madvise'):
+            return
+        start = start // mmap.PAGESIZE * mmap.PAGESIZE
+        end = end // mmap.PAGESIZE * mmap.PAGESIZE
+        if end - start >= self.size:
+            start, end = 0, self.size
+        else:
+            start %= self.size
+            end %= self.size
+        with self._cond:
+            if self._closed:
+                return
+            if start < end:
+                self._mmap.madvise(mmap.MADV_DONTNEED, start, end - start)
+            elif start > end:
+                self._mmap.madvise(mmap.MADV_DONTNEED, start, self.size - start)
+                if end:
+                    self._mmap.madvise(mmap.MADV_DONTNEED, 0, end)
+
+    def _first_index(self):
+        tail = self.tail
+        if not self._index_size or self._index_offsets[0] >= tail:
+            return 0
+        return int(numpy.searchsorted(self._index_offsets[:self._index_size], tail))
+
+    def _on_frame(self, offset, duration):
+        if self._time >= self._next_index_time:
+            if self._index_size == len(self._index_offsets):
+                self._compact_index()
+            self._index_offsets[self._index_size] = offset
+            self._index_times[self._index_size] = self._time
+            self._index_size += 1
+            self._next_index_time = self._time + self.index_interval
+        self._time += duration
+
+    def _compact_index(self):
+        # Drops the entries of overwritten data, or the oldest half if they're all still valid
+        first = self._first_index() or self._index_size // 2
+        size = self._index_size - first
+        self._index_offsets[:size] = self._index_offsets[first:self._index_size]
+        self._index_times[:size] = self._index_times[first:self._index_size]
+        self._index_size = size
+
+    def _write(self, source, data):
+        with self._cond:
+            # Data read from a source while it was being replaced is dropped
+            if self._closed or source is not self._source:
+                return
+            self._scanner.scan(data)
+            start = self._head % self.size
+            end = start + len(data)
+            if end <= self.size:
+                self._mmap[start:end] = data
+            else:
+                split = self.size - start
+                self._mmap[start:] = data[:split]
+                self._mmap[:end - self.size] = data[split:]
+            for position, title in source.pop_metadata():
+                # A title for data read before the source was attached applies from here on
+                self._titles.append((max(self._source_offset + position, self._head), title))
+            self._head += len(data)
+            while self._titles and len(self._titles) > 1 and self._titles[1][0] <= self.tail:
+                self._titles.popleft()
+            self._cond.notify_all()
+        if self._head - self._released >= TIMESHIFT_RELEASE_SIZE:
+            self.release(self._released, self._head)
+            self._released = self._head
+
+    def _pump(self):
+        log.debug('Timeshift pump started')
+        while not self._closed:
+            source = self._source
+            data = None
+            if source is not None:
+                try:
+                    data = source.read(self.chunk_size)
+                except StreamError as e:
+                    if not source.closed:
+                        log.debug(f'Timeshift source error: {e}')
+            if data:
+                self._write(source, bytes(data))
+                continue
+            # Waits for the supervisor to attach a new source after the connection is lost
+            with self._cond:
+                self._cond.wait_for(lambda: self._closed or self._source is not source, 1.0)
+        log.debug('Timeshift pump stopped')
+
+
+class TimeshiftReader(miniaudio.StreamableSource):
+
+    # Stream source for the decoder, reading the timeshift ring from a frame start. Byte and
+    # metadata positions count from the start of the reader, like those of a stream source.
+
+    def __init__(
+        self,
+        buffer,
+        offset,
+        stream_time,
+        prebuffer_size=STREAM_PREBUFFER_SIZE,
+        low_watermark=STREAM_LOW_WATERMARK,
+        read_timeout=READ_TIMEOUT,
+        **_kwargs
+    ):
+        super().__init__()
+        self.start_offset = offset
+        self.start_time = stream_time
+        self.bitrate = buffer.bitrate
+        self.bytes_read = 0
+        self._buffer = buffer
+        self._offset = offset
+        self._released = offset
+        self._title_offset = None
+        self._prebuffer_size = prebuffer_size
+        self._low_watermark = low_watermark
+        self._read_timeout = read_timeout
+        # Like a stream source, ready once prebuffer_size bytes were received from the start,
+        # and again after running low once prebuffer_size bytes are available
+        self._ready = False
+        self._prebuffer_offset = offset
+        self._closed = False
+
+    @property
+    def ready(self):
+        head = self._buffer.head
+        if self._ready and head - self._offset < self._low_watermark:
+            self._ready = False
+            self._prebuffer_offset = self._offset
+        elif not self._ready and head - self._prebuffer_offset >= self._prebuffer_size:
+            self._ready = True
+        return self._ready or self._closed
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def finished(self):
+        return self._closed or self._buffer.closed
+
+    def read(self, size):
+        if self.finished:
+            raise StreamError('Cannot read from a closed stream')
+        data, offset, stream_time = self._buffer.read(self, self._offset, size, self._read_timeout)
+        if offset != self._offset:
+            # Skipped data counts as read, so metadata positions stay valid, and the skipped
+            # time moves the start time, so start_time plus the time decoded is still the position
+            if self.bitrate:
+                self.start_time += stream_time - self._time_at(self._offset)
+            self.bytes_read += offset - self._offset
+            self._released = offset
+        self._offset = offset + len(data)
+        self.bytes_read += len(data)
+        if self._offset - self._released >= TIMESHIFT_RELEASE_SIZE:
+            self._buffer.release(self._released, self._offset)
+            self._released = self._offset
+        return data
+
+    def _time_at(self, offset):
+        return self.start_time + (offset - self.start_offset) * 8 / self.bitrate
+
+    def pop_metadata(self):
+        events = self._buffer.titles_between(self._title_offset, self._offset)
+        self._title_offset = self._offset
+        return [(max(offset - self.start_offset, 0), title) for offset, title in events]
+
+    def close(self):
+        self._closed = True
+        self._buffer.wake()
@@ -0,0 +1,199 @@
+import logging
+import socket
+import time
+import requests
+import requests.adapters
+from collections import deque, OrderedDict
+from threading import local, Lock
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from .constants import (
+    DNS_CACHE_SIZE,
+    DNS_CACHE_TIME,
+    HTTP_POOL_SIZE,
+    READ_TIMEOUT,
+    REQUEST_TIMEOUT,
+    SOCKET_RECEIVE_BUFFER_SIZE,
+    TRANSPORT_TIMINGS_SIZE,
+    USER_AGENT
+)
+
+
+log = logging.getLogger(__name__)
+
+
+class DNSCache:
+
+    def __init__(self, size=DNS_CACHE_SIZE, cache_time=DNS_CACHE_TIME):
+        self.size = size
+        self.cache_time = cache_time
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def resolve(self, host, port):
+        key = (host, port)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.monotonic() - entry[1] <= self.cache_time:
+                self._entries.move_to_end(key)
+                return entry[0]
+        address = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0][4][0]
+        with self._lock:
+            self._entries[key] = (address, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(False)
+        return address
+
+    def invalidate(self, host, port):
+        with self._lock:
+            self._entries.pop((host, port), None)
+
+
+class _TimedConnectionMixin:
+
+    # Set on the per-transport subclasses
+    transport = None
+
+    def _new_conn(self):
+        started = time.perf_counter()
+        host = self._dns_host
+        try:
+            address = self.transport.dns_cache.resolve(host, self.port)
+        except OSError:
+            # Let urllib3 resolve the name and raise the appropriate error
+            address = host
+        resolved = time.perf_counter()
+        # Connect to the cached address, but keep the host name for TLS and headers
+        self._dns_host = address
+        try:
+            sock = super()._new_conn()
+        except Exception:
+            self.transport.dns_cache.invalidate(host, self.port)
+            raise
+        finally:
+            self._dns_host = host
+        self.transport._record_connect(dns=resolved - started, connect=time.perf_counter() - resolved)
+        return sock
+
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        self.transport._record_connect(total=time.perf_counter() - started)
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _TransportAdapter(requests.adapters.HTTPAdapter):
+
+    def __init__(self, pool_classes, socket_options, *args, **kwargs):
+        self._pool_classes = pool_classes
+        self._socket_options = socket_options
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs.setdefault('socket_options', self._socket_options)
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = self._pool_classes
+
+
+class HTTPTransport:
+
+    def __init__(
+        self,
+        connect_timeout=REQUEST_TIMEOUT,
+        read_timeout=READ_TIMEOUT,
+        receive_buffer_size=SOCKET_RECEIVE_BUFFER_SIZE,
+        pool_size=HTTP_POOL_SIZE
+    ):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.receive_buffer_size = receive_buffer_size
+        self.dns_cache = DNSCache()
+        self.timings = deque(maxlen=TRANSPORT_TIMINGS_SIZE)
+        self._connect_timings = local()
+
+        http_connection = type('HTTPConnection', (_TimedHTTPConnection,), {'transport': self})
+        https_connection = type('HTTPSConnection', (_TimedHTTPSConnection,), {'transport': self})
+        pool_classes = {
+            'http': type('HTTPConnectionPool', (HTTPConnectionPool,), {'ConnectionCls': http_connection}),
+            'https': type('HTTPSConnectionPool', (HTTPSConnectionPool,), {'ConnectionCls': https_connection})
+        }
+        socket_options = list(HTTPConnection.default_socket_options)
+        if receive_buffer_size:
+            socket_options.append((socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer_size))
+        adapter = _TransportAdapter(
+            pool_classes,
+            socket_options,
+            pool_connections=pool_size,
+            pool_maxsize=pool_size
+        )
+        self._session = requests.Session()
+        self._session.headers['User-Agent'] = USER_AGENT
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def get(self, url, timeout=None, read_timeout=None, **kwargs):
+        return self.request('GET', url, timeout, read_timeout, **kwargs)
+
+    def request(self, method, url, timeout=None, read_timeout=None, **kwargs):
+        timeouts = (
+            timeout if timeout is not None else self.connect_timeout,
+            read_timeout if read_timeout is not None else self.read_timeout
+        )
+        self._connect_timings.value = {}
+        started = time.perf_counter()
+        try:
+            response = self._session.request(method, url, timeout=timeouts, **kwargs)
+        finally:
+            connect_timings = self._connect_timings.value
+        # Time until the response headers were received
+        first_byte = time.perf_counter() - started
+        tcp_time = connect_timings.get('connect')
+        total_time = connect_timings.get('total')
+        timings = {
+            'url': url,
+            'reused': not connect_timings,
+            'dns': connect_timings.get('dns'),
+            'connect': tcp_time,
+            'tls': total_time - tcp_time if url.startswith('https') and total_time and tcp_time else None,
+            'first_byte': first_byte
+        }
+        self.timings.append(timings)
+        log.debug(f'Request timings: {timings}')
+        return response
+
+    def close(self):
+        self._session.close()
+
+    def _record_connect(self, **timings):
+        connect_timings = getattr(self._connect_timings, 'value', None)
+        if connect_timings is not None:
+            connect_timings.update(timings)
+
+
+_transport = None
+_transport_lock = Lock()
+
+
+def get_transport():
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = HTTPTransport()
+        return _transport
+
+
+def set_transport(transport):
+    global _transport
+    with _transport_lock:
+        if _transport is not None and _transport is not transport:
+            _transport.close()
+        _transport = transport
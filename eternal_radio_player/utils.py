@@ -1,8 +1,6 @@
 import logging
 import platform
 import traceback
-import miniaudio
-import sounddevice
 
 from ._version import __version__
 from .exceptions import ResourceError
@@ -30,19 +28,35 @@ def python_version():
     return f'{platform.python_implementation()} {platform.python_version()} [{platform.python_compiler()}]'
 
 
+# The audio libraries are imported on first use, importing sounddevice initializes PortAudio and
+# fails without it, which is fine for the output sinks that don't use a device
+
+
 def miniaudio_version():
+    import miniaudio
+
     return miniaudio.__version__
 
 
 def miniaudio_backend_version():
+    import miniaudio
+
     return miniaudio.lib_version()
 
 
 def sounddevice_version():
+    try:
+        import sounddevice
+    except OSError:
+        return None
     return sounddevice.__version__
 
 
 def sounddevice_backend_version():
+    try:
+        import sounddevice
+    except OSError:
+        return None
     return sounddevice.get_portaudio_version()[1]
 
 
@@ -0,0 +1,289 @@
+import asyncio
+import json
+import unittest
+
+from eternal_radio_player.aio import AsyncRecentSongsCache, AsyncStreamSource, async_stream_request, http_get
+from eternal_radio_player.exceptions import PlayerError, StreamError
+
+
+RECENT_SONGS = {'items': [{'title': 'Artist - Title [1234]', 'date': '1000'}]}
+
+
+class LocalServer:
+
+    # Serves canned responses by path on a local port and records the request headers
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+        self._server = None
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._server.close()
+        await self._server.wait_closed()
+
+    def url(self, path):
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f'http://{host}:{port}{path}'
+
+    async def _handle(self, reader, writer):
+        request_line = (await reader.readline()).decode('latin-1')
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').rstrip('\r\n')
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        path = request_line.split(' ')[1]
+        self.requests.append((path, headers))
+        response = self.responses[path]
+        if callable(response):
+            response = response(headers)
+        writer.write(response)
+        await writer.drain()
+        writer.close()
+
+
+def response(status, headers=(), body=b''):
+    head = f'{status}\r\n' + ''.join(f'{name}: {value}\r\n' for name, value in headers)
+    return head.encode('latin-1') + b'\r\n' + body
+
+
+def chunked(*chunks):
+    return b''.join(b'%x\r\n%s\r\n' % (len(chunk), chunk) for chunk in chunks) + b'0\r\n\r\n'
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, 5.0))
+
+
+class AsyncHTTPTest(unittest.TestCase):
+
+    def test_content_length_body(self):
+        async def test():
+            async with LocalServer({'/': response('HTTP/1.1 200 OK', [('Content-Length', 5)], b'hello')}) as server:
+                response_ = await http_get(server.url('/'))
+                self.assertEqual(response_.status_code, 200)
+                self.assertEqual(await response_.read(), b'hello')
+                response_.close()
+        run(test())
+
+    def test_chunked_body(self):
+        body = chunked(b'hello ', b'chunked ', b'world')
+        headers = [('Transfer-Encoding', 'chunked')]
+        async def test():
+            async with LocalServer({'/': response('HTTP/1.1 200 OK', headers, body)}) as server:
+                response_ = await http_get(server.url('/'))
+                self.assertEqual(await response_.read(), b'hello chunked world')
+                # Reads after the last chunk return nothing
+                self.assertEqual(await response_.read_chunk(1024), b'')
+                response_.close()
+        run(test())
+
+    def test_chunked_body_small_reads(self):
+        body = chunked(b'0123456789', b'abcdef')
+        headers = [('Transfer-Encoding', 'chunked')]
+        async def test():
+            async with LocalServer({'/': response('HTTP/1.1 200 OK', headers, body)}) as server:
+                response_ = await http_get(server.url('/'))
+                data = []
+                while True:
+                    chunk = await response_.read_chunk(4)
+                    if not chunk:
+                        break
+                    self.assertLessEqual(len(chunk), 4)
+                    data.append(chunk)
+                self.assertEqual(b''.join(data), b'0123456789abcdef')
+                response_.close()
+        run(test())
+
+    def test_invalid_chunk_size(self):
+        headers = [('Transfer-Encoding', 'chunked')]
+        async def test():
+            async with LocalServer({'/': response('HTTP/1.1 200 OK', headers, b'zz\r\ndata')}) as server:
+                response_ = await http_get(server.url('/'))
+                with self.assertRaises(StreamError):
+                    await response_.read()
+                response_.close()
+        run(test())
+
+    def test_redirect(self):
+        async def test():
+            async with LocalServer({
+                '/old': response('HTTP/1.1 302 Found', [('Location', '/new'), ('Content-Length', 0)]),
+                '/new': response('HTTP/1.1 200 OK', [('Content-Length', 3)], b'new')
+            }) as server:
+                response_ = await http_get(server.url('/old'))
+                self.assertEqual(response_.status_code, 200)
+                self.assertEqual(response_.url, server.url('/new'))
+                self.assertEqual(await response_.read(), b'new')
+                response_.close()
+                self.assertEqual([path for path, _headers in server.requests], ['/old', '/new'])
+        run(test())
+
+    def test_redirect_loop(self):
+        async def test():
+            async with LocalServer({'/': response('HTTP/1.1 301 Moved', [('Location', '/')])}) as server:
+                with self.assertRaises(StreamError):
+                    await http_get(server.url('/'))
+        run(test())
+
+    def test_icy_status_line(self):
+        headers = [('Content-Type', 'audio/mpeg'), ('icy-metaint', 16000), ('icy-sr', 44100)]
+        async def test():
+            async with LocalServer({'/': response('ICY 200 OK', headers, b'audio')}) as server:
+                response_, encoding, sample_rate = await async_stream_request(server.url('/'))
+                self.assertEqual(response_.status_code, 200)
+                self.assertEqual(encoding.name, 'MP3')
+                self.assertEqual(sample_rate, 44100)
+                # Headers are case-insensitive
+                self.assertEqual(response_.headers['Icy-MetaInt'], '16000')
+                self.assertEqual(await response_.read(), b'audio')
+                response_.close()
+                self.assertEqual(server.requests[0][1]['icy-metadata'], '1')
+        run(test())
+
+    def test_invalid_status_line(self):
+        async def test():
+            async with LocalServer({'/': b'SPAM\r\n\r\n'}) as server:
+                with self.assertRaises(StreamError):
+                    await http_get(server.url('/'))
+        run(test())
+
+    def test_error_status(self):
+        async def test():
+            async with LocalServer({'/': response('HTTP/1.1 404 Not Found', [('Content-Length', 0)])}) as server:
+                with self.assertRaises(StreamError):
+                    await async_stream_request(server.url('/'))
+        run(test())
+
+    def test_early_eof_content_length(self):
+        async def test():
+            async with LocalServer({'/': response('HTTP/1.1 200 OK', [('Content-Length', 10)], b'short')}) as server:
+                response_ = await http_get(server.url('/'))
+                with self.assertRaises(StreamError):
+                    await response_.read()
+                response_.close()
+        run(test())
+
+    def test_early_eof_chunked(self):
+        headers = [('Transfer-Encoding', 'chunked')]
+        async def test():
+            async with LocalServer({'/': response('HTTP/1.1 200 OK', headers, b'10\r\nshort')}) as server:
+                response_ = await http_get(server.url('/'))
+                with self.assertRaises(StreamError):
+                    await response_.read()
+                response_.close()
+        run(test())
+
+    def test_body_until_close(self):
+        async def test():
+            async with LocalServer({'/': response('HTTP/1.0 200 OK', (), b'until close')}) as server:
+                response_ = await http_get(server.url('/'))
+                self.assertEqual(await response_.read(), b'until close')
+                response_.close()
+        run(test())
+
+
+class AsyncStreamSourceTest(unittest.TestCase):
+
+    def test_icy_metadata(self):
+        metaint = 8
+        metadata = b"StreamTitle='Song';"
+        metadata += b'\0' * (-len(metadata) % 16)
+        body = b'a' * metaint + bytes((len(metadata) // 16,)) + metadata + b'b' * metaint
+        headers = [('Content-Type', 'audio/mpeg'), ('icy-metaint', metaint)]
+        async def test():
+            async with LocalServer({'/': response('ICY 200 OK', headers, body)}) as server:
+                response_, _encoding, _sample_rate = await async_stream_request(server.url('/'))
+                source = AsyncStreamSource(response_, prebuffer_size=1, low_watermark=1)
+                while not source.finished:
+                    await asyncio.sleep(0.01)
+                self.assertEqual(bytes(source.read(64)) + bytes(source.read(64)), b'a' * metaint + b'b' * metaint)
+                self.assertEqual(source.pop_metadata(), [(metaint, 'Song')])
+                self.assertEqual(source.read(64), b'')
+                source.close()
+        run(test())
+
+    def test_early_eof(self):
+        headers = [('Content-Type', 'audio/mpeg'), ('Content-Length', 100)]
+        async def test():
+            async with LocalServer({'/': response('HTTP/1.1 200 OK', headers, b'audio')}) as server:
+                response_, _encoding, _sample_rate = await async_stream_request(server.url('/'))
+                source = AsyncStreamSource(response_, prebuffer_size=1, low_watermark=1)
+                while not source.finished:
+                    await asyncio.sleep(0.01)
+                self.assertEqual(bytes(source.read(64)), b'audio')
+                with self.assertRaises(StreamError):
+                    source.read(64)
+                source.close()
+        run(test())
+
+
+class AsyncRecentSongsCacheTest(unittest.TestCase):
+
+    def test_conditional_request(self):
+        def recent_songs(headers):
+            if headers.get('if-none-match') == '"v1"':
+                return response('HTTP/1.1 304 Not Modified', [('ETag', '"v1"')])
+            body = json.dumps(RECENT_SONGS).encode()
+            return response('HTTP/1.1 200 OK', [('ETag', '"v1"'), ('Content-Length', len(body))], body)
+        async def test():
+            async with LocalServer({'/': recent_songs}) as server:
+                cache = AsyncRecentSongsCache(server.url('/'), cache_time=0.0, stale_time=0.0)
+                first = await cache.get(1.0)
+                self.assertEqual(first[0]['title'], 'Artist - Title')
+                self.assertIs(await cache.get(1.0), first)
+                self.assertEqual(server.requests[1][1]['if-none-match'], '"v1"')
+                self.assertEqual(cache.stats(), {'hits': 0, 'stale_hits': 0, 'misses': 2, 'errors': 0})
+        run(test())
+
+    def test_single_flight(self):
+        body = json.dumps(RECENT_SONGS).encode()
+        async def test():
+            async with LocalServer({'/': response('HTTP/1.1 200 OK', [('Content-Length', len(body))], body)}) as server:
+                cache = AsyncRecentSongsCache(server.url('/'))
+                results = await asyncio.gather(*(cache.get(1.0) for _ in range(5)))
+                self.assertEqual(len(server.requests), 1)
+                self.assertTrue(all(result is results[0] for result in results))
+                self.assertEqual(cache.stats()['misses'], 5)
+        run(test())
+
+    def test_stale_while_revalidate(self):
+        body = json.dumps(RECENT_SONGS).encode()
+        async def test():
+            async with LocalServer({'/': response('HTTP/1.1 200 OK', [('Content-Length', len(body))], body)}) as server:
+                cache = AsyncRecentSongsCache(server.url('/'), cache_time=0.0, stale_time=60.0)
+                first = await cache.get(1.0)
+                # The stale list is returned right away and refreshed in the background
+                self.assertIs(await cache.get(1.0), first)
+                self.assertEqual(cache.stats()['stale_hits'], 1)
+                while cache._task is not None:
+                    await asyncio.sleep(0.01)
+                self.assertEqual(len(server.requests), 2)
+                # max_age skips the stale list and waits for the fetch
+                await cache.get(1.0, max_age=0)
+                self.assertEqual(len(server.requests), 3)
+        run(test())
+
+    def test_negative_caching(self):
+        async def test():
+            async with LocalServer({'/': response('HTTP/1.1 200 OK', [('Content-Length', 4)], b'spam')}) as server:
+                cache = AsyncRecentSongsCache(server.url('/'), error_backoff_min=60.0)
+                with self.assertRaises(PlayerError):
+                    await cache.get(1.0)
+                # The error is served from the cache during the backoff, without another request
+                with self.assertRaises(PlayerError):
+                    await cache.get(1.0)
+                self.assertEqual(len(server.requests), 1)
+                self.assertEqual(cache.stats()['errors'], 1)
+        run(test())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import tracemalloc
+import unittest
+import numpy
+from types import SimpleNamespace
+
+from eternal_radio_player.buffers import SampleRingBuffer
+from eternal_radio_player.dsp import Crossfade, GainRamp
+from eternal_radio_player.player import RadioPlayer
+
+
+BLOCKSIZE = 1024
+CHANNELS = 2
+WARMUP_BLOCKS = 10
+MEASURED_BLOCKS = 400
+# Allows for the few objects created by the measurement itself
+MAX_NET_ALLOCATION = 128
+
+
+def filled_ring_buffer(frames, dtype):
+    ring = SampleRingBuffer(frames, CHANNELS, dtype)
+    samples = numpy.random.default_rng(1).uniform(-1.0, 1.0, (frames, CHANNELS))
+    if dtype == 'int16':
+        samples *= 32767
+    ring.write(samples.astype(dtype))
+    return ring
+
+
+class CallbackAllocationTest(unittest.TestCase):
+
+    # Runs RadioPlayer._stream_callback against filled ring buffers under tracemalloc and checks
+    # that the blocks allocate nothing, including blocks where the volume changes
+
+    def measure(self, dtype, splice=False):
+        total_blocks = WARMUP_BLOCKS + MEASURED_BLOCKS
+        player = SimpleNamespace(
+            _decoder=SimpleNamespace(buffer=filled_ring_buffer(total_blocks * BLOCKSIZE, dtype), finished=False),
+            _next_decoder=None,
+            _gain_ramp=GainRamp(BLOCKSIZE, CHANNELS, dtype),
+            _crossfade=Crossfade(BLOCKSIZE, CHANNELS, dtype),
+            _seek_splice=False,
+            _silence_frames=0,
+            _min_fill=None,
+            _abort=False,
+            _volume=1.0,
+            reconnect_attempts=0,
+            underflow_count=0
+        )
+        output = numpy.empty((BLOCKSIZE, CHANNELS), dtype)
+        volumes = [(i % 10) / 10 for i in range(total_blocks)]
+        # Splicing once during the warmup too fills the NumPy caches for the crossfade
+        splice_blocks = (WARMUP_BLOCKS // 2, WARMUP_BLOCKS + MEASURED_BLOCKS * 3 // 4) if splice else ()
+        next_decoders = [
+            SimpleNamespace(buffer=filled_ring_buffer(total_blocks * BLOCKSIZE, dtype), finished=False)
+            for _ in splice_blocks
+        ]
+
+        def callback(block):
+            # Change the volume every few blocks to exercise the ramp path
+            if block % 4 == 0:
+                player._volume = volumes[block]
+            if block in splice_blocks:
+                player._next_decoder = next_decoders[splice_blocks.index(block)]
+                player._seek_splice = True
+            RadioPlayer._stream_callback(player, output, BLOCKSIZE, None, None)
+
+        for block in range(WARMUP_BLOCKS):
+            callback(block)
+        # Net allocation is measured between the two halves of the run, so the constant overhead
+        # of starting the trace doesn't show up as a per-block allocation
+        half_block = WARMUP_BLOCKS + MEASURED_BLOCKS // 2
+        tracemalloc.start()
+        try:
+            for block in range(WARMUP_BLOCKS, half_block):
+                callback(block)
+            before, _peak = tracemalloc.get_traced_memory()
+            for block in range(half_block, total_blocks):
+                callback(block)
+            after, _peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        if splice:
+            self.assertIs(player._decoder, next_decoders[-1])
+        return after - before
+
+    def test_float32(self):
+        self.assertLessEqual(self.measure('float32'), MAX_NET_ALLOCATION)
+
+    def test_int16(self):
+        self.assertLessEqual(self.measure('int16'), MAX_NET_ALLOCATION)
+
+    def test_crossfade(self):
+        for dtype in ('float32', 'int16'):
+            with self.subTest(dtype=dtype):
+                self.assertLessEqual(self.measure(dtype, splice=True), MAX_NET_ALLOCATION)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import logging
+import queue
+import threading
+import time
+import unittest
+
+from eternal_radio_player.logging_ import DrainingQueueListener
+
+
+class BlockingHandler(logging.Handler):
+
+    def __init__(self):
+        super().__init__()
+        self.gate = threading.Event()
+        self.records = []
+
+    def emit(self, record):
+        self.gate.wait()
+        self.records.append(record)
+
+
+class DrainingQueueListenerTest(unittest.TestCase):
+
+    def fill(self, log_queue, listener):
+        listener.start()
+        # The listener takes the first record and blocks in the handler, the rest fill the queue
+        log_queue.put(logging.makeLogRecord({'msg': 'first'}))
+        while not log_queue.empty():
+            time.sleep(0.01)
+        while not log_queue.full():
+            log_queue.put_nowait(logging.makeLogRecord({'msg': 'queued'}))
+
+    def test_stop_with_full_queue(self):
+        log_queue = queue.Queue(10)
+        handler = BlockingHandler()
+        listener = DrainingQueueListener(log_queue, handler, stop_timeout=1.0)
+        self.fill(log_queue, listener)
+        threading.Timer(0.2, handler.gate.set).start()
+        listener.stop()
+        self.assertEqual(len(handler.records), 11)
+        self.assertEqual(listener.dropped, 0)
+
+    def test_stop_drops_record_for_sentinel(self):
+        log_queue = queue.Queue(10)
+        handler = BlockingHandler()
+        listener = DrainingQueueListener(log_queue, handler, stop_timeout=0.01)
+        self.fill(log_queue, listener)
+        stopper = threading.Thread(target=listener.stop)
+        stopper.start()
+        while not listener.dropped:
+            time.sleep(0.01)
+        handler.gate.set()
+        stopper.join(5.0)
+        self.assertFalse(stopper.is_alive())
+        self.assertEqual(len(handler.records), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+from eternal_radio_player.mp3 import MP3FrameScanner, parse_mp3_frame_header
+
+
+# MPEG-1 layer III, 128 kbps, 44100 Hz, no padding
+FRAME_HEADER = b'\xff\xfb\x90\x00'
+FRAME_LENGTH = 417
+
+
+def frames(count):
+    return (FRAME_HEADER + b'\0' * (FRAME_LENGTH - 4)) * count
+
+
+def scan(*chunks):
+    offsets = []
+    scanner = MP3FrameScanner(lambda offset, duration: offsets.append(offset))
+    for chunk in chunks:
+        scanner.scan(chunk)
+    return offsets
+
+
+class MP3FrameHeaderTest(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(parse_mp3_frame_header(FRAME_HEADER), (FRAME_LENGTH, 1152, 44100))
+
+    def test_invalid(self):
+        self.assertIsNone(parse_mp3_frame_header(b'\xff\x00\x00\xff'))
+        # Free format bitrate
+        self.assertIsNone(parse_mp3_frame_header(b'\xff\xfb\x00\x00'))
+
+
+class MP3FrameScannerTest(unittest.TestCase):
+
+    def test_single_chunk(self):
+        self.assertEqual(scan(frames(5)), [i * FRAME_LENGTH for i in range(5)])
+
+    def test_false_sync(self):
+        data = b'\xff\x00\x00' + frames(5)
+        self.assertEqual(scan(data), [3 + i * FRAME_LENGTH for i in range(5)])
+
+    def test_false_sync_split_chunks(self):
+        # The frames are found wherever the chunks split the false sync and the headers
+        data = b'\x00\xff\x00\x00' + frames(5)
+        expected = scan(data)
+        self.assertEqual(len(expected), 5)
+        for split in range(1, 2 * FRAME_LENGTH):
+            with self.subTest(split=split):
+                self.assertEqual(scan(data[:split], data[split:]), expected)
+
+    def test_byte_by_byte(self):
+        data = b'\xff\xff\x00' + frames(3)
+        self.assertEqual(scan(*(data[i:i + 1] for i in range(len(data)))), scan(data))